@@ -1,18 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import functools
+import hmac
 import json
 import os
 import requests
 from dotenv import load_dotenv
-from query import extract_and_transcribe
-from classify import classify_query
+from query import extract_and_transcribe, normalize_video_url
+from classify import (
+    classification_stages, build_classification_result, normalize_query_text, report_stage_progress,
+    report_classification_result
+)
+from option_table import lookup_option
+from pipeline import run_pipeline
+from singleflight import inflight
+from idempotency import idempotency_store, payload_fingerprint, replayable, IdempotencyConflict
+from metrics import render_metrics, observe_queue_wait, request_timing, record_request_info
+from profiler import profiler, PROFILER_INTERVAL_MS
+from memory import MemoryBudgetExceeded
+from progress import reporting, report, sse_event, SSE_HEARTBEAT_SECONDS, SSE_HEARTBEAT
 from request_priority import set_priority
+from priority_engine import request_rank
 from generate_priority import generate_priority
 from generate_ticket import generate_ticket
 from roles import classify_role  # Importing role classification logic
+import contextvars
 import queue
 import threading
 import time
-from feedback import analyze_feedback
+from feedback import analyze_feedback, analyze_feedback_batch, validate_batch
+from feedback_stats import get_feedback_stats, ENTITY_KINDS
+from ticket_store import get_ticket_store, parse_time, FILTER_FIELDS
+from outbox import DEMO_SERVER_URL
+from rollups import get_ticket_rollups, DIMENSIONS
 
 
 # Load environment variables
@@ -29,27 +48,20 @@ worker_thread = None
 def index():
     return "Hello Tanmay! Please host the web backend as soon as possible, message from Harish. Fintech Project, This is hosted AI/ML backend"
 
-DEMO_SERVER_URL = os.environ.get("DEMO_SERVER_URL", "http://localhost:3000")
 request_queue = queue.PriorityQueue()
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 30))
 processing_active = True
 
 def determine_request_priority(data):
-    cibil_score = data.get('cibil_score', 0)
-    holdings = data.get('holdings', 0)
-    annual_income = data.get('annual_income', 0)
-    query_level = data.get('query_level', 'branch')
-    
-    if query_level == 'central' or cibil_score >= 800 or holdings >= 1000000 or annual_income >= 1000000:
-        return 1
-    elif cibil_score >= 700 or holdings >= 500000 or annual_income >= 500000:
-        return 2
-    return 3
+    """Queue priority of a request (1 is served first), from the rules in priority_engine.REQUEST_RULES."""
+    return request_rank(data)
 
 def process_request_worker():
     with app.app_context():
         while processing_active:
             try:
                 priority, timestamp, data, response_callback = request_queue.get(timeout=1)
+                observe_queue_wait("request", time.time() - timestamp)
                 app.logger.info(f"Processing request with priority {priority}, query_id: {data.get('query_id')}")
 
                 try:
@@ -71,17 +83,20 @@ def process_query_internal(data):
         classification_result = {}
         has_error = False
         error_message = ""
+        report("accepted", {"query_id": query_id, "query_type": query_type})
 
         if query_type == 'text':
             query_text = data.get('user_input', '')
-            classification_result = classify_query(query_text)
         elif query_type == 'video':
             video_url = data.get('video_url', '')
             if not video_url:
                 return {"success": False, "message": "Provide video link too"}
             try:
-                query_text = extract_and_transcribe(video_url)
-                classification_result = classify_query(query_text)
+                # Identical in-flight videos share one download and transcription
+                query_text = inflight.do(("video", normalize_video_url(video_url)), extract_and_transcribe, video_url)
+                report("transcript", {"text": query_text})
+            except MemoryBudgetExceeded:
+                raise
             except Exception as e:
                 error_message = str(e)
                 query_text = f"Error in transcription: {error_message}"
@@ -92,51 +107,131 @@ def process_query_internal(data):
                 }
         elif query_type == 'predefined_option':
             query_text = data.get('predefined_option', '')
-            classification_result = classify_query(query_text)
+            # Menu options are classified ahead of time; only options missing from the table reach the LLM
+            precomputed = lookup_option(query_text)
+            if precomputed is not None:
+                classification_result = precomputed
         else:
             return {"success": False, "message": "Invalid query type"}
 
-        priority_result = generate_priority(
-            data.get('cibil_score'),
-            data.get('holdings'),
-            data.get('annual_income'),
-            data.get('loans'),
-            query_text
-        )
-
-        # Classifying Role
-        role_data = classify_role(classification_result.get('department', ''), query_type)
-
-        ticket = generate_ticket(
-            # query_id=query_id,
-            # query_type=query_type,
-            # branch_id=data.get('branch_id'),
-            # query_level=data.get('query_level'),
-            # department=classification_result.get('department', ''),
-            # service_type=classification_result.get('service_type', ''),
-            # request_category=classification_result.get('request_category', ''),
-            transcribed_text=query_text,
-            translated_query=classification_result.get('translated_query', ''),
-            detected_language=classification_result.get('detected_language', ''),
-            # priority=priority_result.get('priority', ''),
-            success=not has_error,
-            error_message=error_message if has_error else None,
-            # role_name=role_data["role_name"],
-            # role_level=role_data["role_level"],
-            # branch_level=role_data["branch_level"]
-        )
-
-        # ticket["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%S") + f".{int(time.time() % 1 * 1000000):06d}"
-        # ticket["last_updated_at"] = ticket["created_at"]
-
-        response_payload = {
-            # "message": "Received ticket",
-            "ticket": ticket
-        }
-        return response_payload
+        needs_classification = not has_error and not classification_result
+
+        # Identical in-flight queries share one classification; priority is per customer
+        # and is computed while the classification is running
+        if needs_classification:
+            classification = inflight.submit(
+                ("text", normalize_query_text(query_text)),
+                run_pipeline,
+                classification_stages(query_text),
+                None,
+                report_stage_progress
+            )
+
+        priority_result = generate_priority(*priority_args(data, query_text))
+        report("priority", {"priority": priority_result.get("priority", "")})
+
+        if needs_classification:
+            run = classification.result()
+            app.logger.info(f"Pipeline for query_id {query_id}: {run.summary()}")
+            record_request_info("critical_path", run.summary())
+            classification_result = build_classification_result(query_text, run.results)
+        if not has_error:
+            # Covers table hits and requests that attached to another request's classification
+            report_classification_result(classification_result)
+
+        return build_query_response(data, query_text, classification_result, priority_result, has_error, error_message)
+    except MemoryBudgetExceeded:
+        raise
     except Exception as e:
         return {"success": False, "message": str(e)}
 
+def process_query_once(data, query_id, fingerprint):
+    """process_query_internal, shared by identical requests for the same query_id that are in flight together."""
+    if not query_id:
+        return process_query_internal(data)
+    return inflight.do_inline(("query_id", query_id, fingerprint), process_query_internal, data)
+
+def priority_args(data, query_text):
+    """Arguments for generate_priority taken from the request."""
+    return (
+        data.get('cibil_score'),
+        data.get('holdings'),
+        data.get('annual_income'),
+        data.get('loans'),
+        query_text
+    )
+
+def build_query_response(data, query_text, classification_result, priority_result, has_error, error_message):
+    """Build the ticket response from the results of the query pipeline."""
+    query_type = data.get('query_type')
+
+    # Classifying Role
+    role_data = classify_role(classification_result.get('department', ''), query_type)
+
+    ticket = generate_ticket(
+        # query_id=query_id,
+        # query_type=query_type,
+        # branch_id=data.get('branch_id'),
+        # query_level=data.get('query_level'),
+        # department=classification_result.get('department', ''),
+        # service_type=classification_result.get('service_type', ''),
+        # request_category=classification_result.get('request_category', ''),
+        transcribed_text=query_text,
+        translated_query=classification_result.get('translated_query', ''),
+        detected_language=classification_result.get('detected_language', ''),
+        # priority=priority_result.get('priority', ''),
+        success=not has_error,
+        error_message=error_message if has_error else None,
+        # role_name=role_data["role_name"],
+        # role_level=role_data["role_level"],
+        # branch_level=role_data["branch_level"]
+    )
+
+    # ticket["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%S") + f".{int(time.time() % 1 * 1000000):06d}"
+    # ticket["last_updated_at"] = ticket["created_at"]
+
+    persist_ticket(ticket_record(data, classification_result, priority_result, role_data, ticket))
+
+    response_payload = {
+        # "message": "Received ticket",
+        "ticket": ticket
+    }
+    return response_payload
+
+def ticket_record(data, classification_result, priority_result, role_data, ticket):
+    """The full ticket kept in the ticket store; the response carries only the reduced ticket."""
+    return {
+        **ticket,
+        "query_id": data.get('query_id'),
+        "query_type": data.get('query_type'),
+        "branch_id": data.get('branch_id'),
+        "query_level": data.get('query_level'),
+        "department": classification_result.get('department', ''),
+        "service_type": classification_result.get('service_type', ''),
+        "request_category": classification_result.get('request_category', ''),
+        "priority": priority_result.get('priority', ''),
+        "role_name": role_data.get("role_name"),
+        "role_level": role_data.get("role_level"),
+        "branch_level": role_data.get("branch_level"),
+        "success": "error_message" not in ticket,
+        # Lets a retry of the query_id on any worker be replayed from the ticket store
+        "request_fingerprint": payload_fingerprint(data)
+    }
+
+def persist_ticket(record):
+    """Queue the ticket for the next group commit and count it in the rollups; neither can fail the request."""
+    record.setdefault("created_at", time.time())
+    try:
+        store = get_ticket_store()
+        if store is not None:
+            store.append(record)
+    except Exception as e:
+        app.logger.error(f"Error persisting ticket: {str(e)}")
+    try:
+        get_ticket_rollups().record(record)
+    except Exception as e:
+        app.logger.error(f"Error counting ticket: {str(e)}")
+
 # @app.route('/process_query', methods=['POST'])
 # def process_query():
 #     try:
@@ -163,27 +258,137 @@ def process_query_internal(data):
 #     except Exception as e:
 #         return jsonify({"success": False, "message": str(e)})
 
+def debug_requested(data):
+    """Whether the client asked for the debug field, via ?debug=1 or "debug": true in the body."""
+    if str(request.args.get('debug', '')).lower() in ('1', 'true'):
+        return True
+    return isinstance(data, dict) and data.get('debug') is True
+
+def timed_route(view):
+    """Add a Server-Timing header with per-stage durations to the view's response, and a debug field on request."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with request_timing() as timing, profiler.profile_request():
+            response = app.make_response(view(*args, **kwargs))
+
+        if response.is_json and debug_requested(request.get_json(silent=True)):
+            payload = response.get_json()
+            if isinstance(payload, dict):
+                payload["debug"] = timing.debug()
+                response.set_data(app.json.dumps(payload))
+        response.headers["Server-Timing"] = timing.server_timing()
+        return response
+    return wrapper
+
 @app.route('/process_query', methods=['POST'])
+@timed_route
 def process_query():
     try:
         data = request.get_json()
         if not data:
             return jsonify({"success": False, "message": "Invalid JSON format"}), 400
 
+        # Retries of a query_id get the stored ticket back instead of rerunning the pipeline
+        query_id = data.get('query_id')
+        fingerprint = payload_fingerprint(data)
+        if query_id:
+            try:
+                stored = idempotency_store.lookup(query_id, fingerprint)
+            except IdempotencyConflict as e:
+                return jsonify({"success": False, "message": str(e)}), 409
+            if stored is not None:
+                app.logger.info(f"Replaying stored result for query_id: {query_id}")
+                return jsonify(stored)
+
         # Determine priority (still useful for logging or optional sorting)
         priority = determine_request_priority(data)
-        app.logger.info(f"Processing synchronous request with priority {priority}, query_id: {data.get('query_id')}")
-
-        # Direct call to internal logic — no queue or threading
-        result = process_query_internal(data)
+        app.logger.info(f"Processing synchronous request with priority {priority}, query_id: {query_id}")
+
+        # Direct call to internal logic — no queue or threading; concurrent retries of a query_id share the run
+        try:
+            result = process_query_once(data, query_id, fingerprint)
+        except MemoryBudgetExceeded as e:
+            app.logger.warning(f"Refusing query_id {query_id}: {str(e)}")
+            return jsonify({"success": False, "message": str(e)}), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+        if query_id and replayable(result):
+            idempotency_store.store(query_id, fingerprint, result)
         return jsonify(result)
 
     except Exception as e:
         app.logger.error(f"Exception in /process_query: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/process_query/stream', methods=['POST'])
+def process_query_stream():
+    """
+    Process a query like /process_query, streaming its progress as Server-Sent Events.
+
+    Events are sent as each step finishes (accepted, download, downloaded, audio_extracted,
+    transcript, language, translation, classification, priority) and the stream ends with a
+    `ticket` event carrying the /process_query response, or an `error` event.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "Invalid JSON format"}), 400
+
+    query_id = data.get('query_id')
+    fingerprint = payload_fingerprint(data)
+    if query_id:
+        try:
+            stored = idempotency_store.lookup(query_id, fingerprint)
+        except IdempotencyConflict as e:
+            return jsonify({"success": False, "message": str(e)}), 409
+        if stored is not None:
+            app.logger.info(f"Replaying stored result for query_id: {query_id}")
+            return sse_response([sse_event("ticket", stored)])
+
+    events = queue.Queue()
+
+    def run():
+        with reporting(lambda event, payload: events.put((event, payload))):
+            try:
+                result = process_query_once(data, query_id, fingerprint)
+                if result.get("success", True):
+                    if query_id:
+                        idempotency_store.store(query_id, fingerprint, result)
+                    events.put(("ticket", result))
+                else:
+                    events.put(("error", result))
+            except MemoryBudgetExceeded as e:
+                app.logger.warning(f"Refusing query_id {query_id}: {str(e)}")
+                events.put(("error", {"success": False, "message": str(e), "retry_after": RETRY_AFTER_SECONDS}))
+            except Exception as e:
+                app.logger.error(f"Exception in /process_query/stream: {str(e)}")
+                events.put(("error", {"success": False, "message": str(e)}))
+            finally:
+                events.put(None)
+
+    # The query runs on its own thread so that the response can stream while it is processed
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+
+    def stream():
+        while True:
+            try:
+                item = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield SSE_HEARTBEAT
+                continue
+            if item is None:
+                return
+            yield sse_event(*item)
+
+    return sse_response(stream())
+
+def sse_response(messages):
+    """Stream already formatted Server-Sent Events messages without buffering."""
+    return Response(messages, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 
 @app.route('/feedback', methods=['POST'])
+@timed_route
 def feedback_route():
     try:
         data = request.get_json()
@@ -196,10 +401,141 @@ def feedback_route():
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@app.route('/feedback/batch', methods=['POST'])
+@timed_route
+def feedback_batch_route():
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            return jsonify({"success": False, "message": "Invalid JSON"}), 400
+        try:
+            records, group_by = validate_batch(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+        return jsonify(analyze_feedback_batch(records, group_by))
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/feedback/stats/<kind>/<entity_id>', methods=['GET'])
+def feedback_stats_route(kind, entity_id):
+    if kind not in ENTITY_KINDS:
+        return jsonify({"success": False, "message": f"Unknown kind '{kind}'"}), 404
+    stats = get_feedback_stats().stats(kind, entity_id)
+    if stats is None:
+        return jsonify({"success": False, "message": f"No feedback recorded for {kind} {entity_id}"}), 404
+    return jsonify(stats)
+
+
+@app.route('/tickets', methods=['GET'])
+def tickets_route():
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    store = get_ticket_store()
+    if store is None:
+        return jsonify({"success": False, "message": "Ticket store is disabled"}), 404
+    try:
+        filters = {field: request.args[field] for field in FILTER_FIELDS if field in request.args}
+        tickets = store.find(
+            since=parse_time(request.args.get('since')),
+            until=parse_time(request.args.get('until')),
+            limit=min(int(request.args.get('limit', 100)), 1000),
+            **filters
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"tickets": tickets})
+
+
+@app.route('/tickets/export', methods=['GET'])
+def tickets_export_route():
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    store = get_ticket_store()
+    if store is None:
+        return jsonify({"success": False, "message": "Ticket store is disabled"}), 404
+    try:
+        filters = {field: request.args[field] for field in FILTER_FIELDS if field in request.args}
+        lines = store.export(parse_time(request.args.get('since')), parse_time(request.args.get('until')), **filters)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return Response(lines, mimetype="application/x-ndjson")
+
+
+@app.route('/tickets/stats/<dimension>', methods=['GET'])
+def ticket_stats_route(dimension):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    if dimension not in DIMENSIONS:
+        return jsonify({"success": False, "message": f"Unknown dimension '{dimension}'"}), 404
+    return jsonify({"dimension": dimension, "values": get_ticket_rollups().summary(dimension)})
+
+
+@app.route('/tickets/stats/<dimension>/<value>', methods=['GET'])
+def ticket_series_route(dimension, value):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    if dimension not in DIMENSIONS:
+        return jsonify({"success": False, "message": f"Unknown dimension '{dimension}'"}), 404
+    resolution = request.args.get('resolution', 'hour')
+    try:
+        series = get_ticket_rollups().series(
+            dimension, value, resolution=resolution, buckets=int(request.args.get('buckets', 24)))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"dimension": dimension, "value": value, "resolution": resolution, "series": series})
+
+
+@app.route('/tickets/<query_id>', methods=['GET'])
+def tickets_by_query_route(query_id):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    store = get_ticket_store()
+    tickets = store.by_query_id(query_id) if store is not None else []
+    if not tickets:
+        return jsonify({"success": False, "message": f"No ticket stored for query_id {query_id}"}), 404
+    return jsonify({"tickets": tickets})
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "running", "queue_size": request_queue.qsize()})
 
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    body, content_type = render_metrics()
+    return body, 200, {"Content-Type": content_type}
+
+
+def admin_authorized(token):
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set, and then require it in X-Admin-Token."""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    return bool(admin_token) and hmac.compare_digest(token or "", admin_token)
+
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def profiler_route():
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+
+    # Reaches only the worker that handles this call; the status names it by pid
+    try:
+        if request.method == 'GET':
+            return jsonify(profiler.status())
+
+        data = request.get_json(silent=True) or {}
+        if data.get('action', 'start') == 'stop':
+            return jsonify(profiler.stop())
+        return jsonify(profiler.start(
+            seconds=data.get('seconds', 30),
+            fraction=data.get('fraction', 1.0),
+            interval_ms=data.get('interval_ms', PROFILER_INTERVAL_MS)
+        ))
+    except (RuntimeError, ValueError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
 def cleanup():
     global processing_active, worker_thread
     processing_active = False
@@ -0,0 +1,422 @@
+"""
+Asyncio serving mode for the query service.
+
+Exposes the same /process_query, /process_query/stream, /feedback, /tickets and /health contract as the Flask app in
+app.py, but every request is a coroutine: Groq calls and video downloads use async HTTP, and the
+CPU-bound steps (ffmpeg, keyword matching) run in executors, so a single process can keep
+hundreds of requests in flight. Run it with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from app import index, determine_request_priority, priority_args, build_query_response, request_queue, admin_authorized, RETRY_AFTER_SECONDS
+from classify import (
+    classification_stages, build_classification_result, normalize_query_text, report_stage_progress,
+    report_classification_result
+)
+from option_table import lookup_option
+from generate_priority import generate_priority
+from pipeline import arun_pipeline
+from query import aextract_and_transcribe, normalize_video_url
+from singleflight import inflight
+from idempotency import idempotency_store, payload_fingerprint, replayable, IdempotencyConflict
+from feedback import aanalyze_feedback, aanalyze_feedback_batch, validate_batch
+from feedback_stats import get_feedback_stats, ENTITY_KINDS
+from ticket_store import get_ticket_store, parse_time, FILTER_FIELDS
+from rollups import get_ticket_rollups, DIMENSIONS
+from metrics import render_metrics, request_timing, record_request_info
+from profiler import profiler, PROFILER_INTERVAL_MS
+from memory import MemoryBudgetExceeded
+from progress import reporting, report, sse_event, SSE_HEARTBEAT_SECONDS, SSE_HEARTBEAT
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def aprocess_query_internal(data):
+    """Async variant of app.process_query_internal."""
+    try:
+        query_id = data.get('query_id')
+        query_type = data.get('query_type')
+        query_text = ""
+        classification_result = {}
+        has_error = False
+        error_message = ""
+        report("accepted", {"query_id": query_id, "query_type": query_type})
+
+        if query_type == 'text':
+            query_text = data.get('user_input', '')
+        elif query_type == 'video':
+            video_url = data.get('video_url', '')
+            if not video_url:
+                return {"success": False, "message": "Provide video link too"}
+            try:
+                query_text = await inflight.ado(("video", normalize_video_url(video_url)), aextract_and_transcribe, video_url)
+                report("transcript", {"text": query_text})
+            except MemoryBudgetExceeded:
+                raise
+            except Exception as e:
+                error_message = str(e)
+                query_text = f"Error in transcription: {error_message}"
+                has_error = True
+                classification_result = {
+                    "department": "", "service_type": "", "request_category": "",
+                    "detected_language": "en", "translated_query": ""
+                }
+        elif query_type == 'predefined_option':
+            query_text = data.get('predefined_option', '')
+            # Menu options are classified ahead of time; only options missing from the table reach the LLM
+            precomputed = lookup_option(query_text)
+            if precomputed is not None:
+                classification_result = precomputed
+        else:
+            return {"success": False, "message": "Invalid query type"}
+
+        # Copy the context so the executor thread records its timing against this request
+        priority = asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, generate_priority, *priority_args(data, query_text)
+        )
+
+        if not has_error and not classification_result:
+            run = await inflight.ado(
+                ("text", normalize_query_text(query_text)),
+                arun_pipeline,
+                classification_stages(query_text, asynchronous=True),
+                None,
+                report_stage_progress
+            )
+            logger.info(f"Pipeline for query_id {query_id}: {run.summary()}")
+            record_request_info("critical_path", run.summary())
+            classification_result = build_classification_result(query_text, run.results)
+        if not has_error:
+            report_classification_result(classification_result)
+
+        priority_result = await priority
+        report("priority", {"priority": priority_result.get("priority", "")})
+
+        return build_query_response(data, query_text, classification_result, priority_result, has_error, error_message)
+    except MemoryBudgetExceeded:
+        raise
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
+
+async def aprocess_query_once(data, query_id, fingerprint):
+    """Async variant of app.process_query_once."""
+    if not query_id:
+        return await aprocess_query_internal(data)
+    return await inflight.ado(("query_id", query_id, fingerprint), aprocess_query_internal, data)
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def timed_route(endpoint):
+    """Add a Server-Timing header with per-stage durations to the endpoint's response, and a debug field on request."""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        with request_timing() as timing, profiler.profile_request():
+            response = await endpoint(request)
+
+        data = await _json_body(request)
+        debug = request.query_params.get('debug', '').lower() in ('1', 'true') or (
+            isinstance(data, dict) and data.get('debug') is True
+        )
+        if debug and isinstance(response, JSONResponse):
+            payload = json.loads(response.body)
+            if isinstance(payload, dict):
+                payload["debug"] = timing.debug()
+                response = JSONResponse(payload, status_code=response.status_code)
+        response.headers["Server-Timing"] = timing.server_timing()
+        return response
+    return wrapper
+
+
+async def root(request):
+    return PlainTextResponse(index())
+
+
+@timed_route
+async def process_query(request):
+    try:
+        data = await _json_body(request)
+        if not data:
+            return JSONResponse({"success": False, "message": "Invalid JSON format"}, status_code=400)
+
+        # Retries of a query_id get the stored ticket back instead of rerunning the pipeline
+        query_id = data.get('query_id')
+        fingerprint = payload_fingerprint(data)
+        if query_id:
+            try:
+                stored = await asyncio.get_running_loop().run_in_executor(
+                    None, idempotency_store.lookup, query_id, fingerprint)
+            except IdempotencyConflict as e:
+                return JSONResponse({"success": False, "message": str(e)}, status_code=409)
+            if stored is not None:
+                logger.info(f"Replaying stored result for query_id: {query_id}")
+                return JSONResponse(stored)
+
+        priority = determine_request_priority(data)
+        logger.info(f"Processing async request with priority {priority}, query_id: {query_id}")
+
+        try:
+            result = await aprocess_query_once(data, query_id, fingerprint)
+        except MemoryBudgetExceeded as e:
+            logger.warning(f"Refusing query_id {query_id}: {str(e)}")
+            return JSONResponse(
+                {"success": False, "message": str(e)}, status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        if query_id and replayable(result):
+            idempotency_store.store(query_id, fingerprint, result)
+        return JSONResponse(result)
+
+    except Exception as e:
+        logger.error(f"Exception in /process_query: {str(e)}")
+        return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+
+async def process_query_stream(request):
+    """Async variant of app.process_query_stream."""
+    data = await _json_body(request)
+    if not data:
+        return JSONResponse({"success": False, "message": "Invalid JSON format"}, status_code=400)
+
+    query_id = data.get('query_id')
+    fingerprint = payload_fingerprint(data)
+    if query_id:
+        try:
+            stored = await asyncio.get_running_loop().run_in_executor(
+                None, idempotency_store.lookup, query_id, fingerprint)
+        except IdempotencyConflict as e:
+            return JSONResponse({"success": False, "message": str(e)}, status_code=409)
+        if stored is not None:
+            logger.info(f"Replaying stored result for query_id: {query_id}")
+            return sse_response([sse_event("ticket", stored)])
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, payload):
+        # Stages running on executor threads report too
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+
+    async def run():
+        with reporting(emit):
+            try:
+                result = await aprocess_query_once(data, query_id, fingerprint)
+                if result.get("success", True):
+                    if query_id:
+                        idempotency_store.store(query_id, fingerprint, result)
+                    emit("ticket", result)
+                else:
+                    emit("error", result)
+            except MemoryBudgetExceeded as e:
+                logger.warning(f"Refusing query_id {query_id}: {str(e)}")
+                emit("error", {"success": False, "message": str(e), "retry_after": RETRY_AFTER_SECONDS})
+            except Exception as e:
+                logger.error(f"Exception in /process_query/stream: {str(e)}")
+                emit("error", {"success": False, "message": str(e)})
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+    # A client that disconnects does not cancel the query; its ticket is still stored
+    task = asyncio.ensure_future(run())
+
+    async def stream():
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield SSE_HEARTBEAT
+                continue
+            if item is None:
+                break
+            yield sse_event(*item)
+        await task
+
+    return sse_response(stream())
+
+
+def sse_response(messages):
+    """Stream already formatted Server-Sent Events messages without buffering."""
+    return StreamingResponse(messages, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@timed_route
+async def feedback_route(request):
+    try:
+        data = await _json_body(request)
+        if not data:
+            return JSONResponse({"success": False, "message": "Invalid JSON"}, status_code=400)
+
+        result = await aanalyze_feedback(data)
+        return JSONResponse(result)
+    except Exception as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+
+@timed_route
+async def feedback_batch_route(request):
+    try:
+        data = await _json_body(request)
+        if data is None:
+            return JSONResponse({"success": False, "message": "Invalid JSON"}, status_code=400)
+        try:
+            records, group_by = validate_batch(data)
+        except ValueError as e:
+            return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+
+        return JSONResponse(await aanalyze_feedback_batch(records, group_by))
+    except Exception as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+
+async def feedback_stats_route(request):
+    kind, entity_id = request.path_params["kind"], request.path_params["entity_id"]
+    if kind not in ENTITY_KINDS:
+        return JSONResponse({"success": False, "message": f"Unknown kind '{kind}'"}, status_code=404)
+    stats = get_feedback_stats().stats(kind, entity_id)
+    if stats is None:
+        return JSONResponse({"success": False, "message": f"No feedback recorded for {kind} {entity_id}"},
+                            status_code=404)
+    return JSONResponse(stats)
+
+
+def _ticket_query(request):
+    filters = {field: request.query_params[field] for field in FILTER_FIELDS if field in request.query_params}
+    return parse_time(request.query_params.get('since')), parse_time(request.query_params.get('until')), filters
+
+
+async def tickets_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+    store = get_ticket_store()
+    if store is None:
+        return JSONResponse({"success": False, "message": "Ticket store is disabled"}, status_code=404)
+    try:
+        since, until, filters = _ticket_query(request)
+        limit = min(int(request.query_params.get('limit', 100)), 1000)
+        tickets = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(store.find, since=since, until=until, limit=limit, **filters))
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    return JSONResponse({"tickets": tickets})
+
+
+async def tickets_export_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+    store = get_ticket_store()
+    if store is None:
+        return JSONResponse({"success": False, "message": "Ticket store is disabled"}, status_code=404)
+    try:
+        since, until, filters = _ticket_query(request)
+        lines = store.export(since, until, **filters)
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    # SQLite reads block, so the rows are fetched on the thread pool
+    return StreamingResponse(iterate_in_threadpool(lines), media_type="application/x-ndjson")
+
+
+async def ticket_stats_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+    dimension = request.path_params["dimension"]
+    if dimension not in DIMENSIONS:
+        return JSONResponse({"success": False, "message": f"Unknown dimension '{dimension}'"}, status_code=404)
+    return JSONResponse({"dimension": dimension, "values": get_ticket_rollups().summary(dimension)})
+
+
+async def ticket_series_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+    dimension, value = request.path_params["dimension"], request.path_params["value"]
+    if dimension not in DIMENSIONS:
+        return JSONResponse({"success": False, "message": f"Unknown dimension '{dimension}'"}, status_code=404)
+    resolution = request.query_params.get('resolution', 'hour')
+    try:
+        series = get_ticket_rollups().series(
+            dimension, value, resolution=resolution, buckets=int(request.query_params.get('buckets', 24)))
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+    return JSONResponse({"dimension": dimension, "value": value, "resolution": resolution, "series": series})
+
+
+async def tickets_by_query_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+    query_id = request.path_params["query_id"]
+    store = get_ticket_store()
+    tickets = []
+    if store is not None:
+        tickets = await asyncio.get_running_loop().run_in_executor(None, store.by_query_id, query_id)
+    if not tickets:
+        return JSONResponse({"success": False, "message": f"No ticket stored for query_id {query_id}"},
+                            status_code=404)
+    return JSONResponse({"tickets": tickets})
+
+
+async def health_check(request):
+    return JSONResponse({"status": "running", "queue_size": request_queue.qsize()})
+
+
+async def metrics_route(request):
+    body, content_type = render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def profiler_route(request):
+    if not admin_authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"success": False, "message": "Forbidden"}, status_code=403)
+
+    # Reaches only the worker that handles this call; the status names it by pid
+    try:
+        if request.method == 'GET':
+            return JSONResponse(profiler.status())
+
+        data = await _json_body(request) or {}
+        if data.get('action', 'start') == 'stop':
+            return JSONResponse(await asyncio.get_running_loop().run_in_executor(None, profiler.stop))
+        return JSONResponse(profiler.start(
+            seconds=data.get('seconds', 30),
+            fraction=data.get('fraction', 1.0),
+            interval_ms=data.get('interval_ms', PROFILER_INTERVAL_MS)
+        ))
+    except (RuntimeError, ValueError) as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=400)
+
+
+# Opening the ticket store at startup delivers the tickets a previous run left in the outbox
+app = Starlette(routes=[
+    Route("/", root),
+    Route("/process_query", process_query, methods=["POST"]),
+    Route("/process_query/stream", process_query_stream, methods=["POST"]),
+    Route("/feedback", feedback_route, methods=["POST"]),
+    Route("/feedback/batch", feedback_batch_route, methods=["POST"]),
+    Route("/feedback/stats/{kind}/{entity_id}", feedback_stats_route, methods=["GET"]),
+    Route("/tickets", tickets_route, methods=["GET"]),
+    Route("/tickets/export", tickets_export_route, methods=["GET"]),
+    Route("/tickets/stats/{dimension}", ticket_stats_route, methods=["GET"]),
+    Route("/tickets/stats/{dimension}/{value}", ticket_series_route, methods=["GET"]),
+    Route("/tickets/{query_id}", tickets_by_query_route, methods=["GET"]),
+    Route("/health", health_check, methods=["GET"]),
+    Route("/metrics", metrics_route, methods=["GET"]),
+    Route("/admin/profiler", profiler_route, methods=["GET", "POST"]),
+], on_startup=[get_ticket_store])
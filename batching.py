@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import observe_queue_wait
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collect concurrent calls into batches and hand each batch to a single handler call.
+
+    A batch is dispatched when max_batch_size items are waiting or window_ms has passed since
+    the first one arrived, whichever comes first. Batches run on their own small pool so new
+    items keep being collected while a batch is in flight.
+
+    Args:
+        handler (callable): Takes a list of items, returns a list of results in the same order
+        window_ms (float): How long to wait for more items after the first one
+        max_batch_size (int): Largest batch handed to the handler
+        max_concurrent_batches (int): Number of batches that may be in flight at once
+        name (str): Used for the thread names
+    """
+    def __init__(self, handler, window_ms=5, max_batch_size=8, max_concurrent_batches=4, name="batcher"):
+        self.handler = handler
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix=name)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue an item and return a Future that resolves to its result."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._collect, name=f"{self.name}-collector", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._executor.submit(self._dispatch, batch)
+            except RuntimeError:
+                # The pool is shut down at interpreter exit before atexit handlers run; handling
+                # the batch here lets flushes registered with atexit complete
+                self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            observe_queue_wait(self.name, now - queued_at)
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"Error in {self.name} batch of {len(items)}: {str(e)}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+
+class AsyncMicroBatcher:
+    """
+    Asyncio variant of MicroBatcher: the handler is a coroutine function, and each batch runs as
+    a task on the event loop, so any number of batches can be in flight without holding threads.
+
+    The batcher belongs to the event loop it is first used on; used from another loop, it drops
+    what the old loop left pending and starts over.
+
+    Args:
+        handler (callable): Coroutine function taking a list of items, returning a list of results in the same order
+        window_ms (float): How long to wait for more items after the first one
+        max_batch_size (int): Largest batch handed to the handler
+        name (str): Used in metrics and logs
+    """
+    def __init__(self, handler, window_ms=5, max_batch_size=8, name="batcher"):
+        self.handler = handler
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._loop = None
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        """Queue an item and return its result once its batch has been handled."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._pending, self._timer = loop, [], None
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # A fresh context, so the batch is not accounted to the request that happened to start it
+            contextvars.Context().run(self._loop.create_task, self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            observe_queue_wait(self.name, now - queued_at)
+        items = [item for item, _, _ in batch]
+        try:
+            results = await self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"Error in {self.name} batch of {len(items)}: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # A caller that was cancelled while waiting has nobody to hand its result to
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
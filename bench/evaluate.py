@@ -0,0 +1,263 @@
+"""
+Offline accuracy-vs-latency evaluation of the classification paths.
+
+Runs a labelled query set through every registered classifier path (the keyword fallback, the
+local model when an artifact is deployed, and one entry per LLM tier) and reports accuracy at
+the department, service_type and request_category levels next to latency and estimated token
+cost, followed by a Pareto table of the paths that are not beaten on accuracy, latency and
+cost at once.
+
+LLM tiers never need the network: by default they replay responses recorded in
+--recordings (keyed by model and text, with the latency and token usage seen when recording);
+--mock-url sends them to bench/mock_groq.py instead. To refresh the recordings from the real
+API, run once with --live --record.
+
+Usage:
+    python bench/evaluate.py
+    python bench/evaluate.py --mock-url http://127.0.0.1:8089
+    GROQ_API_KEY=... python bench/evaluate.py --live --record --paths llm-8b,llm-70b
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+from groq import Groq  # noqa: E402
+from classify import fallback_classification, _classification_request, _parse_classification  # noqa: E402
+from local_classifier import get_local_classifier  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LABELLED_PATH = os.path.join(BENCH_DIR, "labelled_queries.jsonl")
+RECORDINGS_PATH = os.path.join(BENCH_DIR, "recorded_classifications.jsonl")
+
+LEVELS = (("department", "department"), ("service_type", "service_type"), ("request_category", "subsubcategory"))
+
+# Estimated USD per million (prompt, completion) tokens; override with --prices
+MODEL_PRICES = {
+    "llama3-8b-8192": (0.05, 0.08),
+    "mixtral-8x7b-32768": (0.24, 0.24),
+    "llama3-70b-8192": (0.59, 0.79),
+}
+
+# LLM tiers by path name; the production classifier uses mixtral-8x7b-32768
+LLM_TIERS = {
+    "llm-8b": "llama3-8b-8192",
+    "llm-mixtral": "mixtral-8x7b-32768",
+    "llm-70b": "llama3-70b-8192",
+}
+
+
+class Prediction:
+    def __init__(self, classification, latency, prompt_tokens=0, completion_tokens=0):
+        self.classification = classification
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class FallbackPath:
+    model = None
+
+    def classify(self, text):
+        start = time.perf_counter()
+        classification = fallback_classification(text)
+        return Prediction(classification, time.perf_counter() - start)
+
+
+class LocalPath:
+    model = None
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+
+    def classify(self, text):
+        start = time.perf_counter()
+        classification, _ = self.classifier.predict(text)
+        return Prediction(classification, time.perf_counter() - start)
+
+
+class LLMPath:
+    """
+    One LLM tier, answered from recordings, a mock server or the live API.
+
+    Args:
+        model (str): Groq model name
+        recordings (dict): (model, text) -> recorded response
+        client (Groq): Client for mock or live calls; None to replay recordings only
+        record (bool): Store live responses into recordings
+    """
+    def __init__(self, model, recordings, client=None, record=False):
+        self.model = model
+        self.recordings = recordings
+        self.client = client
+        self.record = record
+
+    def classify(self, text):
+        if self.client is None:
+            recorded = self.recordings.get((self.model, text))
+            if recorded is None:
+                return None
+            return Prediction(_parse_classification(recorded["content"]), recorded["latency_ms"] / 1000.0,
+                              recorded.get("prompt_tokens", 0), recorded.get("completion_tokens", 0))
+
+        request = _classification_request(text, self.model)
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(**request)
+        latency = time.perf_counter() - start
+        content = response.choices[0].message.content
+        usage = response.usage
+        if self.record:
+            self.recordings[(self.model, text)] = {
+                "model": self.model, "text": text, "content": content, "latency_ms": round(latency * 1000, 1),
+                "prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens
+            }
+        return Prediction(_parse_classification(content), latency, usage.prompt_tokens, usage.completion_tokens)
+
+
+def build_paths(recordings, client=None, record=False):
+    """Registry of classifier paths by name."""
+    paths = {"fallback": FallbackPath()}
+    classifier = get_local_classifier()
+    if classifier is not None:
+        paths["local"] = LocalPath(classifier)
+    for name, model in LLM_TIERS.items():
+        paths[name] = LLMPath(model, recordings, client, record)
+    return paths
+
+
+def load_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(path, dataset, prices):
+    """Run one path over the dataset and summarise accuracy, latency and cost."""
+    correct = {level: 0 for level, _ in LEVELS}
+    latencies = []
+    prompt_tokens = completion_tokens = answered = 0
+    for example in dataset:
+        try:
+            prediction = path.classify(example["text"])
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Classification failed: {str(e)}")
+            prediction = None
+        if prediction is None:
+            continue
+        answered += 1
+        latencies.append(prediction.latency * 1000)
+        prompt_tokens += prediction.prompt_tokens
+        completion_tokens += prediction.completion_tokens
+        for level, key in LEVELS:
+            if prediction.classification.get(key) == example[level]:
+                correct[level] += 1
+
+    if not answered:
+        return None
+    latencies.sort()
+    prompt_price, completion_price = prices.get(path.model, (0.0, 0.0))
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+    return {
+        "coverage": answered / len(dataset),
+        # Unanswered examples count as wrong, so partial recordings cannot inflate accuracy
+        "accuracy": {level: correct[level] / len(dataset) for level, _ in LEVELS},
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "tokens_per_query": (prompt_tokens + completion_tokens) / answered,
+        "usd_per_1k_queries": cost / answered * 1000,
+    }
+
+
+def pareto(results, level):
+    """Names of the paths not dominated on (accuracy at level, p50 latency, cost)."""
+    def dominates(a, b):
+        better_or_equal = (a["accuracy"][level] >= b["accuracy"][level] and a["p50_ms"] <= b["p50_ms"]
+                           and a["usd_per_1k_queries"] <= b["usd_per_1k_queries"])
+        strictly_better = (a["accuracy"][level] > b["accuracy"][level] or a["p50_ms"] < b["p50_ms"]
+                           or a["usd_per_1k_queries"] < b["usd_per_1k_queries"])
+        return better_or_equal and strictly_better
+
+    return [name for name, result in results.items()
+            if not any(dominates(other, result) for other_name, other in results.items() if other_name != name)]
+
+
+def print_report(results, level):
+    print(f"{'path':<14}{'coverage':>9}{'dept':>8}{'service':>9}{'category':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'tok/q':>8}{'$/1k q':>10}")
+    for name, result in results.items():
+        accuracy = result["accuracy"]
+        print(f"{name:<14}{result['coverage']:>9.0%}{accuracy['department']:>8.0%}{accuracy['service_type']:>9.0%}"
+              f"{accuracy['request_category']:>10.0%}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['tokens_per_query']:>8.0f}{result['usd_per_1k_queries']:>10.4f}")
+
+    frontier = sorted(pareto(results, level), key=lambda name: results[name]["usd_per_1k_queries"])
+    print(f"\nPareto frontier on {level} accuracy, p50 latency and cost (cheapest first):")
+    for name in frontier:
+        result = results[name]
+        print(f"  {name:<14}{result['accuracy'][level]:>6.0%}{result['p50_ms']:>10.1f} ms"
+              f"{result['usd_per_1k_queries']:>10.4f} $/1k")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate classifier paths on a labelled query set")
+    parser.add_argument("--dataset", default=LABELLED_PATH)
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--paths", help="Comma-separated path names (default: all)")
+    parser.add_argument("--mock-url", help="Answer LLM tiers from a bench/mock_groq.py server")
+    parser.add_argument("--live", action="store_true", help="Call the real Groq API (uses GROQ_API_KEY)")
+    parser.add_argument("--record", action="store_true", help="With --live, save the responses to --recordings")
+    parser.add_argument("--prices", help="JSON file of {model: [prompt, completion]} USD per million tokens")
+    parser.add_argument("--pareto-level", default="request_category", choices=[level for level, _ in LEVELS])
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    dataset = load_jsonl(args.dataset)
+    recordings = {}
+    if os.path.exists(args.recordings):
+        recordings = {(r["model"], r["text"]): r for r in load_jsonl(args.recordings)}
+
+    prices = dict(MODEL_PRICES)
+    if args.prices:
+        with open(args.prices) as f:
+            prices.update({model: tuple(price) for model, price in json.load(f).items()})
+
+    client = None
+    if args.mock_url:
+        client = Groq(api_key="mock", base_url=args.mock_url, max_retries=0)
+    elif args.live:
+        client = Groq()
+
+    paths = build_paths(recordings, client, record=args.live and args.record)
+    selected = args.paths.split(",") if args.paths else list(paths)
+
+    results = {}
+    for name in selected:
+        result = evaluate(paths[name], dataset, prices)
+        if result is None:
+            print(f"{name}: no responses (record them with --live --record)", file=sys.stderr)
+            continue
+        results[name] = result
+
+    if results:
+        print_report(results, args.pareto_level)
+
+    if args.live and args.record:
+        with open(args.recordings, "w") as f:
+            for recording in recordings.values():
+                f.write(json.dumps(recording, ensure_ascii=False) + "\n")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
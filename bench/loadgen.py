@@ -0,0 +1,229 @@
+"""
+Replay a JSONL workload against /process_query and report throughput and latency.
+
+Each workload line is either a /process_query payload ({"query_type": "text", "user_input": ...},
+{"query_type": "video", "video_url": ...}, ...), or a backlog-style record ({"request_id", "title",
+"body"}) which is replayed as a text query.
+An optional "delay_ms" on a line is honoured in open-loop mode to reproduce recorded arrival gaps.
+
+The report gives throughput, p50/p95/p99 overall and per stage (from the Server-Timing header),
+and status counts. Pass --output to keep the report as JSON and --baseline to compare against
+an earlier one; the exit status is 1 if any percentile regressed by more than --threshold.
+
+Usage:
+    python bench/mock_groq.py --port 8089 &
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=mock gunicorn app:app &
+    python bench/loadgen.py bench/workload.jsonl --url http://127.0.0.1:8000 --concurrency 16 --requests 500
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import requests
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_workload(path):
+    """Read the workload file into a list of (payload, delay_ms) pairs."""
+    workload = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            delay_ms = record.pop("delay_ms", 0)
+            if "payload" in record:
+                payload = record["payload"]
+            elif "query_type" in record:
+                payload = record
+            elif "body" in record:
+                text = f"{record.get('title', '')}. {record['body']}".strip(". ")
+                payload = {"query_type": "text", "user_input": text}
+            else:
+                raise ValueError(f"Unrecognised workload line: {line[:80]}")
+            workload.append((payload, delay_ms))
+    if not workload:
+        raise ValueError(f"Workload {path} is empty")
+    return workload
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {stage: milliseconds}."""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    summary = {f"p{pct}": round(percentile(values, pct), 1) for pct in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 1) if values else 0.0
+    summary["count"] = len(values)
+    return summary
+
+
+class LoadGenerator:
+    def __init__(self, url, workload, total, concurrency, rate=None, unique_ids=True, timeout=300):
+        self.url = url.rstrip("/") + "/process_query"
+        self.workload = workload
+        self.total = total
+        self.concurrency = concurrency
+        self.rate = rate
+        self.unique_ids = unique_ids
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def _next(self):
+        with self._lock:
+            index = next(self._counter)
+        if index >= self.total:
+            return None
+        payload, delay_ms = self.workload[index % len(self.workload)]
+        payload = dict(payload)
+        if self.unique_ids:
+            payload["query_id"] = uuid.uuid4().hex
+        return index, payload, delay_ms
+
+    def _send(self, session, payload):
+        start = time.perf_counter()
+        try:
+            response = session.post(self.url, json=payload, timeout=self.timeout)
+            status = response.status_code
+            if status == 200 and response.json().get("success") is False:
+                status = "failed"
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+        except (requests.RequestException, ValueError) as e:
+            status = type(e).__name__
+            timings = {}
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.results.append({"status": status, "latency_ms": latency_ms, "stages": timings})
+
+    def _worker(self, started_at):
+        session = requests.Session()
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            index, payload, delay_ms = item
+            if self.rate:
+                # Open loop: requests are sent on schedule regardless of how long earlier ones took
+                scheduled = started_at + index / self.rate + delay_ms / 1000.0
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+            self._send(session, payload)
+
+    def run(self):
+        started_at = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, args=(started_at,), daemon=True)
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - started_at)
+
+    def report(self, elapsed):
+        statuses = Counter(str(result["status"]) for result in self.results)
+        ok = [result for result in self.results if result["status"] == 200]
+        stages = defaultdict(list)
+        for result in ok:
+            for stage, ms in result["stages"].items():
+                stages[stage].append(ms)
+        return {
+            "requests": len(self.results),
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_rps": round(len(self.results) / elapsed, 2) if elapsed else 0.0,
+            "statuses": dict(statuses),
+            "latency_ms": summarize([result["latency_ms"] for result in ok]),
+            "stages_ms": {stage: summarize(values) for stage, values in sorted(stages.items())}
+        }
+
+
+def compare(report, baseline, threshold):
+    """List the percentiles that got slower than the baseline by more than the threshold fraction."""
+    regressions = []
+    pairs = [("latency", report["latency_ms"], baseline.get("latency_ms", {}))]
+    pairs += [(stage, values, baseline.get("stages_ms", {}).get(stage, {}))
+              for stage, values in report["stages_ms"].items()]
+    for name, current, previous in pairs:
+        for pct in PERCENTILES:
+            key = f"p{pct}"
+            if previous.get(key) and current[key] > previous[key] * (1 + threshold):
+                regressions.append(f"{name} {key}: {previous[key]:.1f}ms -> {current[key]:.1f}ms")
+    if baseline.get("throughput_rps") and report["throughput_rps"] < baseline["throughput_rps"] * (1 - threshold):
+        regressions.append(f"throughput: {baseline['throughput_rps']:.2f} -> {report['throughput_rps']:.2f} rps")
+    return regressions
+
+
+def print_report(report, out=sys.stdout):
+    print(f"{report['requests']} requests in {report['elapsed_seconds']}s "
+          f"({report['throughput_rps']} req/s), statuses: {report['statuses']}", file=out)
+    print(f"{'stage':<24}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}", file=out)
+    rows = [("request", report["latency_ms"])] + list(report["stages_ms"].items())
+    for name, summary in rows:
+        print(f"{name:<24}{summary['count']:>8}{summary['mean']:>10.1f}{summary['p50']:>10.1f}"
+              f"{summary['p95']:>10.1f}{summary['p99']:>10.1f}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a JSONL workload against /process_query")
+    parser.add_argument("workload", help="JSONL file of request payloads")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, help="Total requests to send (default: one pass over the workload)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate in requests per second")
+    parser.add_argument("--reuse-ids", action="store_true",
+                        help="Keep query_ids from the workload instead of generating unique ones")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before a regression is reported")
+    args = parser.parse_args(argv)
+
+    workload = load_workload(args.workload)
+    generator = LoadGenerator(args.url, workload, args.requests or len(workload), args.concurrency,
+                              rate=args.rate, unique_ids=not args.reuse_ids, timeout=args.timeout)
+    report = generator.run()
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
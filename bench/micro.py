@@ -0,0 +1,239 @@
+"""
+Micro-benchmarks for the pure-Python code that runs on every request.
+
+Each case is timed over short queries and long transcripts; the report gives ns per call
+(best of several repeats, so scheduler noise is filtered out) and the Python heap allocated
+per call as seen by tracemalloc. Results are compared against bench/micro_baseline.json and the
+exit status is 1 when a case is slower, or allocates more, than the baseline by more than
+--threshold.
+
+Timings are machine-specific. A fixed pure-Python calibration loop is timed with every run and
+stored in the baseline, and timings are scaled by its ratio before comparing, so a uniformly
+slower or busier machine does not read as a regression. Refresh the baseline with
+--update-baseline after an intended change.
+
+Usage:
+    python bench/micro.py
+    python bench/micro.py --filter priority --update-baseline
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Importing the app needs a key; nothing here talks to the API
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+from app import determine_request_priority  # noqa: E402
+from classify import fallback_classification, _classification_request  # noqa: E402
+from condense import condense  # noqa: E402
+from generate_priority import check_critical_query, calculate_financial_priority  # noqa: E402
+from generate_ticket import generate_ticket  # noqa: E402
+from roles import classify_role  # noqa: E402
+
+# The hot paths log on some inputs; keep the terminal readable without skewing timings with I/O
+logging.disable(logging.WARNING)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+
+SHORT_QUERIES = [
+    "I lost my debit card yesterday, please block it immediately.",
+    "My salary was not credited to my account this month.",
+    "I want to apply for a home loan, what documents are needed?",
+    "How do I update my mobile number linked to my account?",
+    "The ATM did not dispense cash but my account was debited.",
+    "Please increase the credit limit on my credit card.",
+    "What are the branch timings on Saturday?",
+    "I need help with my fixed deposit renewal.",
+]
+
+# A transcript of a rambling video query, with no critical keyword so every pattern is scanned
+LONG_TRANSCRIPT = " ".join([
+    "Hello, good morning, I am calling about my account at the main branch.",
+    "I have been a customer for many years and I usually visit the branch on weekends.",
+    "Last month I asked about changing the nominee on my savings account and updating my address.",
+    "The person at the counter told me to bring some documents, which I did the next week,",
+    "but I was told the system was down and I should come back later.",
+    "I also wanted to ask about the interest rates on fixed deposits for senior citizens,",
+    "because my father is planning to invest some of his retirement savings.",
+] * 12)
+
+CUSTOMERS = [
+    {"cibil_score": 820, "holdings": 1500000, "annual_income": 1200000, "loans": 6000000, "query_level": "branch"},
+    {"cibil_score": 710, "holdings": 250000, "annual_income": 600000, "loans": 150000, "query_level": "branch"},
+    {"cibil_score": 580, "holdings": 5000, "annual_income": 180000, "loans": 0, "query_level": "central"},
+    {"cibil_score": None, "holdings": "n/a", "annual_income": 300000, "loans": None, "query_level": "branch"},
+]
+
+DEPARTMENTS = ["loans", "operations", "fraud_investigator", "branch_manager", "compliance_officer", "unknown"]
+
+
+def _cycle(func, inputs):
+    """Call func on each input in turn, so one op covers a realistic mix."""
+    def run():
+        for args in inputs:
+            func(*args)
+    return run, len(inputs)
+
+
+def _ticket(text):
+    return generate_ticket(
+        query_type="text", branch_id="BR001", department="operations", service_type="card_services",
+        request_category="card_blocking", transcribed_text=text, translated_query=text,
+        detected_language="en", priority="critical"
+    )
+
+
+CASES = {
+    "fallback_classification/short": _cycle(fallback_classification, [(q,) for q in SHORT_QUERIES]),
+    "fallback_classification/long": _cycle(fallback_classification, [(LONG_TRANSCRIPT,)]),
+    "check_critical_query/short": _cycle(check_critical_query, [(q,) for q in SHORT_QUERIES]),
+    "check_critical_query/long": _cycle(check_critical_query, [(LONG_TRANSCRIPT,)]),
+    "calculate_financial_priority": _cycle(
+        calculate_financial_priority,
+        [(c["cibil_score"], c["holdings"], c["annual_income"], c["loans"]) for c in CUSTOMERS]
+    ),
+    "determine_request_priority": _cycle(
+        determine_request_priority,
+        [({k: v for k, v in c.items() if isinstance(v, (int, str))},) for c in CUSTOMERS[:3]]
+    ),
+    "classify_role": _cycle(classify_role, [(d, "text") for d in DEPARTMENTS]),
+    "generate_ticket/short": _cycle(_ticket, [(q,) for q in SHORT_QUERIES]),
+    "generate_ticket/long": _cycle(_ticket, [(LONG_TRANSCRIPT,)]),
+    "classification_prompt/short": _cycle(_classification_request, [(q,) for q in SHORT_QUERIES]),
+    "classification_prompt/long": _cycle(_classification_request, [(LONG_TRANSCRIPT,)]),
+    "condense/long": _cycle(condense, [(LONG_TRANSCRIPT, 300)]),
+}
+
+
+def _calibration():
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+CALIBRATION = "_calibration"
+
+
+def measure(run, calls_per_op, min_time=0.2, repeats=7):
+    """
+    Time a case and measure its allocations.
+
+    Returns:
+        dict: ns per call (best repeat) and bytes allocated per call
+    """
+    # Pick a loop count that takes about min_time, as timeit's autorange does
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        if time.perf_counter() - start >= min_time / 10 or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    best = float("inf")
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter_ns()
+            for _ in range(loops):
+                run()
+            best = min(best, (time.perf_counter_ns() - start) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    # Heap peak of one op above what was live before it, i.e. what a call allocates
+    tracemalloc.start()
+    try:
+        run()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ns_per_call": round(best / calls_per_op, 1),
+        "alloc_bytes_per_call": round(peak / calls_per_op, 1)
+    }
+
+
+def machine_speed(results, baseline):
+    """Ratio of this run's calibration time to the baseline's (above 1 means a slower machine)."""
+    current = results.get(CALIBRATION, {}).get("ns_per_call")
+    previous = baseline.get(CALIBRATION, {}).get("ns_per_call")
+    return current / previous if current and previous else 1.0
+
+
+def compare(results, baseline, threshold):
+    """List the cases that regressed past the threshold against the baseline."""
+    regressions = []
+    speed = machine_speed(results, baseline)
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or name == CALIBRATION:
+            continue
+        if current["ns_per_call"] > previous["ns_per_call"] * speed * (1 + threshold):
+            regressions.append(f"ns_per_call {name}: {previous['ns_per_call']:.1f} -> {current['ns_per_call']:.1f} "
+                               f"(machine speed factor {speed:.2f})")
+        # Allow a few bytes of slack so tiny allocation counts do not flap
+        if current["alloc_bytes_per_call"] > previous["alloc_bytes_per_call"] * (1 + threshold) + 16:
+            regressions.append(f"alloc_bytes_per_call {name}: {previous['alloc_bytes_per_call']:.1f} -> "
+                               f"{current['alloc_bytes_per_call']:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the request hot paths")
+    parser.add_argument("--filter", help="Only run cases whose name contains this string")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed regression as a fraction")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Approximate seconds per repeat")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {CALIBRATION: measure(_calibration, 1, min_time=args.min_time)}
+    speed = machine_speed(results, baseline)
+    print(f"machine speed vs baseline: {speed:.2f}x time")
+    print(f"{'case':<34}{'ns/call':>12}{'bytes/call':>12}{'vs baseline':>14}")
+    for name, (run, calls_per_op) in CASES.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(run, calls_per_op, min_time=args.min_time)
+        previous = baseline.get(name, {}).get("ns_per_call")
+        change = f"{results[name]['ns_per_call'] / (previous * speed) - 1:+.1%}" if previous else "-"
+        print(f"{name:<34}{results[name]['ns_per_call']:>12.1f}"
+              f"{results[name]['alloc_bytes_per_call']:>12.1f}{change:>14}")
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Local stand-in for the Groq API, for load tests that must not spend real quota.
+
+Serves the chat-completions and audio-transcriptions endpoints with canned responses,
+a configurable latency distribution and injectable 5xx / 429 rates. Point the service at it with
+
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=mock gunicorn app:app
+
+It also serves files from --video-dir under /videos/ so video queries can be replayed offline.
+
+Usage:
+    python bench/mock_groq.py --port 8089 --latency-ms 300 --latency-sigma 0.5 --error-rate 0.01 --rate-limit-rate 0.02
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_RESPONSES = {
+    "language": "en",
+    "classification": {
+        "department": "operations",
+        "service_type": "card_services",
+        "subsubcategory": "card_blocking"
+    },
+    "feedback": "Customer is broadly satisfied; communication could be clearer. Follow up on the comments raised.",
+    "transcription": "I lost my debit card yesterday, please block it immediately."
+}
+
+
+class MockConfig:
+    def __init__(self, latency_ms, latency_sigma, transcription_latency_ms, error_rate, rate_limit_rate,
+                 responses, video_dir, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.transcription_latency_ms = transcription_latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.responses = responses
+        self.video_dir = video_dir
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def latency(self, median_ms):
+        """Sample a log-normal latency around the median, in seconds."""
+        with self.lock:
+            sample = self.random.lognormvariate(math.log(max(median_ms, 0.001)), self.latency_sigma)
+        return sample / 1000.0
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def chat_reply(config, body):
+    """Pick a canned reply for a chat completion request based on its prompt."""
+    messages = body.get("messages", [])
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    user = next((m["content"] for m in messages if m.get("role") == "user"), "")
+    classification = config.responses["classification"]
+
+    if "language detection" in system:
+        kind, content = "language", config.responses["language"]
+    elif "translation assistant" in system:
+        match = re.search(r"Original text: (.*?)\n\nEnglish translation:", user, re.S)
+        kind, content = "translation", (match.group(1).strip() if match else user)
+    elif "classif" in system and "numbered texts" in user:
+        # Multi-query prompt: one result per numbered text
+        count = len(re.findall(r'^\d+\. "', user, re.M))
+        kind = "batch_classification"
+        content = json.dumps({"results": [dict(index=i, **classification) for i in range(1, count + 1)]})
+    elif "classif" in system:
+        if body.get("response_format", {}).get("type") == "json_object":
+            kind, content = "classification", json.dumps(classification)
+        else:
+            kind = "classification"
+            content = "\n".join(f"{key}: {value}" for key, value in classification.items())
+    elif "feedback records" in user:
+        # Batched feedback: one summary per numbered record plus a group summary
+        count = len(re.findall(r"^\d+\. Behaviour", user, re.M))
+        kind = "batch_feedback"
+        content = json.dumps({
+            "records": [{"index": i, "summary": config.responses["feedback"]} for i in range(1, count + 1)],
+            "group_summary": config.responses["feedback"]
+        })
+    else:
+        kind, content = "feedback", config.responses["feedback"]
+    return kind, content, estimate_tokens(json.dumps(messages))
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    config = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _inject_failure(self):
+        """Return True if a simulated 429 or 5xx was sent."""
+        roll = self.config.roll()
+        if roll < self.config.rate_limit_rate:
+            self.config.count("429")
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                            {"retry-after": "1"})
+            return True
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.config.count("500")
+            self._send_json(500, {"error": {"message": "Simulated server error", "type": "server_error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send_json(200, self.config.counts)
+        if self.path.startswith("/videos/") and self.config.video_dir:
+            name = os.path.basename(self.path[len("/videos/"):])
+            path = os.path.join(self.config.video_dir, name)
+            if os.path.isfile(path):
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    while chunk := f.read(65536):
+                        self.wfile.write(chunk)
+                return
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+
+        if self.path.endswith("/chat/completions"):
+            time.sleep(self.config.latency(self.config.latency_ms))
+            if self._inject_failure():
+                return
+            body = json.loads(raw or b"{}")
+            kind, content, prompt_tokens = chat_reply(self.config, body)
+            self.config.count(kind)
+            completion_tokens = estimate_tokens(content)
+            return self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        if self.path.endswith("/audio/transcriptions"):
+            time.sleep(self.config.latency(self.config.transcription_latency_ms))
+            if self._inject_failure():
+                return
+            self.config.count("transcription")
+            return self._send_json(200, {"text": self.config.responses["transcription"]})
+
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+
+def serve(host, port, config):
+    MockGroqHandler.config = config
+    server = ThreadingHTTPServer((host, port), MockGroqHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the Groq API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Median chat completion latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of the latency")
+    parser.add_argument("--transcription-latency-ms", type=float, default=2000, help="Median transcription latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--responses", help="JSON file overriding the canned responses")
+    parser.add_argument("--video-dir", help="Directory served under /videos/")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    responses = dict(DEFAULT_RESPONSES)
+    if args.responses:
+        with open(args.responses) as f:
+            responses.update(json.load(f))
+
+    config = MockConfig(args.latency_ms, args.latency_sigma, args.transcription_latency_ms, args.error_rate,
+                        args.rate_limit_rate, responses, args.video_dir, args.seed)
+    server = serve(args.host, args.port, config)
+    print(f"Mock Groq API listening on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Parity and throughput check for priority_engine.
+
+The three per-row scorers the engine replaced are frozen below exactly as they were. Random
+customers, plus every threshold and the values just around it, are scored by the frozen code,
+by the public functions (now backed by the engine) and by the engine's batch API; any
+disagreement is printed and makes the exit status 1. Inputs on which the frozen code raises
+are only checked for the public functions, which must raise too.
+
+Then a synthetic book of --rows customers is scored with score_book to report rows per second.
+
+Usage:
+    python bench/priority_parity.py
+    python bench/priority_parity.py --samples 200000 --rows 5000000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+import numpy as np  # noqa: E402
+import priority_engine  # noqa: E402
+from app import determine_request_priority  # noqa: E402
+from generate_priority import calculate_financial_priority  # noqa: E402
+from request_priority import set_priority  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+
+# Frozen reference implementations
+
+def reference_financial(cibil_score, holdings, annual_income, loans):
+    try:
+        try:
+            cibil_score = float(cibil_score) if cibil_score is not None else 700
+            holdings = float(holdings) if holdings is not None else 0
+            annual_income = float(annual_income) if annual_income is not None else 0
+            loans = float(loans) if loans is not None else 0
+        except (ValueError, TypeError):
+            cibil_score = 700
+            holdings = 0
+            annual_income = 0
+            loans = 0
+        priority_score = 0
+        if cibil_score >= 800:
+            priority_score += 3
+        elif cibil_score >= 700:
+            priority_score += 2
+        elif cibil_score >= 600:
+            priority_score += 1
+        if holdings >= 1000000:
+            priority_score += 3
+        elif holdings >= 100000:
+            priority_score += 2
+        elif holdings >= 10000:
+            priority_score += 1
+        if annual_income >= 1000000:
+            priority_score += 3
+        elif annual_income >= 500000:
+            priority_score += 2
+        elif annual_income >= 250000:
+            priority_score += 1
+        if loans >= 5000000:
+            priority_score += 3
+        elif loans >= 1000000:
+            priority_score += 2
+        elif loans >= 100000:
+            priority_score += 1
+        if priority_score >= 8:
+            return "high"
+        elif priority_score >= 4:
+            return "medium"
+        else:
+            return "low"
+    except Exception:
+        return "medium"
+
+
+def reference_request_rank(data):
+    cibil_score = data.get('cibil_score', 0)
+    holdings = data.get('holdings', 0)
+    annual_income = data.get('annual_income', 0)
+    query_level = data.get('query_level', 'branch')
+    if query_level == 'central' or cibil_score >= 800 or holdings >= 1000000 or annual_income >= 1000000:
+        return 1
+    elif cibil_score >= 700 or holdings >= 500000 or annual_income >= 500000:
+        return 2
+    return 3
+
+
+def _normalize(value, min_val, max_val):
+    return (value - min_val) / (max_val - min_val) if max_val > min_val else 0
+
+
+def reference_weighted(loans, holdings, cibil, income):
+    L_norm = _normalize(loans, 0, 100)
+    H_norm = 1 - _normalize(holdings, 0, 500)
+    C_norm = 1 - _normalize(cibil, 300, 900)
+    I_norm = 1 - _normalize(income, 0, 100)
+    priority_score = (0.3 * L_norm) + (0.2 * H_norm) + (0.25 * C_norm) + (0.25 * I_norm)
+    if priority_score <= 0.3:
+        return "Low Priority"
+    elif priority_score <= 0.6:
+        return "Medium Priority"
+    else:
+        return "High Priority"
+
+
+# Inputs
+
+def _edges(thresholds):
+    values = []
+    for threshold in thresholds:
+        values += [threshold, threshold - 1, threshold + 1, np.nextafter(threshold, -np.inf)]
+    return values
+
+
+FIELD_EDGES = {
+    "cibil_score": _edges([800, 700, 600, 300, 900]),
+    "holdings": _edges([1000000, 500000, 100000, 10000, 500]),
+    "annual_income": _edges([1000000, 500000, 250000, 100]),
+    "loans": _edges([5000000, 1000000, 100000, 100]),
+}
+ODD_VALUES = [None, "", "abc", "n/a", "750", " 1e6 ", "-5", True]
+
+
+def sample_rows(count, rng):
+    """Random customers mixing realistic ranges, exact threshold edges and odd values."""
+    scales = {"cibil_score": (300, 900), "holdings": (0, 3e6), "annual_income": (0, 3e6), "loans": (0, 1e7)}
+    rows = []
+    for _ in range(count):
+        row = {}
+        for field, (low, high) in scales.items():
+            roll = rng.random()
+            if roll < 0.6:
+                row[field] = float(rng.uniform(low, high)) if rng.random() < 0.5 else int(rng.integers(low, high))
+            elif roll < 0.85:
+                row[field] = float(FIELD_EDGES[field][rng.integers(len(FIELD_EDGES[field]))])
+            else:
+                row[field] = ODD_VALUES[rng.integers(len(ODD_VALUES))]
+        row["query_level"] = ["branch", "central", None, ""][rng.integers(4)]
+        rows.append(row)
+    return rows
+
+
+def _column(rows, field):
+    column = np.empty(len(rows), dtype=object)
+    column[:] = [row[field] for row in rows]
+    return column
+
+
+def _raises(func, *args):
+    try:
+        return False, func(*args)
+    except TypeError:
+        return True, None
+
+
+def check(rows):
+    """List the disagreements between the frozen code, the public functions and the batch API."""
+    failures = []
+    columns = {field: _column(rows, field) for field in ("cibil_score", "holdings", "annual_income", "loans")}
+    financial = priority_engine.financial_priority_batch(
+        columns["cibil_score"], columns["holdings"], columns["annual_income"], columns["loans"])
+    ranks = priority_engine.request_rank_batch(
+        columns["cibil_score"], columns["holdings"], columns["annual_income"], [row["query_level"] for row in rows])
+    weighted = priority_engine.weighted_priority_batch(
+        columns["loans"], columns["holdings"], columns["cibil_score"], columns["annual_income"])
+
+    for i, row in enumerate(rows):
+        args = (row["cibil_score"], row["holdings"], row["annual_income"], row["loans"])
+        expected = reference_financial(*args)
+        if calculate_financial_priority(*args) != expected:
+            failures.append(f"calculate_financial_priority{args}: {calculate_financial_priority(*args)} != {expected}")
+        # Batch reads an empty cell as missing (None), where float("") would reject the row
+        expected = reference_financial(*(None if value == "" else value for value in args))
+        if priority_engine.FINANCIAL_LEVELS[financial[i]] != expected:
+            failures.append(f"financial_priority_batch{args}: {priority_engine.FINANCIAL_LEVELS[financial[i]]} != {expected}")
+
+        # Requests carry the fields they have; absent keys take the defaults
+        data = {key: value for key, value in row.items() if value is not None and value != ""}
+        raised, expected = _raises(reference_request_rank, data)
+        got_raised, got = _raises(determine_request_priority, data)
+        if raised != got_raised or got != expected:
+            failures.append(f"determine_request_priority({data}): {got} != {expected}")
+        numeric = all(isinstance(value, (int, float)) for key, value in data.items() if key != "query_level")
+        if not raised and numeric and ranks[i] != expected:
+            failures.append(f"request_rank_batch({data}): {ranks[i]} != {expected}")
+
+        args = (row["loans"], row["holdings"], row["cibil_score"], row["annual_income"])
+        raised, expected = _raises(reference_weighted, *args)
+        got_raised, got = _raises(set_priority, *args)
+        if raised != got_raised or got != expected:
+            failures.append(f"set_priority{args}: {got} != {expected}")
+        if not raised and all(isinstance(value, (int, float)) for value in args):
+            got = priority_engine.WEIGHTED_LEVELS[weighted[i]] if weighted[i] >= 0 else None
+            if got != expected:
+                failures.append(f"weighted_priority_batch{args}: {got} != {expected}")
+    return failures
+
+
+def throughput(rows, rng):
+    columns = {
+        "cibil_score": rng.integers(300, 900, rows).astype(np.float64),
+        "holdings": rng.uniform(0, 3e6, rows),
+        "annual_income": rng.uniform(0, 3e6, rows),
+        "loans": rng.uniform(0, 1e7, rows),
+        "query_level": np.where(rng.random(rows) < 0.1, "central", "branch").astype(object),
+    }
+    start = time.perf_counter()
+    priority_engine.score_book(columns)
+    return rows / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check priority_engine against the original scorers")
+    parser.add_argument("--samples", type=int, default=50000, help="Random customers to compare")
+    parser.add_argument("--rows", type=int, default=1000000, help="Synthetic book size for the throughput run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    failures = check(sample_rows(args.samples, rng))
+    for failure in failures[:20]:
+        print(f"MISMATCH {failure}", file=sys.stderr)
+    print(f"{args.samples} customers compared, {len(failures)} mismatches")
+    if args.rows:
+        print(f"score_book: {throughput(args.rows, rng):,.0f} rows/s over {args.rows} rows")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
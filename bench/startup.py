@@ -0,0 +1,208 @@
+"""
+Startup benchmark: how long the app takes to import and how long gunicorn workers take to get ready.
+
+`import` imports app in fresh interpreters and reports the median wall time, the slowest modules
+(from -X importtime) and which heavy optional dependencies were loaded that a text query does
+not need.
+
+`serve` starts gunicorn with gunicorn.conf.py, with and without preload_app, and reports the
+time until /health first answers and until every worker is ready, which is when its
+post_worker_init hook has run (gunicorn is started with a config that wraps the repo's
+gunicorn.conf.py to leave a marker file at that point). Stores are pointed at a throwaway
+directory. Memory is then read from each worker's
+/proc/<pid>/smaps_rollup: the proportional set size (PSS) counts shared pages once across the
+workers that share them, so it drops when workers share the preloaded app copy-on-write.
+
+Usage:
+    python bench/startup.py import --repeats 5
+    python bench/startup.py serve --workers 4
+    python bench/startup.py serve --workers 4 --preload true --output startup.json
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Optional dependencies that only the video path needs
+HEAVY_MODULES = ("moviepy", "imageio", "imageio_ffmpeg", "IPython")
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def _env(**extra):
+    env = dict(os.environ)
+    # Importing the app needs a key; nothing here talks to the API
+    env.setdefault("GROQ_API_KEY", "bench")
+    env.update(extra)
+    return env
+
+
+def measure_import(repeats, top):
+    """Import app in `repeats` fresh interpreters; returns the report as a dict."""
+    seconds = []
+    heavy = []
+    probe = IMPORT_PROBE.format(heavy=HEAVY_MODULES)
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, env=_env(),
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, heavy = json.loads(output.strip().splitlines()[-1])
+        seconds.append(elapsed)
+
+    # One more run for the per-module breakdown; -X importtime slows the import, so it is not timed
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=_env(),
+                           capture_output=True, text=True, check=True).stderr
+    # Only the modules app imports directly, so nested imports are not counted twice
+    direct = []
+    for line in trace.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if len(name) - len(name.lstrip()) == 3:
+            direct.append((name.strip(), int(cumulative) / 1000.0))
+
+    return {
+        "repeats": repeats,
+        "import_ms_median": round(statistics.median(seconds) * 1000, 1),
+        "import_ms_min": round(min(seconds) * 1000, 1),
+        "heavy_modules_loaded": heavy,
+        "slowest_imports_ms": [
+            {"module": name, "cumulative_ms": round(cumulative, 1)}
+            for name, cumulative in sorted(direct, key=lambda module: -module[1])[:top]
+        ],
+    }
+
+
+# gunicorn.conf.py plus a marker file per worker once its post_worker_init hook has run
+READY_CONFIG = """
+import os
+exec(compile(open({config!r}).read(), {config!r}, "exec"))
+_post_worker_init = post_worker_init
+
+
+def post_worker_init(worker):
+    _post_worker_init(worker)
+    open(os.path.join({ready_dir!r}, str(os.getpid())), "w").close()
+"""
+
+
+def _memory(pid):
+    """RSS, PSS and private memory of a process in MiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    return {
+        "rss_mib": round(fields.get("Rss", 0), 1),
+        "pss_mib": round(fields.get("Pss", 0), 1),
+        "private_mib": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1),
+    }
+
+
+def _healthy(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def measure_serve(workers, preload, port, timeout):
+    """Start gunicorn and time it until every worker is ready; returns the report as a dict."""
+    with tempfile.TemporaryDirectory() as directory:
+        ready_dir = os.path.join(directory, "ready")
+        os.makedirs(ready_dir)
+        config_path = os.path.join(directory, "gunicorn.conf.py")
+        with open(config_path, "w") as f:
+            f.write(READY_CONFIG.format(config=os.path.join(ROOT, "gunicorn.conf.py"), ready_dir=ready_dir))
+        env = _env(
+            GUNICORN_PRELOAD=str(preload).lower(),
+            TICKET_STORE_PATH=os.path.join(directory, "tickets.db"),
+            ROLLUPS_PATH=os.path.join(directory, "rollups.npz"),
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            OUTBOX_ENABLED="false",
+        )
+        command = [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}",
+                   "--config", config_path, "--log-level", "warning", "app:app"]
+        start = time.perf_counter()
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        first_response = None
+        ready = {}
+        try:
+            while time.perf_counter() - start < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+                now = time.perf_counter() - start
+                if first_response is None and _healthy(f"http://127.0.0.1:{port}/health"):
+                    first_response = now
+                for name in os.listdir(ready_dir):
+                    ready.setdefault(int(name), now)
+                if first_response is not None and len(ready) >= workers:
+                    break
+                time.sleep(0.01)
+            else:
+                raise RuntimeError(f"{len(ready)} of {workers} workers ready after {timeout}s")
+
+            memory = [_memory(pid) for pid in ready]
+            return {
+                "workers": workers,
+                "preload": preload,
+                "first_response_ms": round(first_response * 1000, 1),
+                "all_workers_ready_ms": round(max(ready.values()) * 1000, 1),
+                "master": _memory(server.pid),
+                "worker_pss_mib_total": round(sum(m["pss_mib"] for m in memory), 1),
+                "worker_private_mib_mean": round(statistics.mean(m["private_mib"] for m in memory), 1),
+                "worker_rss_mib_mean": round(statistics.mean(m["rss_mib"] for m in memory), 1),
+            }
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app import time and gunicorn worker startup")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Time importing app in fresh interpreters")
+    import_parser.add_argument("--repeats", type=int, default=5)
+    import_parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    serve_parser = subparsers.add_parser("serve", help="Time gunicorn until every worker is ready")
+    serve_parser.add_argument("--workers", type=int, default=4)
+    serve_parser.add_argument("--preload", choices=("true", "false", "both"), default="both")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--timeout", type=float, default=120)
+    for subparser in (import_parser, serve_parser):
+        subparser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        report = measure_import(args.repeats, args.top)
+    else:
+        preloads = (False, True) if args.preload == "both" else (args.preload == "true",)
+        report = [measure_serve(args.workers, preload, args.port, args.timeout) for preload in preloads]
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -224,19 +224,40 @@ CATEGORIES = {
 
 # Flattened list of all categories for easier lookup
 ALL_CATEGORIES = []
-for department, service_type in CATEGORIES.items():
-    for service_type,  request_category in service_type.items():
-        for request_category in  request_category:
+for department_name, service_types in CATEGORIES.items():
+    for service_type_name, request_categories in service_types.items():
+        for request_category_name in request_categories:
             ALL_CATEGORIES.append({
-                "department": department,
-                "service_type": service_type,
-                "request_category": request_category
+                "department": department_name,
+                "service_type": service_type_name,
+                "request_category": request_category_name
             })
 
+# The snake_case tree as department -> service_type -> request categories
+TAXONOMY = {
+    department_name: {
+        service_type_name: list(leaves[" request_category"])
+        for service_type_name, leaves in details["service_type"].items()
+    }
+    for department_name, details in department.items()
+}
+
+# Every valid (department, service_type, request_category) triple of the snake_case tree
+VALID_CLASSIFICATIONS = frozenset(
+    (department_name, service_type_name, request_category_name)
+    for department_name, service_types in TAXONOMY.items()
+    for service_type_name, request_categories in service_types.items()
+    for request_category_name in request_categories
+)
+
 def get_all_categories():
     """Return the flattened list of all categories."""
     return ALL_CATEGORIES
 
+def get_taxonomy():
+    """Return the snake_case department -> service_type -> request categories tree."""
+    return TAXONOMY
+
 def get_category_structure():
     """Return the full department structure."""
     return CATEGORIES 
\ No newline at end of file
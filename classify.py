@@ -1,10 +1,25 @@
 import os
+import asyncio
+import functools
 import json
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from groq import Groq
-from categories import ALL_CATEGORIES, get_category_structure, get_all_categories
+from categories import ALL_CATEGORIES, get_category_structure, get_all_categories, get_taxonomy
+from pipeline import Stage, run_pipeline, arun_pipeline
+from batching import MicroBatcher, AsyncMicroBatcher
+from metrics import (
+    timed, record_llm_usage, record_classification, record_request_info, record_output_failure, record_repair,
+    record_label_resolution
+)
+from local_classifier import log_label, local_classify, is_confident
+from routing import route, escalation, record_escalation, maybe_audit
+from taxonomy import normalize_label, resolve
+from condense import condense_transcript
+from progress import report
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +36,265 @@ if not GROQ_API_KEY:
 # Set categories
 CATEGORIES = ALL_CATEGORIES
 
+# Start classifying the original text while language detection is still running;
+# the result is discarded if the text turns out to need translation
+SPECULATIVE_CLASSIFY = os.environ.get("SPECULATIVE_CLASSIFY", "true").lower() == "true"
+
+# Concurrent classify_text calls arriving within this window are sent as one multi-query prompt;
+# set the window to 0 to send every query on its own. gunicorn.conf.py sets it to 0 in sync
+# workers unless it is configured, as a worker serving one request has nothing to batch with.
+CLASSIFY_BATCH_WINDOW_MS = float(os.environ.get("CLASSIFY_BATCH_WINDOW_MS", 5))
+CLASSIFY_BATCH_SIZE = int(os.environ.get("CLASSIFY_BATCH_SIZE", 8))
+
+# Output token cap per classified text; a JSON classification needs about 30 tokens
+CLASSIFY_MAX_TOKENS = int(os.environ.get("CLASSIFY_MAX_TOKENS", 64))
+
+CLASSIFICATION_KEYS = ("department", "service_type", "subsubcategory")
+
+class LLMClassification(dict):
+    """A classification answered by the LLM, remembering the model; only these become training labels."""
+
+    def __init__(self, classification, model):
+        super().__init__(classification)
+        self.model = model
+
+def _format_taxonomy(taxonomy):
+    """Render the taxonomy compactly, one `department > service_type: categories` line per service type."""
+    return "\n".join(
+        f"{department} > {service_type}: {', '.join(request_categories)}"
+        for department, service_types in taxonomy.items()
+        for service_type, request_categories in service_types.items()
+    )
+
+# Built once; every classification prompt embeds it
+TAXONOMY_PROMPT = _format_taxonomy(get_taxonomy())
+
+_async_client = None
+
+def get_async_client():
+    """Return the shared AsyncGroq client so async callers reuse pooled connections."""
+    global _async_client
+    if _async_client is None:
+        from groq import AsyncGroq
+        _async_client = AsyncGroq(api_key=GROQ_API_KEY)
+    return _async_client
+
+def _language_request(text):
+    """Build the chat completion arguments for language detection."""
+    prompt = f"""Detect the language of the following text and return only the ISO 639-1 language code (e.g., 'en' for English, 'hi' for Hindi, etc.):
+
+Text: {text}
+
+Language code:"""
+
+    return dict(
+        model="llama3-8b-8192",
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a language detection assistant. Respond with only the two-letter ISO 639-1 language code and nothing else."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.1,
+        max_tokens=4
+    )
+
+def _parse_language(content, model):
+    """Extract the ISO 639-1 code from a language detection response, or 'unknown'."""
+    code = (content or "").strip().strip(".'\"`").lower()
+    if re.fullmatch(r"[a-z]{2}", code):
+        return code
+    record_output_failure("detect_language", model, "invalid")
+    logger.warning(f"Unexpected language detection response: {(content or '')[:40]!r}")
+    return "unknown"
+
+def _translation_request(text, source_language):
+    """Build the chat completion arguments for translation to English."""
+    prompt = f"""Translate the following text from {source_language} to English. analyze the text and only, strictly only return 2-3 lines (remember this):
+
+Original text: {text}
+
+English translation:"""
+
+    return dict(
+        model="llama3-8b-8192",
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a translation assistant. Translate the given text to English.Analyze and remove unnecessary text, extra punctuation, and newlines. Provide a concise summary in 2-3 sentences."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.1,
+        max_tokens=1000
+    )
+
+def _classification_request(text, model="mixtral-8x7b-32768"):
+    """Build the chat completion arguments for classification."""
+    prompt = f"""Classify the banking query below into one leaf of this taxonomy (department > service_type: request categories):
+{TAXONOMY_PROMPT}
+
+Query: "{text}"
+
+Respond with a JSON object {{"department": "...", "service_type": "...", "subsubcategory": "..."}} using labels exactly as written in the taxonomy, where subsubcategory is one of the request categories."""
+
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant that accurately classifies banking-related queries. Respond only with JSON."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.1,
+        response_format={"type": "json_object"},
+        max_tokens=CLASSIFY_MAX_TOKENS
+    )
+
+def _parse_classification(classification_text, strict=False):
+    """
+    Parse a classification response: a JSON object, or `key: value` lines as older prompts returned.
+    Missing keys get defaults, or with strict=True make the result None.
+    """
+    classification = {}
+    try:
+        data = json.loads(classification_text)
+        if isinstance(data, dict):
+            classification = {
+                key: normalize_label(value) for key, value in data.items()
+                if key in CLASSIFICATION_KEYS and isinstance(value, str) and value.strip()
+            }
+    except ValueError:
+        for line in classification_text.strip().split('\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                classification[key.strip()] = normalize_label(value)
+
+    if strict and not all(key in classification for key in CLASSIFICATION_KEYS):
+        return None
+
+    # Ensure all required keys are present
+    if 'department' not in classification:
+        classification['department'] = 'operations'
+    if 'service_type' not in classification:
+        classification['service_type'] = 'general'
+    if 'subsubcategory' not in classification:
+        classification['subsubcategory'] = 'general_banking_queries'
+
+    return classification
+
+def _check_classification(content, model):
+    """
+    Parse and validate a classification response against the taxonomy.
+
+    Returns:
+        tuple: (classification, problem) where problem is None for a valid leaf, otherwise a
+            description of what is wrong that can be shown to the model
+    """
+    classification = _parse_classification(content or "", strict=True)
+    if classification is None:
+        record_output_failure("classify", model, "unparseable")
+        return None, "it is not a JSON object with department, service_type and subsubcategory"
+    resolved = _resolve_classification(classification, model)
+    if resolved is None:
+        triple = tuple(classification[key] for key in CLASSIFICATION_KEYS)
+        return None, f"{' > '.join(triple)} is not a leaf of the taxonomy"
+    return resolved, None
+
+def _resolve_classification(classification, model):
+    """
+    Map a parsed classification onto the taxonomy, snapping near-miss labels to the closest
+    leaf; None when nothing is close enough.
+    """
+    triple = tuple(classification[key] for key in CLASSIFICATION_KEYS)
+    leaf, how = resolve(*triple)
+    record_label_resolution("classify", how)
+    if leaf is None:
+        record_output_failure("classify", model, "invalid")
+        logger.info(f"Classification {' > '.join(triple)} is not a leaf of the taxonomy")
+        return None
+    if how == "snapped":
+        logger.info(f"Snapped classification {' > '.join(triple)} to {' > '.join(leaf)}")
+    return dict(zip(CLASSIFICATION_KEYS, leaf))
+
+def _repair_request(request, content, problem):
+    """Ask the same model once more, showing it its rejected answer."""
+    return dict(request, messages=request["messages"] + [
+        {"role": "assistant", "content": content or ""},
+        {
+            "role": "user",
+            "content": f"That answer is invalid: {problem}. Reply again with only the JSON object, "
+                       "using a department, service_type and subsubcategory exactly as listed in the taxonomy."
+        }
+    ])
+
+def _batch_classification_request(texts, model="mixtral-8x7b-32768"):
+    """Build the chat completion arguments for classifying several numbered texts in one call."""
+    numbered_texts = "\n".join(f'{i}. "{text}"' for i, text in enumerate(texts, 1))
+
+    prompt = f"""Classify each banking query below into one leaf of this taxonomy (department > service_type: request categories):
+{TAXONOMY_PROMPT}
+
+Queries, as numbered texts:
+{numbered_texts}
+
+Respond with a JSON object of the form {{"results": [{{"index": 1, "department": "...", "service_type": "...", "subsubcategory": "..."}}]}} with exactly one entry per numbered text, using labels exactly as written in the taxonomy, where subsubcategory is one of the request categories."""
+
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant that accurately classifies banking-related queries. Respond only with JSON."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.1,
+        response_format={"type": "json_object"},
+        max_tokens=CLASSIFY_MAX_TOKENS * len(texts)
+    )
+
+def _parse_batch_classification(classification_text, count, model=None):
+    """
+    Split a multi-query classification response back into per-text results.
+
+    Returns:
+        list: One classification dict per text, or None where the item is missing, malformed
+            or not a leaf of the taxonomy
+    """
+    parsed = [None] * count
+    try:
+        items = json.loads(classification_text).get("results", [])
+    except (ValueError, AttributeError):
+        return parsed
+
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        if not isinstance(index, int) or not 1 <= index <= count:
+            continue
+        values = [item.get(key) for key in CLASSIFICATION_KEYS]
+        if not all(isinstance(value, str) and value.strip() for value in values):
+            continue
+        parsed[index - 1] = _resolve_classification(dict(zip(CLASSIFICATION_KEYS, values)), model)
+    return parsed
+
+@timed("detect_language")
 def detect_language(text):
     """Detect the language of the text using Groq API."""
     try:
@@ -28,35 +302,31 @@ def detect_language(text):
             return "unknown"
         
         client = Groq(api_key=GROQ_API_KEY)
+        request = _language_request(text)
+        response = client.chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
         
-        prompt = f"""Detect the language of the following text and return only the ISO 639-1 language code (e.g., 'en' for English, 'hi' for Hindi, etc.):
+        return _parse_language(response.choices[0].message.content, request["model"])
+    except Exception as e:
+        logger.error(f"Error detecting language: {str(e)}")
+        return "unknown"
 
-Text: {text}
+@timed("detect_language")
+async def adetect_language(text):
+    """Async variant of detect_language."""
+    try:
+        if not GROQ_API_KEY:
+            return "unknown"
 
-Language code:"""
-        
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a language detection assistant. Respond with only the ISO 639-1 language code. first do analysis and then return the analysis in 3-4 lines only."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.1,
-            max_tokens=10
-        )
-        
-        language_code = response.choices[0].message.content.strip()
-        return language_code
+        request = _language_request(text)
+        response = await get_async_client().chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
+        return _parse_language(response.choices[0].message.content, request["model"])
     except Exception as e:
         logger.error(f"Error detecting language: {str(e)}")
         return "unknown"
 
+@timed("translate")
 def translate_to_english(text, source_language):
     """Translate text to English if not already in English."""
     try:
@@ -67,28 +337,9 @@ def translate_to_english(text, source_language):
             return text
         
         client = Groq(api_key=GROQ_API_KEY)
-        
-        prompt = f"""Translate the following text from {source_language} to English. analyze the text and only, strictly only return 2-3 lines (remember this):
-
-Original text: {text}
-
-English translation:"""
-        
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a translation assistant. Translate the given text to English.Analyze and remove unnecessary text, extra punctuation, and newlines. Provide a concise summary in 2-3 sentences."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.1,
-            max_tokens=1000
-        )
+        request = _translation_request(text, source_language)
+        response = client.chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
         
         translated_text = response.choices[0].message.content.strip()
         return translated_text
@@ -96,65 +347,304 @@ English translation:"""
         logger.error(f"Error translating text: {str(e)}")
         return text
 
+@timed("translate")
+async def atranslate_to_english(text, source_language):
+    """Async variant of translate_to_english."""
+    try:
+        if source_language == "en" or source_language == "unknown":
+            return text
 
-def classify_text(text):
+        if not GROQ_API_KEY:
+            return text
+
+        request = _translation_request(text, source_language)
+        response = await get_async_client().chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Error translating text: {str(e)}")
+        return text
+
+
+@timed("classify")
+def classify_text(text, local_confidence=None, language=None):
     """
     Classify the text into department, service_type, and request_category using Groq API.
     Falls back to keyword-based classification if API fails.
+    The model tier is chosen per call by the routing policy, and concurrent calls for the same
+    model are micro-batched into a single request when batching is enabled.
     """
+    tier, model = route("classify", text, local_confidence=local_confidence, language=language)
+    if GROQ_API_KEY and CLASSIFY_BATCH_WINDOW_MS > 0:
+        return _get_batcher(tier, model).submit(text).result()
+    return _classify_single(text, tier, model)
+
+def _classify_single(text, tier, model):
+    """Classify one text with its own Groq request, escalating unusable cheaper-tier answers."""
     try:
         if not GROQ_API_KEY:
             logger.warning("GROQ_API_KEY not set, using fallback classification")
+            record_classification("fallback")
             return fallback_classification(text)
         
         client = Groq(api_key=GROQ_API_KEY)
-        
-        # Format categories for the prompt
-        categories_str = json.dumps(CATEGORIES, indent=2)
-        
-        prompt = f"""Given the following categories:{categories_str} And the following text: "{text}" Please classify this text into the most appropriate department, service_type, and request_category if applicable.Return the result in the following format:department: [main department]service_type: [service_type]subsubcategory: [request_category or 'none' if not applicable] Be specific and accurate in your classification. Use snake_case for all department names (lowercase with underscores)."""
-
-        response = client.chat.completions.create(
-            model="mixtral-8x7b-32768",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that accurately classifies banking-related queries. Always use snake_case (lowercase with underscores) for all department names."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.1,
-        )
+        request = _classification_request(text, model)
+        response = client.chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
+        content = response.choices[0].message.content
+        classification, problem = _check_classification(content, model)
 
-        classification_text = response.choices[0].message.content
-        
-        # Parse the classification response
-        lines = classification_text.strip().split('\n')
-        classification = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                classification[key.strip()] = value.strip().lower().replace(' ', '_')
-        
-        # Ensure all required keys are present
-        if 'department' not in classification:
-            classification['department'] = 'operations'
-        if 'service_type' not in classification:
-            classification['service_type'] = 'general'
-        if 'subsubcategory' not in classification:
-            classification['subsubcategory'] = 'general_banking_queries'
-        
+        if problem:
+            target, target_model = escalation("classify", tier)
+            if target is not None:
+                logger.info(f"Escalating unusable {tier} classification to {target}: {problem}")
+                record_escalation("classify", tier)
+                return _classify_single(text, target, target_model)
+
+            # One repair attempt on the same model before giving up on the LLM
+            response = client.chat.completions.create(**_repair_request(request, content, problem))
+            record_llm_usage(request["model"], response)
+            classification, problem = _check_classification(response.choices[0].message.content, model)
+            record_repair("classify", model, problem is None)
+            if problem:
+                logger.warning(f"Classification still invalid after repair ({problem}), using fallback")
+                record_classification("fallback")
+                return fallback_classification(text)
+
+        record_classification("llm")
+        classification = LLMClassification(classification, request["model"])
+        maybe_audit("classify", tier, classification, lambda audit_model: _audit_classification(text, audit_model))
         return classification
         
     except Exception as e:
         # Fallback classification if API fails
         logger.error(f"Error in classification API: {str(e)}")
         logger.info("Using fallback classification")
+        record_classification("fallback")
         return fallback_classification(text)
 
+def _audit_classification(text, model):
+    """
+    Reference classification from the escalation tier, used to audit cheaper-tier answers.
+    It is resolved onto the taxonomy like the answer it is compared with, so labels that only
+    differ in spelling agree.
+
+    Raises:
+        ValueError: When the reference is not a classification or resolves to no leaf
+    """
+    client = Groq(api_key=GROQ_API_KEY)
+    request = _classification_request(text, model)
+    response = client.chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    classification = _parse_classification(response.choices[0].message.content or "", strict=True)
+    if classification is None:
+        raise ValueError("the reference classification could not be parsed")
+    leaf, _ = resolve(*(classification[key] for key in CLASSIFICATION_KEYS))
+    if leaf is None:
+        raise ValueError(f"the reference {' > '.join(classification[key] for key in CLASSIFICATION_KEYS)} "
+                         "is not a leaf of the taxonomy")
+    return dict(zip(CLASSIFICATION_KEYS, leaf))
+
+def classify_validated(text, model="mixtral-8x7b-32768"):
+    """
+    Classify with one model and no fallback, for offline builds that must not store a guess.
+    An invalid answer gets one repair attempt; API errors are raised.
+
+    Returns:
+        dict: A classification that is a leaf of the taxonomy, or None if the model never gave one
+    """
+    client = Groq(api_key=GROQ_API_KEY)
+    request = _classification_request(text, model)
+    response = client.chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    content = response.choices[0].message.content
+    classification, problem = _check_classification(content, model)
+    if problem:
+        response = client.chat.completions.create(**_repair_request(request, content, problem))
+        record_llm_usage(request["model"], response)
+        classification, problem = _check_classification(response.choices[0].message.content, model)
+        record_repair("classify", model, problem is None)
+    return None if problem else classification
+
+def classify_texts(texts, model="mixtral-8x7b-32768"):
+    """
+    Classify several texts with one multi-query Groq request.
+
+    Returns:
+        list: One classification dict per text, or None for items that could not be parsed
+    """
+    client = Groq(api_key=GROQ_API_KEY)
+    request = _batch_classification_request(texts, model)
+    response = client.chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    classifications = _parse_batch_classification(response.choices[0].message.content, len(texts), request["model"])
+    return [None if classification is None else LLMClassification(classification, request["model"])
+            for classification in classifications]
+
+def _classify_batch(texts, tier, model):
+    """Batch handler for the micro-batcher; items that fail to parse are retried on their own."""
+    if len(texts) == 1:
+        return [_classify_single(texts[0], tier, model)]
+
+    try:
+        classifications = classify_texts(texts, model)
+    except Exception as e:
+        logger.error(f"Error in batch classification API: {str(e)}")
+        classifications = [None] * len(texts)
+
+    failed = [i for i, classification in enumerate(classifications) if classification is None]
+    record_classification("llm", len(texts) - len(failed))
+    results = list(classifications)
+    if failed:
+        logger.info(f"Retrying {len(failed)} of {len(texts)} batched classifications individually")
+        retried = _get_retry_executor().map(lambda i: _classify_single(texts[i], tier, model), failed)
+        for i, classification in zip(failed, retried):
+            results[i] = classification
+    for text, classification in zip(texts, classifications):
+        if classification is not None:
+            maybe_audit("classify", tier, classification,
+                        lambda audit_model, text=text: _audit_classification(text, audit_model))
+    return results
+
+# Failed items of a batch are retried side by side rather than one after the other
+_retry_executor = None
+_retry_executor_lock = threading.Lock()
+
+def _get_retry_executor():
+    global _retry_executor
+    with _retry_executor_lock:
+        if _retry_executor is None:
+            _retry_executor = ThreadPoolExecutor(max_workers=CLASSIFY_BATCH_SIZE, thread_name_prefix="classify-retry")
+        return _retry_executor
+
+# One micro-batcher per tier, since a multi-query prompt goes to a single model
+_classification_batchers = {}
+_classification_batchers_lock = threading.Lock()
+
+def _get_batcher(tier, model):
+    with _classification_batchers_lock:
+        batcher = _classification_batchers.get((tier, model))
+        if batcher is None:
+            batcher = MicroBatcher(
+                functools.partial(_classify_batch, tier=tier, model=model),
+                window_ms=CLASSIFY_BATCH_WINDOW_MS,
+                max_batch_size=CLASSIFY_BATCH_SIZE,
+                name=f"classify-batch-{tier}"
+            )
+            _classification_batchers[(tier, model)] = batcher
+        return batcher
+
+async def aclassify_texts(texts, model="mixtral-8x7b-32768"):
+    """Async variant of classify_texts."""
+    request = _batch_classification_request(texts, model)
+    response = await get_async_client().chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    classifications = _parse_batch_classification(response.choices[0].message.content, len(texts), request["model"])
+    return [None if classification is None else LLMClassification(classification, request["model"])
+            for classification in classifications]
+
+async def _aclassify_batch(texts, tier, model):
+    """Async variant of _classify_batch; failed items are retried concurrently."""
+    if len(texts) == 1:
+        return [await _aclassify_single(texts[0], tier, model)]
+
+    try:
+        classifications = await aclassify_texts(texts, model)
+    except Exception as e:
+        logger.error(f"Error in batch classification API: {str(e)}")
+        classifications = [None] * len(texts)
+
+    failed = [i for i, classification in enumerate(classifications) if classification is None]
+    record_classification("llm", len(texts) - len(failed))
+    results = list(classifications)
+    if failed:
+        logger.info(f"Retrying {len(failed)} of {len(texts)} batched classifications individually")
+        retried = await asyncio.gather(*(_aclassify_single(texts[i], tier, model) for i in failed))
+        for i, classification in zip(failed, retried):
+            results[i] = classification
+    for text, classification in zip(texts, classifications):
+        if classification is not None:
+            maybe_audit("classify", tier, classification,
+                        lambda audit_model, text=text: _audit_classification(text, audit_model))
+    return results
+
+_async_classification_batchers = {}
+
+def _get_async_batcher(tier, model):
+    # Only used from the event loop, which runs one callback at a time
+    batcher = _async_classification_batchers.get((tier, model))
+    if batcher is None:
+        batcher = _async_classification_batchers[(tier, model)] = AsyncMicroBatcher(
+            functools.partial(_aclassify_batch, tier=tier, model=model),
+            window_ms=CLASSIFY_BATCH_WINDOW_MS,
+            max_batch_size=CLASSIFY_BATCH_SIZE,
+            name=f"classify-batch-{tier}"
+        )
+    return batcher
+
+@timed("classify")
+async def aclassify_text(text, local_confidence=None, language=None):
+    """Async variant of classify_text; the keyword fallback runs in an executor."""
+    tier, model = route("classify", text, local_confidence=local_confidence, language=language)
+    if GROQ_API_KEY and CLASSIFY_BATCH_WINDOW_MS > 0:
+        return await _get_async_batcher(tier, model).submit(text)
+    return await _aclassify_single(text, tier, model)
+
+async def _aclassify_single(text, tier, model):
+    loop = asyncio.get_running_loop()
+    try:
+        if not GROQ_API_KEY:
+            logger.warning("GROQ_API_KEY not set, using fallback classification")
+            record_classification("fallback")
+            return await loop.run_in_executor(None, fallback_classification, text)
+
+        request = _classification_request(text, model)
+        response = await get_async_client().chat.completions.create(**request)
+        record_llm_usage(request["model"], response)
+        content = response.choices[0].message.content
+        classification, problem = _check_classification(content, model)
+
+        if problem:
+            target, target_model = escalation("classify", tier)
+            if target is not None:
+                logger.info(f"Escalating unusable {tier} classification to {target}: {problem}")
+                record_escalation("classify", tier)
+                return await _aclassify_single(text, target, target_model)
+
+            response = await get_async_client().chat.completions.create(**_repair_request(request, content, problem))
+            record_llm_usage(request["model"], response)
+            classification, problem = _check_classification(response.choices[0].message.content, model)
+            record_repair("classify", model, problem is None)
+            if problem:
+                logger.warning(f"Classification still invalid after repair ({problem}), using fallback")
+                record_classification("fallback")
+                return await loop.run_in_executor(None, fallback_classification, text)
+
+        record_classification("llm")
+        classification = LLMClassification(classification, request["model"])
+        maybe_audit("classify", tier, classification, lambda audit_model: _audit_classification(text, audit_model))
+        return classification
+    except Exception as e:
+        logger.error(f"Error in classification API: {str(e)}")
+        logger.info("Using fallback classification")
+        record_classification("fallback")
+        return await loop.run_in_executor(None, fallback_classification, text)
+
+def local_classify_stage(text):
+    """Run the local first-tier classifier, recording its confidence for the request."""
+    local_result = local_classify(text)
+    if local_result is not None:
+        record_request_info("local_classifier", {
+            "confidence": round(local_result["confidence"], 4), "used": is_confident(local_result)
+        })
+        if is_confident(local_result):
+            record_classification("local")
+    return local_result
+
+async def alocal_classify_stage(text):
+    """Async variant of local_classify_stage; the model is fast enough to run on the loop."""
+    return local_classify_stage(text)
+
 def fallback_classification(text):
     """Simple keyword-based classification as fallback."""
     # Default classification
@@ -277,45 +767,130 @@ def fallback_classification(text):
     
     return classification
 
+def normalize_query_text(query_text):
+    """Canonical form of a query, used to recognise identical requests."""
+    return " ".join(query_text.split()).casefold()
+
+def _needs_translation(detected_language):
+    return detected_language != "en" and detected_language != "unknown"
+
+def classification_stages(query_text, asynchronous=False):
+    """
+    Build the pipeline stages that classify the query.
+    The local classifier runs first; when it is confident the LLM classification is skipped.
+    Otherwise language detection and (speculative) classification of the original text run
+    concurrently, and the translated text is classified only when the query is not in English.
+    With asynchronous=True the stages are coroutines for arun_pipeline.
+    Long transcripts are condensed to a token budget first; the stages only see the condensed text.
+    """
+    query_text = condense_transcript(query_text)
+    has_text = lambda results: bool(query_text)
+    # The LLM classifies only when the local model is missing or not confident enough
+    needs_llm = lambda results: bool(query_text) and not is_confident(results["local_classify"])
+    if asynchronous:
+        detect, translate, classify = adetect_language, atranslate_to_english, aclassify_text
+        local = alocal_classify_stage
+    else:
+        detect, translate, classify = detect_language, translate_to_english, classify_text
+        local = local_classify_stage
+
+    local_confidence = lambda results: (results["local_classify"] or {}).get("confidence")
+    classified_text = lambda results: query_text if results["translate"] is None else results["translate"]
+
+    classify_stage = Stage(
+        "classify",
+        lambda results: classify(
+            classified_text(results),
+            local_confidence=local_confidence(results),
+            language=results["detect_language"] if results["translate"] is None else "en"
+        ),
+        deps=("translate", "local_classify"),
+        when=needs_llm
+    )
+    stages = [
+        Stage("local_classify", lambda results: local(query_text), when=has_text),
+        Stage("detect_language", lambda results: detect(query_text), when=has_text),
+        Stage(
+            "translate",
+            lambda results: translate(query_text, results["detect_language"]),
+            deps=("detect_language",),
+            when=lambda results: bool(query_text) and _needs_translation(results["detect_language"])
+        ),
+        classify_stage
+    ]
+
+    if SPECULATIVE_CLASSIFY:
+        stages.append(Stage(
+            "classify_speculative",
+            lambda results: classify(query_text, local_confidence=local_confidence(results)),
+            deps=("local_classify",),
+            when=needs_llm
+        ))
+        classify_stage.speculation = "classify_speculative"
+        classify_stage.speculation_valid = lambda results: not _needs_translation(results["detect_language"])
+
+    # Only the accepted LLM label becomes training data, not discarded speculation or audits
+    log = _alog_label if asynchronous else log_label
+    stages.append(Stage(
+        "log_label",
+        lambda results: log(classified_text(results), results["classify"], results["classify"].model),
+        deps=("classify",),
+        when=lambda results: isinstance(results["classify"], LLMClassification)
+    ))
+    return stages
+
+async def _alog_label(text, classification, model):
+    log_label(text, classification, model)
+
+def build_classification_result(query_text, results):
+    """Format the results of the classification stages to match the expected output."""
+    if not query_text:
+        return {
+            "department": "operations",
+            "service_type": "general",
+            "request_category": "general_banking_queries",
+            "translated_query": "",
+            "detected_language": "en"
+        }
+
+    classification = results["classify"] or results["local_classify"]
+    return {
+        "department": classification.get("department", "operations"),
+        "service_type": classification.get("service_type", "general"),
+        "request_category": classification.get("subsubcategory", "general_banking_queries"),
+        "translated_query": results.get("translate") or "",
+        "detected_language": results["detect_language"]
+    }
+
+def report_stage_progress(name, result):
+    """on_stage_done callback reporting the classification stages as progress events as they finish."""
+    if name == "detect_language":
+        report("language", {"detected_language": result})
+    elif name == "translate" and result is not None:
+        report("translation", {"translated_query": result})
+    elif name == "classify" or (name == "local_classify" and is_confident(result)):
+        report("classification", {
+            "department": result.get("department", "operations"),
+            "service_type": result.get("service_type", "general"),
+            "request_category": result.get("subsubcategory", "general_banking_queries")
+        })
+
+def report_classification_result(classification_result):
+    """Report the final classification; events already reported while the stages ran are not repeated."""
+    report("language", {"detected_language": classification_result.get("detected_language", "")})
+    if classification_result.get("translated_query"):
+        report("translation", {"translated_query": classification_result["translated_query"]})
+    report("classification", {key: classification_result.get(key, "") for key in
+                              ("department", "service_type", "request_category")})
+
 def classify_query(query_text):
     """
     Classify the query into department, service_type, and request_category.
     Also detect language and translate if not in English.
     """
     try:
-        if not query_text:
-            return {
-                "department": "operations",
-                "service_type": "general",
-                "request_category": "general_banking_queries",
-                "translated_query": "",
-                "detected_language": "en"
-            }
-        
-        # Detect language
-        detected_language = detect_language(query_text)
-        
-        # Translate if not in English
-        translated_query = ""
-        if detected_language != "en" and detected_language != "unknown":
-            translated_query = translate_to_english(query_text, detected_language)
-            text_to_classify = translated_query
-        else:
-            text_to_classify = query_text
-        
-        # Classify the text
-        classification = classify_text(text_to_classify)
-        
-        # Format the result to match the expected output
-        result = {
-            "department": classification.get("department", "operations"),
-            "service_type": classification.get("service_type", "general"),
-            "request_category": classification.get("subsubcategory", "general_banking_queries"),
-            "translated_query": translated_query,
-            "detected_language": detected_language
-        }
-        
-        return result
+        run = run_pipeline(classification_stages(query_text))
+        return build_classification_result(query_text, run.results)
     except Exception as e:
         logger.error(f"Error classifying query: {str(e)}")
         return {
@@ -326,6 +901,21 @@ def classify_query(query_text):
             "detected_language": "unknown"
         }  # ❌ Removed the extra double-quote here
 
+async def aclassify_query(query_text):
+    """Async variant of classify_query."""
+    try:
+        run = await arun_pipeline(classification_stages(query_text, asynchronous=True))
+        return build_classification_result(query_text, run.results)
+    except Exception as e:
+        logger.error(f"Error classifying query: {str(e)}")
+        return {
+            "department": "operations",
+            "service_type": "general",
+            "request_category": "general_banking_queries",
+            "translated_query": "",
+            "detected_language": "unknown"
+        }
+
 
 if __name__ == "__main__":
     # Test the function
@@ -0,0 +1,137 @@
+"""
+Token-aware condensation of long transcripts before they reach the LLM.
+
+A rambling video transcript is sent to language detection, translation and classification;
+past a point the extra text only adds cost and latency, and a long enough one overflows the
+context window. condense_transcript() keeps the transcript whole while it fits
+CONDENSE_TOKEN_BUDGET and otherwise keeps only its most informative sentences, in their
+original order, up to the budget.
+
+Sentences are scored extractively:
+- density of taxonomy terms (words of the department, service type and request category
+  labels, compared by a crude stem), since those are what the classifier decides between
+- a bonus when the sentence matches a critical pattern (fraud, lost card, ...), so urgency
+  signals survive for routing and priority
+Repeated sentences are kept once.
+
+Only the LLM inputs are condensed; the ticket keeps the full transcript.
+"""
+import logging
+import math
+import os
+import re
+from categories import get_taxonomy
+from generate_priority import CRITICAL_RE
+from metrics import timed, record_request_info
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Estimated tokens a transcript may take before it is condensed; 0 disables condensation
+CONDENSE_TOKEN_BUDGET = int(os.environ.get("CONDENSE_TOKEN_BUDGET", 300))
+
+# Score added to a sentence that matches a critical pattern
+CRITICAL_WEIGHT = 1.0
+
+# Sentences longer than this many words are split into windows, for unpunctuated transcripts
+MAX_SENTENCE_WORDS = 40
+
+# Label words too generic to say anything about the query
+_STOPWORDS = {"and", "or", "of", "the", "other", "than", "general", "union", "related", "issues", "services",
+              "service", "type", "request"}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """
+    Rough token count without a tokenizer: about four UTF-8 bytes per token, which holds for
+    English and errs high for non-Latin scripts.
+    """
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _taxonomy_terms():
+    terms = set()
+    for department, service_types in get_taxonomy().items():
+        labels = [department]
+        for service_type, request_categories in service_types.items():
+            labels.append(service_type)
+            labels.extend(request_categories)
+        for label in labels:
+            terms.update(_stem(word) for word in label.split("_") if len(word) > 2 and word not in _STOPWORDS)
+    return frozenset(terms)
+
+
+TAXONOMY_TERMS = _taxonomy_terms()
+
+
+def split_sentences(text):
+    """Split a transcript into sentences, breaking overlong ones into windows of MAX_SENTENCE_WORDS words."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        words = sentence.split()
+        for start in range(0, len(words), MAX_SENTENCE_WORDS):
+            sentences.append(" ".join(words[start:start + MAX_SENTENCE_WORDS]))
+    return sentences
+
+
+def score_sentence(sentence):
+    """Taxonomy term density plus CRITICAL_WEIGHT when the sentence matches a critical pattern."""
+    lowered = sentence.lower()
+    words = _WORD.findall(lowered)
+    if not words:
+        return 0.0
+    density = sum(1 for word in words if _stem(word) in TAXONOMY_TERMS) / len(words)
+    return density + (CRITICAL_WEIGHT if CRITICAL_RE.search(lowered) else 0.0)
+
+
+def condense(text, budget):
+    """
+    Keep the highest-scoring sentences of text, in their original order, within budget tokens.
+
+    Returns:
+        str: The condensed text; text itself when it already fits
+    """
+    if budget <= 0 or estimate_tokens(text) <= budget:
+        return text
+
+    sentences = split_sentences(text)
+    ranked = sorted(range(len(sentences)), key=lambda i: (-score_sentence(sentences[i]), i))
+    kept, seen, used = set(), set(), 0
+    for i in ranked:
+        # Speech transcripts repeat themselves; a repeated sentence adds nothing
+        key = " ".join(_WORD.findall(sentences[i].lower()))
+        cost = estimate_tokens(sentences[i]) + 1
+        if key not in seen and used + cost <= budget:
+            kept.add(i)
+            seen.add(key)
+            used += cost
+    if not kept:
+        # Not even the best sentence fits; keep as many of its words as the budget allows
+        words = sentences[ranked[0]].split()
+        return " ".join(words[:max(1, budget * 3 // 4)])
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+@timed("condense")
+def condense_transcript(text, budget=None):
+    """Condense a query for the LLM stages to CONDENSE_TOKEN_BUDGET (or budget) estimated tokens."""
+    budget = CONDENSE_TOKEN_BUDGET if budget is None else budget
+    if not text:
+        return text
+    condensed = condense(text, budget)
+    if condensed is not text:
+        before, after = estimate_tokens(text), estimate_tokens(condensed)
+        record_request_info("condense", {"tokens_before": before, "tokens_after": after})
+        logger.info(f"Condensed transcript from ~{before} to ~{after} tokens")
+    return condensed
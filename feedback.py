@@ -1,24 +1,62 @@
 # feedback.py
+import asyncio
+import json
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from groq import Groq
 from dotenv import load_dotenv
+from condense import estimate_tokens
+from feedback_stats import ENTITY_KINDS, get_feedback_stats, describe
+from metrics import timed, record_llm_usage
+from routing import route, escalation, record_escalation
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 groq_api_key = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=groq_api_key)
 
-def analyze_feedback(data):
-    try:
-        feedback_id = data.get('id')
-        employee_id = data.get('employee_id')
-        branch_id = data.get('branch_id')
-        behaviour = data.get('behaviour')
-        communication = data.get('communication')
-        satisfaction = data.get('satisfaction')
-        overall_rating = data.get('overall_rating')
-        comment = data.get('comment', "")
-
-        prompt_text = f"""
+# Batch analysis: estimated prompt tokens and records per LLM call, and calls in flight per request
+FEEDBACK_BATCH_TOKEN_BUDGET = int(os.environ.get("FEEDBACK_BATCH_TOKEN_BUDGET", 3000))
+FEEDBACK_BATCH_MAX_RECORDS = int(os.environ.get("FEEDBACK_BATCH_MAX_RECORDS", 20))
+FEEDBACK_BATCH_WORKERS = int(os.environ.get("FEEDBACK_BATCH_WORKERS", 4))
+# Largest number of records accepted by one /feedback/batch request
+FEEDBACK_BATCH_MAX_SIZE = int(os.environ.get("FEEDBACK_BATCH_MAX_SIZE", 5000))
+
+# Output tokens allowed per record summary and for a group summary
+FEEDBACK_SUMMARY_TOKENS = 80
+FEEDBACK_GROUP_SUMMARY_TOKENS = 150
+
+FEEDBACK_GROUP_KEYS = ("employee_id", "branch_id")
+
+_client = None
+_async_client = None
+
+def get_client():
+    """Return the shared Groq client, built on first use so that importing this module stays cheap."""
+    global _client
+    if _client is None:
+        _client = Groq(api_key=groq_api_key)
+    return _client
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        from groq import AsyncGroq
+        _async_client = AsyncGroq(api_key=groq_api_key)
+    return _async_client
+
+def _feedback_request(data, model="llama3-70b-8192"):
+    behaviour = data.get('behaviour')
+    communication = data.get('communication')
+    satisfaction = data.get('satisfaction')
+    overall_rating = data.get('overall_rating')
+    comment = data.get('comment', "")
+
+    prompt_text = f"""
         Analyze the following customer feedback:
         Behaviour: {behaviour}/10
         Communication: {communication}/10
@@ -28,20 +66,374 @@ def analyze_feedback(data):
         Provide a concise 3-4 line summary of key insights and improvement areas.
         """
 
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[{"role": "user", "content": prompt_text}],
-            max_tokens=150
-        )
+    return dict(
+        model=model,
+        messages=[{"role": "user", "content": prompt_text}],
+        max_tokens=150
+    )
 
+def _feedback_result(data, response, analysis_result=None):
+    if analysis_result is None:
         analysis_result = response.choices[0].message.content.strip()
 
-        return {
-            "feedback_id": feedback_id,
-            "employee_id": employee_id,
-            "branch_id": branch_id,
-            "analysis": analysis_result
-        }
+    return {
+        "feedback_id": data.get('id'),
+        "employee_id": data.get('employee_id'),
+        "branch_id": data.get('branch_id'),
+        "analysis": analysis_result
+    }
+
+def _usable(response):
+    return bool((response.choices[0].message.content or "").strip())
+
+def _has_comment(data):
+    return bool((data.get('comment') or "").replace('$$', ' ').strip())
+
+def _score_analysis(data):
+    """Describe a record without comments from its scores and the running statistics, without the LLM."""
+    analysis = (f"No comments given. Behaviour {data.get('behaviour')}/10, Communication {data.get('communication')}/10, "
+                f"Satisfaction {data.get('satisfaction')}/10, Overall {data.get('overall_rating')}/10.")
+    if data.get('employee_id') is not None:
+        history = describe("employee", data.get('employee_id'))
+        if history:
+            analysis += f" {history}"
+    return analysis
+
+def _record_scores(data):
+    """Add the record's scores to the running statistics; a failure is logged and does not fail the request."""
+    try:
+        get_feedback_stats().record(data)
+    except Exception as e:
+        logger.error(f"Error recording feedback scores: {str(e)}")
+
+@timed("feedback")
+def analyze_feedback(data):
+    """Record the scores in the running statistics; only records with comments go to the LLM."""
+    _record_scores(data)
+    if not _has_comment(data):
+        return _feedback_result(data, None, _score_analysis(data))
+    return _analyze_feedback(data)
+
+def _analyze_feedback(data):
+    try:
+        # Short comments go to the small tier; an empty answer from it is retried on the large one
+        tier, model = route("feedback", data.get('comment', ""))
+        while True:
+            request = _feedback_request(data, model)
+            response = get_client().chat.completions.create(**request)
+            record_llm_usage(request["model"], response)
+            target, target_model = escalation("feedback", tier)
+            if target is None or _usable(response):
+                return _feedback_result(data, response)
+            record_escalation("feedback", tier)
+            tier, model = target, target_model
+
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
+@timed("feedback")
+async def aanalyze_feedback(data):
+    _record_scores(data)
+    if not _has_comment(data):
+        return _feedback_result(data, None, _score_analysis(data))
+    return await _aanalyze_feedback(data)
+
+async def _aanalyze_feedback(data):
+    try:
+        tier, model = route("feedback", data.get('comment', ""))
+        while True:
+            request = _feedback_request(data, model)
+            response = await get_async_client().chat.completions.create(**request)
+            record_llm_usage(request["model"], response)
+            target, target_model = escalation("feedback", tier)
+            if target is None or _usable(response):
+                return _feedback_result(data, response)
+            record_escalation("feedback", tier)
+            tier, model = target, target_model
 
     except Exception as e:
         return {"success": False, "message": str(e)}
+
+
+def _record_line(index, data):
+    comment = (data.get('comment') or "").replace('$$', ', ')
+    return (f"{index}. Behaviour {data.get('behaviour')}/10, Communication {data.get('communication')}/10, "
+            f"Satisfaction {data.get('satisfaction')}/10, Overall {data.get('overall_rating')}/10. "
+            f"Comments: {json.dumps(comment, ensure_ascii=False)}")
+
+def group_feedback(records, group_by="employee_id"):
+    """Group records by the value of group_by, keeping first-seen order; records without it share the None group."""
+    groups = {}
+    for position, data in enumerate(records):
+        groups.setdefault(data.get(group_by), []).append(position)
+    return groups
+
+def pack_records(records, positions, budget=None, max_records=None):
+    """
+    Split the records at positions into chunks whose rendered lines fit the token budget.
+    A record too large for the budget on its own gets a chunk to itself.
+    """
+    budget = FEEDBACK_BATCH_TOKEN_BUDGET if budget is None else budget
+    max_records = FEEDBACK_BATCH_MAX_RECORDS if max_records is None else max_records
+    chunks, chunk, used = [], [], 0
+    for position in positions:
+        cost = estimate_tokens(_record_line(len(chunk) + 1, records[position]))
+        if chunk and (used + cost > budget or len(chunk) >= max_records):
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(position)
+        used += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _batch_feedback_request(records, group_by, group_key, model="llama3-70b-8192"):
+    numbered = "\n".join(_record_line(i, data) for i, data in enumerate(records, 1))
+    prompt_text = f"""Analyze the following customer feedback records, all for {group_by} {group_key}:
+{numbered}
+
+For each record give a concise 3-4 line summary of key insights and improvement areas, then one 3-4 line summary of the recurring themes across all records. Return a JSON object of the form {{"records": [{{"index": 1, "summary": "..."}}], "group_summary": "..."}} with exactly one entry per numbered record."""
+
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You analyze bank customer feedback. Respond only with JSON."},
+            {"role": "user", "content": prompt_text}
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=FEEDBACK_SUMMARY_TOKENS * len(records) + FEEDBACK_GROUP_SUMMARY_TOKENS
+    )
+
+def _parse_batch_feedback(content, count):
+    """
+    Returns:
+        tuple: (summaries, group_summary) with None for every record summary that is missing
+    """
+    summaries = [None] * count
+    try:
+        data = json.loads(content or "")
+    except ValueError:
+        return summaries, None
+    if not isinstance(data, dict):
+        return summaries, None
+    for item in data.get("records") or []:
+        if not isinstance(item, dict):
+            continue
+        index, summary = item.get("index"), item.get("summary")
+        if isinstance(index, int) and 1 <= index <= count and isinstance(summary, str) and summary.strip():
+            summaries[index - 1] = summary.strip()
+    group_summary = data.get("group_summary")
+    return summaries, group_summary.strip() if isinstance(group_summary, str) and group_summary.strip() else None
+
+def _merge_summaries_request(partial_summaries, group_by, group_key, model="llama3-70b-8192"):
+    joined = "\n".join(f"- {summary}" for summary in partial_summaries)
+    prompt_text = f"""The following are summaries of batches of customer feedback for {group_by} {group_key}:
+{joined}
+Combine them into one concise 3-4 line summary of key insights and improvement areas."""
+
+    return dict(
+        model=model,
+        messages=[{"role": "user", "content": prompt_text}],
+        max_tokens=FEEDBACK_GROUP_SUMMARY_TOKENS
+    )
+
+def _batch_model(records):
+    # One call carries every comment of the chunk, so the chunk is routed as a whole
+    return route("feedback", " ".join(data.get('comment') or "" for data in records))[1]
+
+def _chunk_result(records, response):
+    summaries, group_summary = _parse_batch_feedback(response.choices[0].message.content, len(records))
+    results = [
+        None if summary is None else _feedback_result(data, None, summary)
+        for data, summary in zip(records, summaries)
+    ]
+    return results, group_summary
+
+def _prepare_batch(records, group_by):
+    """
+    Record every record's scores and answer the ones without comments locally.
+
+    Returns:
+        tuple: (groups, results, pending) where pending maps each group to the positions that
+            still need the LLM
+    """
+    results = [None] * len(records)
+    for position, data in enumerate(records):
+        _record_scores(data)
+        if not _has_comment(data):
+            results[position] = _feedback_result(data, None, _score_analysis(data))
+    groups = group_feedback(records, group_by)
+    pending = {key: [p for p in positions if results[p] is None] for key, positions in groups.items()}
+    return groups, results, pending
+
+def _group_entry(group_by, key, positions, summary):
+    return {"group_by": group_by, "key": key, "count": len(positions), "summary": summary}
+
+def _batch_response(results, groups, group_by, group_summaries):
+    # Groups without any comments, or whose summaries failed, are described from their statistics
+    kind = next(kind for kind, field in ENTITY_KINDS.items() if field == group_by)
+    return {
+        "results": results,
+        "groups": [_group_entry(group_by, key, positions,
+                                group_summaries.get(key) or (describe(kind, key) if key is not None else None))
+                   for key, positions in groups.items()]
+    }
+
+def validate_batch(payload):
+    """
+    Unpack a /feedback/batch payload: either a list of records or {"records": [...], "group_by": ...}.
+
+    Returns:
+        tuple: (records, group_by)
+
+    Raises:
+        ValueError: When the payload is malformed
+    """
+    if isinstance(payload, list):
+        payload = {"records": payload}
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a list of feedback records or an object with 'records'")
+    records = payload.get("records")
+    group_by = payload.get("group_by", "employee_id")
+    if not isinstance(records, list) or not all(isinstance(data, dict) for data in records):
+        raise ValueError("'records' must be a list of feedback objects")
+    if len(records) > FEEDBACK_BATCH_MAX_SIZE:
+        raise ValueError(f"At most {FEEDBACK_BATCH_MAX_SIZE} records per batch")
+    if group_by not in FEEDBACK_GROUP_KEYS:
+        raise ValueError(f"'group_by' must be one of {', '.join(FEEDBACK_GROUP_KEYS)}")
+    return records, group_by
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def _get_batch_executor():
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=FEEDBACK_BATCH_WORKERS, thread_name_prefix="feedback-batch")
+        return _batch_executor
+
+def _analyze_chunk(records, group_by, group_key):
+    request = _batch_feedback_request(records, group_by, group_key, _batch_model(records))
+    response = get_client().chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    return _chunk_result(records, response)
+
+def _merge_group(partial_summaries, group_by, group_key):
+    partial_summaries = [summary for summary in partial_summaries if summary]
+    if len(partial_summaries) <= 1:
+        return partial_summaries[0] if partial_summaries else None
+    request = _merge_summaries_request(partial_summaries, group_by, group_key)
+    response = get_client().chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    return (response.choices[0].message.content or "").strip() or None
+
+@timed("feedback_batch")
+def analyze_feedback_batch(records, group_by="employee_id"):
+    """
+    Analyze many feedback records with one LLM call per chunk of a group.
+
+    Every record's scores go into the running statistics and records without comments are
+    answered from them. The rest are grouped by group_by, each group is packed into chunks within
+    FEEDBACK_BATCH_TOKEN_BUDGET, and the chunks run concurrently on a pool of
+    FEEDBACK_BATCH_WORKERS threads. Records missing from a batch answer are analyzed one by one.
+
+    Returns:
+        dict: "results", one analyze_feedback-style result per record in input order, and
+            "groups", a summary per group
+    """
+    groups, results, pending = _prepare_batch(records, group_by)
+    executor = _get_batch_executor()
+    chunk_futures = {
+        key: [(chunk, executor.submit(_analyze_chunk, [records[p] for p in chunk], group_by, key))
+              for chunk in pack_records(records, positions)]
+        for key, positions in pending.items()
+    }
+
+    partials = {}
+    for key, chunks in chunk_futures.items():
+        partials[key] = []
+        for chunk, future in chunks:
+            try:
+                chunk_results, group_summary = future.result()
+            except Exception as e:
+                logger.error(f"Feedback batch for {group_by} {key} failed: {str(e)}")
+                chunk_results, group_summary = [None] * len(chunk), None
+            partials[key].append(group_summary)
+            for position, result in zip(chunk, chunk_results):
+                results[position] = result
+
+    # Records the batch answers left out, and the groups that need their partial summaries merged
+    retries = {position: executor.submit(_analyze_feedback, records[position])
+               for position, result in enumerate(results) if result is None}
+    merges = {key: executor.submit(_merge_group, summaries, group_by, key) for key, summaries in partials.items()}
+    for position, future in retries.items():
+        results[position] = future.result()
+
+    group_summaries = {}
+    for key, future in merges.items():
+        try:
+            group_summaries[key] = future.result()
+        except Exception as e:
+            logger.error(f"Merging feedback summaries for {group_by} {key} failed: {str(e)}")
+            group_summaries[key] = None
+    return _batch_response(results, groups, group_by, group_summaries)
+
+async def _aanalyze_chunk(records, group_by, group_key):
+    request = _batch_feedback_request(records, group_by, group_key, _batch_model(records))
+    response = await get_async_client().chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    return _chunk_result(records, response)
+
+async def _amerge_group(partial_summaries, group_by, group_key):
+    partial_summaries = [summary for summary in partial_summaries if summary]
+    if len(partial_summaries) <= 1:
+        return partial_summaries[0] if partial_summaries else None
+    request = _merge_summaries_request(partial_summaries, group_by, group_key)
+    response = await get_async_client().chat.completions.create(**request)
+    record_llm_usage(request["model"], response)
+    return (response.choices[0].message.content or "").strip() or None
+
+@timed("feedback_batch")
+async def aanalyze_feedback_batch(records, group_by="employee_id"):
+    """Async variant of analyze_feedback_batch; FEEDBACK_BATCH_WORKERS bounds the calls in flight."""
+    groups, results, pending = _prepare_batch(records, group_by)
+    semaphore = asyncio.Semaphore(FEEDBACK_BATCH_WORKERS)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    chunks = [(key, chunk) for key, positions in pending.items() for chunk in pack_records(records, positions)]
+    answers = await asyncio.gather(
+        *(bounded(_aanalyze_chunk([records[p] for p in chunk], group_by, key)) for key, chunk in chunks),
+        return_exceptions=True
+    )
+
+    partials = {key: [] for key in groups}
+    for (key, chunk), answer in zip(chunks, answers):
+        if isinstance(answer, Exception):
+            logger.error(f"Feedback batch for {group_by} {key} failed: {str(answer)}")
+            answer = ([None] * len(chunk), None)
+        chunk_results, group_summary = answer
+        partials[key].append(group_summary)
+        for position, result in zip(chunk, chunk_results):
+            results[position] = result
+
+    missing = [position for position, result in enumerate(results) if result is None]
+    keys = list(partials)
+    retried, merged = await asyncio.gather(
+        asyncio.gather(*(bounded(_aanalyze_feedback(records[position])) for position in missing)),
+        asyncio.gather(*(bounded(_amerge_group(partials[key], group_by, key)) for key in keys),
+                       return_exceptions=True)
+    )
+    for position, result in zip(missing, retried):
+        results[position] = result
+
+    group_summaries = {}
+    for key, summary in zip(keys, merged):
+        if isinstance(summary, Exception):
+            logger.error(f"Merging feedback summaries for {group_by} {key} failed: {str(summary)}")
+            summary = None
+        group_summaries[key] = summary
+    return _batch_response(results, groups, group_by, group_summaries)
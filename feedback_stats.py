@@ -0,0 +1,269 @@
+"""
+Running statistics of feedback scores per employee and per branch.
+
+Every feedback record updates, for its employee_id and its branch_id, each of the numeric
+scores (behaviour, communication, satisfaction, overall_rating):
+- count, mean and variance, kept with Welford's online algorithm
+- a histogram over half-point bins of the 0-10 scale, for percentiles
+- per-day sums and counts in a ring of STATS_WINDOW_DAYS days, for window means and trend
+
+State lives in preallocated NumPy arrays, one row per entity, grown by doubling, so an update
+and a stats read touch a fixed number of cells whatever the history length.
+
+A record carrying an id is counted once: the ids of the last FEEDBACK_STATS_SEEN_IDS records
+are remembered, per process, so a retry that lands on another worker is still counted again.
+
+The statistics are a merged_state.MergedState: every process merges its own updates into
+FEEDBACK_STATS_PATH every FEEDBACK_STATS_SAVE_SECONDS and at exit.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from merged_state import RowTable, MergedState, process_wide
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FEEDBACK_STATS_PATH = os.environ.get("FEEDBACK_STATS_PATH", os.path.join("data", "feedback_stats.npz"))
+FEEDBACK_STATS_SAVE_SECONDS = float(os.environ.get("FEEDBACK_STATS_SAVE_SECONDS", 30))
+# Ids of the most recent records remembered per process, so a retried record is counted once
+FEEDBACK_STATS_SEEN_IDS = int(os.environ.get("FEEDBACK_STATS_SEEN_IDS", 100000))
+
+SCORE_FIELDS = ("behaviour", "communication", "satisfaction", "overall_rating")
+ENTITY_KINDS = {"employee": "employee_id", "branch": "branch_id"}
+
+MAX_SCORE = 10
+BIN_WIDTH = 0.5
+BINS = int(MAX_SCORE / BIN_WIDTH) + 1
+PERCENTILES = (25, 50, 75, 90)
+
+STATS_WINDOW_DAYS = 30
+# Trend compares the mean of the last TREND_DAYS days with the TREND_DAYS before them
+TREND_DAYS = 7
+
+ARTIFACT_FORMAT = 1
+
+
+def _day(timestamp):
+    return int(timestamp // 86400)
+
+
+def _timestamp(value):
+    """Epoch seconds from a record's timestamp (epoch number or ISO 8601 string); now if absent or invalid."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def _scores(data):
+    """The record's scores as floats, NaN where a score is missing or outside 0-10."""
+    scores = np.full(len(SCORE_FIELDS), np.nan)
+    for i, field in enumerate(SCORE_FIELDS):
+        try:
+            value = float(data.get(field))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= value <= MAX_SCORE:
+            scores[i] = value
+    return scores
+
+
+def _combine_moments(a, b):
+    """Chan et al.'s parallel combination of (count, mean, m2) arrays along the last axis."""
+    n_a, mean_a, m2_a = a[..., 0], a[..., 1], a[..., 2]
+    n_b, mean_b, m2_b = b[..., 0], b[..., 1], b[..., 2]
+    n = n_a + n_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * n_b / np.where(n > 0, n, 1), 0.0)
+        m2 = m2_a + m2_b + np.where(n > 0, delta ** 2 * n_a * n_b / np.where(n > 0, n, 1), 0.0)
+    return np.stack([n, mean, m2], axis=-1)
+
+
+def _combine_days(stamp_a, sums_a, counts_a, stamp_b, sums_b, counts_b):
+    """Merge day rings slot by slot: equal days add up, otherwise the more recent day wins."""
+    same = (stamp_a == stamp_b)[..., None]
+    newer_b = (stamp_b > stamp_a)[..., None]
+    sums = np.where(same, sums_a + sums_b, np.where(newer_b, sums_b, sums_a))
+    counts = np.where(same, counts_a + counts_b, np.where(newer_b, counts_b, counts_a))
+    return np.maximum(stamp_a, stamp_b), sums, counts
+
+
+class _Table(RowTable):
+    """Array-backed statistics for a set of entities, one row each."""
+    LABEL = "feedback stats"
+    ARTIFACT_FORMAT = ARTIFACT_FORMAT
+
+    @classmethod
+    def layout(cls):
+        fields = len(SCORE_FIELDS)
+        return {
+            "moments": ((fields, 3), np.float64, 0),
+            "histogram": ((fields, BINS), np.int64, 0),
+            "day_stamp": ((STATS_WINDOW_DAYS,), np.int64, -1),
+            "day_sum": ((STATS_WINDOW_DAYS, fields), np.float64, 0),
+            "day_count": ((STATS_WINDOW_DAYS, fields), np.int64, 0),
+        }
+
+    def add(self, key, scores, day):
+        row = self.row(key, create=True)
+        present = ~np.isnan(scores)
+        values = np.where(present, scores, 0.0)
+
+        # Welford update, only for the scores present in this record
+        moments = self.moments[row]
+        count = moments[:, 0] + present
+        delta = values - moments[:, 1]
+        mean = np.where(present, moments[:, 1] + delta / np.maximum(count, 1), moments[:, 1])
+        moments[:, 2] += np.where(present, delta * (values - mean), 0.0)
+        moments[:, 0], moments[:, 1] = count, mean
+
+        bins = np.rint(values / BIN_WIDTH).astype(np.int64)
+        fields = np.nonzero(present)[0]
+        self.histogram[row, fields, bins[fields]] += 1
+
+        slot = day % STATS_WINDOW_DAYS
+        if self.day_stamp[row, slot] != day:
+            if self.day_stamp[row, slot] > day:
+                return  # Older than the window kept for this entity
+            self.day_stamp[row, slot] = day
+            self.day_sum[row, slot] = 0.0
+            self.day_count[row, slot] = 0
+        self.day_sum[row, slot] += values
+        self.day_count[row, slot] += present
+
+    def merge_row(self, row, other, other_row):
+        self.moments[row] = _combine_moments(self.moments[row], other.moments[other_row])
+        self.histogram[row] += other.histogram[other_row]
+        self.day_stamp[row], self.day_sum[row], self.day_count[row] = _combine_days(
+            self.day_stamp[row], self.day_sum[row], self.day_count[row],
+            other.day_stamp[other_row], other.day_sum[other_row], other.day_count[other_row]
+        )
+
+
+def _summary(entry, today):
+    moments, histogram, day_stamp, day_sum, day_count = entry
+
+    def window(start, end):
+        # Mean per field over days in (today - start, today - end]
+        days = (day_stamp > today - start) & (day_stamp <= today - end)
+        counts = day_count[days].sum(axis=0)
+        sums = day_sum[days].sum(axis=0)
+        return [None if n == 0 else round(float(s / n), 3) for s, n in zip(sums, counts)]
+
+    recent, previous = window(TREND_DAYS, 0), window(2 * TREND_DAYS, TREND_DAYS)
+    month = window(STATS_WINDOW_DAYS, 0)
+    cumulative = np.cumsum(histogram, axis=1)
+    summary = {}
+    for i, field in enumerate(SCORE_FIELDS):
+        count = int(moments[i, 0])
+        if count == 0:
+            summary[field] = {"count": 0}
+            continue
+        percentiles = {
+            f"p{p}": float(np.searchsorted(cumulative[i], math.ceil(p / 100 * count)) * BIN_WIDTH)
+            for p in PERCENTILES
+        }
+        summary[field] = {
+            "count": count,
+            "mean": round(float(moments[i, 1]), 3),
+            "variance": round(float(moments[i, 2] / (count - 1)), 3) if count > 1 else 0.0,
+            **percentiles,
+            f"mean_{TREND_DAYS}d": recent[i],
+            f"mean_{STATS_WINDOW_DAYS}d": month[i],
+            "trend": None if recent[i] is None or previous[i] is None else round(recent[i] - previous[i], 3)
+        }
+    return summary
+
+
+class FeedbackStats(MergedState):
+    """
+    Per-employee and per-branch score statistics for one process, persisted to path.
+
+    Args:
+        path (str): npz file shared by every process; None keeps the statistics in memory only
+        save_seconds (float): How often pending updates are merged into the file
+    """
+    TABLE = _Table
+
+    def __init__(self, path=FEEDBACK_STATS_PATH, save_seconds=FEEDBACK_STATS_SAVE_SECONDS):
+        super().__init__(path, save_seconds)
+        self._seen = OrderedDict()
+
+    def record(self, data):
+        """
+        Add the scores of one feedback record to its employee and branch.
+
+        Returns:
+            bool: False if the record has no valid score, or its id was recorded before
+        """
+        scores = _scores(data)
+        if np.isnan(scores).all():
+            return False
+        day = _day(_timestamp(data.get("timestamp")))
+        record_id = data.get("id")
+        with self._lock:
+            if record_id is not None:
+                if str(record_id) in self._seen:
+                    return False
+                self._seen[str(record_id)] = None
+                if len(self._seen) > FEEDBACK_STATS_SEEN_IDS:
+                    self._seen.popitem(last=False)
+            for kind, field in ENTITY_KINDS.items():
+                entity_id = data.get(field)
+                if entity_id is not None:
+                    self._delta.add((kind, str(entity_id)), scores, day)
+        self._updated()
+        return True
+
+    def stats(self, kind, entity_id):
+        """
+        Summary statistics of one employee or branch.
+
+        Returns:
+            dict: Per score field count, mean, variance, percentiles, window means and trend;
+                None if nothing was recorded for the entity
+        """
+        key = (kind, str(entity_id))
+        with self._lock:
+            entries = [entry for entry in (table.entry(key) for table in self._tables()) if entry is not None]
+            if not entries:
+                return None
+            entry = tuple(np.copy(array) for array in entries[0])
+            for other in entries[1:]:
+                entry = (
+                    _combine_moments(entry[0], other[0]),
+                    entry[1] + other[1],
+                    *_combine_days(entry[2], entry[3], entry[4], other[2], other[3], other[4])
+                )
+        return {"kind": kind, "id": str(entity_id), "scores": _summary(entry, _day(time.time()))}
+
+
+_feedback_stats = process_wide(FeedbackStats)
+
+
+def get_feedback_stats():
+    """Return the process-wide FeedbackStats, loading it from FEEDBACK_STATS_PATH on first use."""
+    return _feedback_stats()
+
+
+def describe(kind, entity_id):
+    """A one-line description of an entity's overall rating, or None if nothing is recorded."""
+    stats = get_feedback_stats().stats(kind, entity_id)
+    overall = stats and stats["scores"]["overall_rating"]
+    if not overall or not overall["count"]:
+        return None
+    text = f"{kind.capitalize()} {entity_id} averages {overall['mean']:.1f}/10 overall across {overall['count']} feedback record{'s' if overall['count'] != 1 else ''}"
+    if overall["trend"]:
+        text += f", {'up' if overall['trend'] > 0 else 'down'} {abs(overall['trend']):.1f} over the last {TREND_DAYS} days"
+    return text + "."
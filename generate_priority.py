@@ -3,6 +3,8 @@ import json
 import logging
 import re
 from groq import Groq
+from metrics import timed
+from priority_engine import financial_priority
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,9 +15,22 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if not GROQ_API_KEY:
     logger.warning("GROQ_API_KEY environment variable not set. Priority generation will use rule-based approach only.")
 
+# Keywords and phrases that make a query critical
+CRITICAL_PATTERNS = [
+    r'\bfraud\b', r'\bstolen\b', r'\bhack\b', r'\bphish\b', r'\bunauthorized\b',
+    r'\bblock\b.*\bcard\b', r'\blost\b.*\bcard\b', r'\bstolen\b.*\bcard\b',
+    r'\bwrong\b.*\btransaction\b', r'\bfailed\b.*\btransaction\b',
+    r'\bfrozen\b.*\baccount\b', r'\blocked\b.*\baccount\b',
+    r'\bscam\b', r'\btheft\b', r'\bcompromised\b', r'\bsuspicious\b',
+    r'\bemergency\b', r'\burgent\b', r'\bimmediate\b', r'\bcritical\b'
+]
+
+# One alternation, so a query is scanned once instead of once per pattern
+CRITICAL_RE = re.compile("|".join(f"(?:{pattern})" for pattern in CRITICAL_PATTERNS))
+
 def calculate_financial_priority(cibil_score, holdings, annual_income, loans):
     """
-    Calculate priority based on financial parameters.
+    Calculate priority based on financial parameters, using the rules in priority_engine.FINANCIAL_RULES.
     
     Args:
         cibil_score (int/float): Customer's CIBIL score (300-900)
@@ -27,61 +42,7 @@ def calculate_financial_priority(cibil_score, holdings, annual_income, loans):
         str: Priority level ('low', 'medium', 'high')
     """
     try:
-        # Convert inputs to appropriate types
-        try:
-            cibil_score = float(cibil_score) if cibil_score is not None else 700
-            holdings = float(holdings) if holdings is not None else 0
-            annual_income = float(annual_income) if annual_income is not None else 0
-            loans = float(loans) if loans is not None else 0
-        except (ValueError, TypeError):
-            logger.warning("Invalid financial parameters provided, using defaults")
-            cibil_score = 700
-            holdings = 0
-            annual_income = 0
-            loans = 0
-        
-        # Calculate priority based on financial parameters
-        priority_score = 0
-        
-        # CIBIL Score contribution (higher score = higher priority)
-        if cibil_score >= 800:
-            priority_score += 3
-        elif cibil_score >= 700:
-            priority_score += 2
-        elif cibil_score >= 600:
-            priority_score += 1
-        
-        # Holdings contribution (higher holdings = higher priority)
-        if holdings >= 1000000:  # 10 lakhs or more
-            priority_score += 3
-        elif holdings >= 100000:  # 1 lakh or more
-            priority_score += 2
-        elif holdings >= 10000:   # 10k or more
-            priority_score += 1
-        
-        # Annual income contribution (higher income = higher priority)
-        if annual_income >= 1000000:  # 10 lakhs or more
-            priority_score += 3
-        elif annual_income >= 500000:  # 5 lakhs or more
-            priority_score += 2
-        elif annual_income >= 250000:  # 2.5 lakhs or more
-            priority_score += 1
-        
-        # Loans contribution (higher loans = higher priority, as they're more valuable customers)
-        if loans >= 5000000:  # 50 lakhs or more
-            priority_score += 3
-        elif loans >= 1000000:  # 10 lakhs or more
-            priority_score += 2
-        elif loans >= 100000:   # 1 lakh or more
-            priority_score += 1
-        
-        # Determine priority level based on score
-        if priority_score >= 8:
-            return "high"
-        elif priority_score >= 4:
-            return "medium"
-        else:
-            return "low"
+        return financial_priority(cibil_score, holdings, annual_income, loans)
     except Exception as e:
         logger.error(f"Error calculating financial priority: {str(e)}")
         return "medium"  # Default to medium priority on error
@@ -99,25 +60,9 @@ def check_critical_query(query_text):
     if not query_text:
         return False
     
-    query_lower = query_text.lower()
-    
-    # Critical keywords
-    critical_patterns = [
-        r'\bfraud\b', r'\bstolen\b', r'\bhack\b', r'\bphish\b', r'\bunauthorized\b',
-        r'\bblock\b.*\bcard\b', r'\blost\b.*\bcard\b', r'\bstolen\b.*\bcard\b',
-        r'\bwrong\b.*\btransaction\b', r'\bfailed\b.*\btransaction\b',
-        r'\bfrozen\b.*\baccount\b', r'\blocked\b.*\baccount\b',
-        r'\bscam\b', r'\btheft\b', r'\bcompromised\b', r'\bsuspicious\b',
-        r'\bemergency\b', r'\burgent\b', r'\bimmediate\b', r'\bcritical\b'
-    ]
-    
-    # Check for critical patterns
-    for pattern in critical_patterns:
-        if re.search(pattern, query_lower):
-            return True
-    
-    return False
+    return CRITICAL_RE.search(query_text.lower()) is not None
 
+@timed("priority")
 def generate_priority(cibil_score, holdings, annual_income, loans, query_text):
     """
     Generate priority based on customer data and query content.
@@ -1,12 +1,14 @@
 import json
 import logging
 import uuid
+from metrics import timed
 # from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@timed("ticket")
 def generate_ticket(
     query_id=None,
     query_type=None,
@@ -132,7 +134,7 @@ def generate_ticket(
 
 def save_ticket_to_file(ticket, filename=None):
     """
-    Save ticket to a JSON file.
+    Save ticket to a JSON file. The service persists its tickets in ticket_store instead.
     
     Args:
         ticket (dict): The ticket to save
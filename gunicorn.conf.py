@@ -0,0 +1,63 @@
+# gunicorn.conf.py - picked up automatically by `gunicorn app:app`
+import gc
+import glob
+import os
+import tempfile
+
+# Workers write their metrics here so /metrics can aggregate across all of them.
+# This must be set before any worker imports prometheus_client.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "idea-ml-metrics"))
+os.makedirs(metrics_dir, exist_ok=True)
+
+# Import the app once in the master; workers are forked from it and share its modules, taxonomy
+# indexes, compiled patterns and loaded models copy-on-write instead of each building their own
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def on_starting(server):
+    # Drop the metric files of a previous run, which would otherwise be added to this run's
+    # totals; only prometheus_client's own files, as the directory may be shared or set by hand.
+    # The master's files are kept: with preload_app it has already written them while importing
+    # the app, and no worker has been forked yet
+    own = f"_{os.getpid()}.db"
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        if path.endswith(own):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    # Models are otherwise loaded on the first request of every worker
+    from local_classifier import get_local_classifier
+    from option_table import get_option_table
+    get_local_classifier()
+    get_option_table()
+    # Move everything built so far out of the collector's reach: collections in the workers would
+    # otherwise write to these objects' headers and copy the shared pages into every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # A sync worker serves one request at a time, so its classifications have nothing to be
+    # batched with and would only wait out the window
+    from gunicorn.workers.sync import SyncWorker
+    if isinstance(worker, SyncWorker) and "CLASSIFY_BATCH_WINDOW_MS" not in os.environ:
+        import classify
+        classify.CLASSIFY_BATCH_WINDOW_MS = 0
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Open the ticket store now so tickets a previous run left in the outbox are delivered
+    # without waiting for new traffic
+    from ticket_store import get_ticket_store
+    get_ticket_store()
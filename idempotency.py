@@ -0,0 +1,158 @@
+"""
+Replay of finished requests by query_id.
+
+A retried query_id gets the stored result back instead of rerunning the pipeline (and creating
+a second ticket), as long as that result succeeded; reusing it with a different payload is a
+conflict. Results are kept in a
+per-process IdempotencyStore, and a query_id this process has not seen is looked up in the
+ticket store, which every worker writes: each ticket record carries the request_fingerprint of
+its payload, and its response ticket is rebuilt from the record. Identical requests in flight at
+the same time are coalesced by the endpoints through SingleFlight.
+
+Requests for one query_id that run at the same moment in different workers are not coalesced,
+and each stores its own ticket.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import record_cache
+from ticket_store import get_ticket_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# How long a result can be replayed, and how many results are kept at most
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 900))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 10000))
+
+# Fields of a ticket record that make up the ticket of the response (see generate_ticket)
+RESPONSE_TICKET_FIELDS = ("transcribed_text", "translated_query", "detected_language", "error_message")
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a query_id is reused with a different payload."""
+
+
+def payload_fingerprint(data):
+    """
+    Fingerprint a request payload so retries can be told apart from conflicting reuse of a query_id.
+
+    Args:
+        data (dict): The request payload
+
+    Returns:
+        str: Hex digest of the canonical JSON of the payload without its query_id and debug flag
+    """
+    payload = {key: value for key, value in data.items() if key not in ('query_id', 'debug')}
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Recent results keyed by query_id, bounded by age and by count (oldest evicted first).
+
+    Args:
+        ttl_seconds (float): How long a stored result can be replayed
+        max_entries (int): Maximum number of results kept
+    """
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, query_id, fingerprint):
+        """
+        Return the stored result for a retry of query_id, or None if there is none.
+
+        Raises:
+            IdempotencyConflict: If query_id was stored with a different payload
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(query_id)
+            # Entries taken over from the ticket store keep their age, so they can be out of order
+            if entry is not None and entry[2] < time.monotonic() - self.ttl_seconds:
+                del self._entries[query_id]
+                entry = None
+        if entry is None:
+            # Another worker may have answered it
+            entry = stored_ticket_result(query_id, self.ttl_seconds)
+            if entry is not None:
+                stored_fingerprint, result, created_at = entry
+                self.store(query_id, stored_fingerprint, result, stored_at=time.monotonic() - (time.time() - created_at))
+        record_cache("idempotency", entry is not None)
+        if entry is None:
+            return None
+        stored_fingerprint, result = entry[:2]
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict(f"query_id {query_id} was already used with a different payload")
+        return result
+
+    def store(self, query_id, fingerprint, result, stored_at=None):
+        """
+        Remember the result for query_id, unless it is not replayable.
+
+        Args:
+            stored_at (float): time.monotonic() the result's TTL counts from; now by default
+        """
+        if not replayable(result):
+            return
+        with self._lock:
+            self._entries.pop(query_id, None)
+            self._entries[query_id] = (fingerprint, result, time.monotonic() if stored_at is None else stored_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            query_id, (_, _, stored_at) = next(iter(self._entries.items()))
+            if stored_at >= cutoff:
+                break
+            del self._entries[query_id]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def replayable(result):
+    """
+    Whether a retry may get this result back: only when it succeeded. A ticket carrying an
+    error_message (such as a failed transcription) is not, so the retry redoes the work.
+    """
+    return result.get("success", True) and "error_message" not in (result.get("ticket") or {})
+
+
+def stored_ticket_result(query_id, ttl_seconds):
+    """
+    The newest successful ticket stored for query_id within ttl_seconds, as the response it was sent with.
+
+    Returns:
+        tuple: (fingerprint, result, created_at epoch seconds), or None if no such ticket is stored
+    """
+    try:
+        store = get_ticket_store()
+        tickets = store.by_query_id(query_id) if store is not None else []
+    except Exception as e:
+        logger.error(f"Error looking up query_id {query_id} in the ticket store: {str(e)}")
+        return None
+    cutoff = time.time() - ttl_seconds
+    for record in reversed(tickets):
+        if record.get("request_fingerprint") is None or record.get("created_at", 0) < cutoff:
+            continue
+        ticket = {field: record[field] for field in RESPONSE_TICKET_FIELDS if field in record}
+        result = {"ticket": ticket}
+        if record.get("success") is False or not replayable(result):
+            continue
+        return record["request_fingerprint"], result, record["created_at"]
+    return None
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,344 @@
+"""
+Local first-tier classifier distilled from the LLM's own classifications.
+
+With LOG_CLASSIFICATION_LABELS=true, the classification the LLM gives each query is appended to
+a JSONL label log (the raw query text included, which is why it is off by default). The pipeline
+logs only the label it accepts, once per classified query, and the lines are written by a
+background writer, off the request path. The training command fits
+a multinomial naive Bayes model over hashed word unigrams and bigrams, one class per
+department/service_type/subsubcategory leaf, and calibrates its confidence with a temperature
+fitted on a held-out split. The model is saved as a versioned .npz artifact holding only the
+features seen in training, so it stays small and loads in milliseconds.
+
+Train with:
+    python local_classifier.py train --labels data/labels/classifications.jsonl --output-dir models
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from batching import MicroBatcher
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+LOG_CLASSIFICATION_LABELS = os.environ.get("LOG_CLASSIFICATION_LABELS", "false").lower() == "true"
+LABEL_LOG_PATH = os.environ.get("LABEL_LOG_PATH", os.path.join("data", "labels", "classifications.jsonl"))
+LOCAL_CLASSIFIER_DIR = os.environ.get("LOCAL_CLASSIFIER_DIR", "models")
+# Explicit artifact to load; by default the newest one in LOCAL_CLASSIFIER_DIR is used
+LOCAL_CLASSIFIER_PATH = os.environ.get("LOCAL_CLASSIFIER_PATH")
+# Calibrated confidence at or above which the local answer is used instead of the LLM
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", 0.9))
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_PREFIX = "local_classifier-"
+HASH_BITS = 20
+LABEL_KEYS = ("department", "service_type", "subsubcategory")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _write_labels(records):
+    """Batch handler of the label writer: append the records to the label log."""
+    try:
+        os.makedirs(os.path.dirname(LABEL_LOG_PATH) or ".", exist_ok=True)
+        with open(LABEL_LOG_PATH, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    except OSError as e:
+        logger.error(f"Error logging {len(records)} classification labels: {str(e)}")
+    return [None] * len(records)
+
+
+# One writer thread appends every label, so requests never wait on the file
+_label_writer = MicroBatcher(_write_labels, window_ms=100, max_batch_size=256, max_concurrent_batches=1,
+                             name="label-log")
+
+
+def log_label(text, classification, model=None):
+    """Queue an LLM classification for the label log, for later training."""
+    if not LOG_CLASSIFICATION_LABELS or not text:
+        return
+    _label_writer.submit(
+        {"text": text, **{key: classification.get(key) for key in LABEL_KEYS}, "model": model, "ts": time.time()}
+    )
+
+
+def hashed_features(text, hash_bits=HASH_BITS):
+    """Hash the word unigrams and bigrams of the text into feature ids."""
+    tokens = _TOKEN_RE.findall(text.casefold())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    mask = (1 << hash_bits) - 1
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) & mask for gram in grams), dtype=np.int64, count=len(grams))
+
+
+class LocalClassifier:
+    """
+    Hashed n-gram naive Bayes over classification leaves.
+
+    Scores are stored relative to an unseen feature: a class scores
+    log_prior + n_features * unseen + sum(count * delta) over the features seen in training.
+    """
+    def __init__(self, labels, vocabulary, delta, unseen, log_prior, temperature, metadata):
+        self.labels = labels
+        self.vocabulary = vocabulary
+        self.delta = delta
+        self.unseen = unseen
+        self.log_prior = log_prior
+        self.temperature = temperature
+        self.metadata = metadata
+
+    @property
+    def version(self):
+        return self.metadata.get("version")
+
+    def scores(self, text):
+        """Uncalibrated log-joint score of every class."""
+        return self._score_features(hashed_features(text, self.metadata["hash_bits"]))
+
+    def _score_features(self, features):
+        scores = self.log_prior + len(features) * self.unseen
+        if len(features) and len(self.vocabulary):
+            ids, counts = np.unique(features, return_counts=True)
+            positions = np.minimum(np.searchsorted(self.vocabulary, ids), len(self.vocabulary) - 1)
+            known = self.vocabulary[positions] == ids
+            if known.any():
+                scores = scores + counts[known] @ self.delta[positions[known]]
+        return scores
+
+    def probabilities(self, text):
+        """Calibrated class probabilities for the text."""
+        scaled = self.scores(text) / self.temperature
+        scaled = np.exp(scaled - scaled.max())
+        return scaled / scaled.sum()
+
+    def predict(self, text):
+        """
+        Classify the text.
+
+        Returns:
+            tuple: (classification dict, calibrated confidence)
+        """
+        probabilities = self.probabilities(text)
+        best = int(np.argmax(probabilities))
+        classification = dict(zip(LABEL_KEYS, self.labels[best].split("/")))
+        return classification, float(probabilities[best])
+
+    def save(self, output_dir):
+        """Write the model as a versioned artifact and return its path."""
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{ARTIFACT_PREFIX}{self.metadata['version']}.npz")
+        np.savez_compressed(
+            path,
+            vocabulary=self.vocabulary,
+            delta=self.delta,
+            unseen=self.unseen,
+            log_prior=self.log_prior,
+            metadata=np.array(json.dumps({**self.metadata, "labels": self.labels, "temperature": self.temperature}))
+        )
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            if metadata.get("format") != ARTIFACT_FORMAT:
+                raise ValueError(f"Unsupported local classifier format {metadata.get('format')} in {path}")
+            return cls(
+                metadata.pop("labels"), artifact["vocabulary"], artifact["delta"], artifact["unseen"],
+                artifact["log_prior"], metadata.pop("temperature"), metadata
+            )
+
+
+def _fit(examples, labels, hash_bits, alpha):
+    """Fit naive Bayes counts on (features, label index) pairs."""
+    vocabulary = np.unique(np.concatenate([features for features, _ in examples] + [np.zeros(0, dtype=np.int64)]))
+    counts = np.zeros((len(vocabulary), len(labels)), dtype=np.float64)
+    class_counts = np.zeros(len(labels), dtype=np.float64)
+    for features, label in examples:
+        class_counts[label] += 1
+        if len(features):
+            np.add.at(counts[:, label], np.searchsorted(vocabulary, features), 1)
+
+    totals = counts.sum(axis=0)
+    denominator = totals + alpha * (len(vocabulary) + 1)
+    unseen = np.log(alpha / denominator)
+    delta = np.log((counts + alpha) / denominator) - unseen
+    log_prior = np.log(class_counts / class_counts.sum())
+    return vocabulary, delta.astype(np.float32), unseen.astype(np.float32), log_prior.astype(np.float32)
+
+
+def _fit_temperature(model, examples):
+    """Pick the temperature minimising the held-out negative log-likelihood."""
+    scores = np.array([model._score_features(features) for features, _ in examples])
+    targets = np.array([label for _, label in examples])
+    best_temperature, best_nll = 1.0, np.inf
+    for temperature in np.logspace(-1, 3, 81):
+        scaled = scores / temperature
+        scaled = scaled - scaled.max(axis=1, keepdims=True)
+        log_probabilities = scaled - np.log(np.exp(scaled).sum(axis=1, keepdims=True))
+        nll = -log_probabilities[np.arange(len(targets)), targets].mean()
+        if nll < best_nll:
+            best_temperature, best_nll = float(temperature), nll
+    return best_temperature
+
+
+def _calibration_report(model, examples, bins=10):
+    """Held-out accuracy and expected calibration error."""
+    confidences, hits = [], []
+    for features, label in examples:
+        scaled = model._score_features(features) / model.temperature
+        probabilities = np.exp(scaled - scaled.max())
+        probabilities /= probabilities.sum()
+        confidences.append(probabilities.max())
+        hits.append(int(np.argmax(probabilities)) == label)
+    confidences, hits = np.array(confidences), np.array(hits, dtype=float)
+    edges = np.linspace(0, 1, bins + 1)
+    ece = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidences > low) & (confidences <= high)
+        if in_bin.any():
+            ece += in_bin.mean() * abs(hits[in_bin].mean() - confidences[in_bin].mean())
+    covered = confidences >= LOCAL_CLASSIFIER_THRESHOLD
+    return {
+        "holdout_accuracy": float(hits.mean()),
+        "holdout_ece": float(ece),
+        "holdout_coverage_at_threshold": float(covered.mean()),
+        "holdout_accuracy_at_threshold": float(hits[covered].mean()) if covered.any() else None
+    }
+
+
+def train(records, hash_bits=HASH_BITS, alpha=0.1, min_count=3, holdout=0.2, seed=0):
+    """
+    Train a LocalClassifier from label log records.
+
+    Args:
+        records (list): Dicts with text, department, service_type and subsubcategory
+        hash_bits (int): Size of the feature hash space in bits
+        alpha (float): Additive smoothing
+        min_count (int): Leaves with fewer examples are left out
+        holdout (float): Share of examples used to calibrate the confidence
+
+    Returns:
+        LocalClassifier: The model, trained on all examples, with its calibration metadata
+    """
+    # The latest label wins when the same text was logged more than once
+    latest = {}
+    for record in records:
+        if record.get("text") and all(record.get(key) for key in LABEL_KEYS):
+            latest[" ".join(record["text"].split()).casefold()] = "/".join(record[key] for key in LABEL_KEYS)
+    label_counts = {}
+    for label in latest.values():
+        label_counts[label] = label_counts.get(label, 0) + 1
+    labels = sorted(label for label, count in label_counts.items() if count >= min_count)
+    if len(labels) < 2:
+        raise ValueError(f"Need at least two leaves with {min_count}+ examples, got {len(labels)}")
+    index = {label: i for i, label in enumerate(labels)}
+    examples = [(hashed_features(text, hash_bits), index[label]) for text, label in latest.items() if label in index]
+
+    order = np.random.default_rng(seed).permutation(len(examples))
+    split = int(len(examples) * (1 - holdout))
+    fit_examples = [examples[i] for i in order[:split]]
+    held_out = [examples[i] for i in order[split:]]
+
+    metadata = {
+        "format": ARTIFACT_FORMAT,
+        "version": time.strftime("%Y%m%d%H%M%S"),
+        "hash_bits": hash_bits,
+        "alpha": alpha,
+        "examples": len(examples),
+    }
+    temperature = 1.0
+    if held_out:
+        calibration_model = LocalClassifier(labels, *_fit(fit_examples, labels, hash_bits, alpha), 1.0, metadata)
+        temperature = _fit_temperature(calibration_model, held_out)
+        calibration_model.temperature = temperature
+        metadata.update(_calibration_report(calibration_model, held_out))
+
+    return LocalClassifier(labels, *_fit(examples, labels, hash_bits, alpha), temperature, metadata)
+
+
+def latest_artifact(directory=LOCAL_CLASSIFIER_DIR):
+    """Path of the newest artifact in the directory, or None."""
+    try:
+        names = sorted(name for name in os.listdir(directory)
+                       if name.startswith(ARTIFACT_PREFIX) and name.endswith(".npz"))
+    except FileNotFoundError:
+        return None
+    return os.path.join(directory, names[-1]) if names else None
+
+
+_classifier = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier():
+    """Return the deployed local classifier, loading it on first use; None if there is no artifact."""
+    global _classifier, _classifier_loaded
+    if _classifier_loaded:
+        return _classifier
+    with _classifier_lock:
+        if not _classifier_loaded:
+            path = LOCAL_CLASSIFIER_PATH or latest_artifact()
+            if path:
+                try:
+                    start = time.perf_counter()
+                    _classifier = LocalClassifier.load(path)
+                    logger.info(f"Loaded local classifier {_classifier.version} from {path} "
+                                f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+                except Exception as e:
+                    logger.error(f"Error loading local classifier from {path}: {str(e)}")
+            _classifier_loaded = True
+    return _classifier
+
+
+def local_classify(text):
+    """
+    Classify with the local model.
+
+    Returns:
+        dict: The classification plus its calibrated confidence, or None if no model is deployed
+    """
+    classifier = get_local_classifier()
+    if classifier is None or not text:
+        return None
+    classification, confidence = classifier.predict(text)
+    return {**classification, "confidence": confidence}
+
+
+def is_confident(local_result):
+    return local_result is not None and local_result["confidence"] >= LOCAL_CLASSIFIER_THRESHOLD
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local classifier tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="Train a model from the label log")
+    train_parser.add_argument("--labels", default=LABEL_LOG_PATH)
+    train_parser.add_argument("--output-dir", default=LOCAL_CLASSIFIER_DIR)
+    train_parser.add_argument("--min-count", type=int, default=3)
+    train_parser.add_argument("--alpha", type=float, default=0.1)
+    train_parser.add_argument("--hash-bits", type=int, default=HASH_BITS)
+    predict_parser = subparsers.add_parser("predict", help="Classify a text with the deployed model")
+    predict_parser.add_argument("text")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        with open(args.labels, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        model = train(records, hash_bits=args.hash_bits, alpha=args.alpha, min_count=args.min_count)
+        path = model.save(args.output_dir)
+        print(f"Saved {len(model.labels)}-leaf model to {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+        print(json.dumps(model.metadata, indent=2))
+    else:
+        print(local_classify(args.text))
+
+
+if __name__ == "__main__":
+    main()
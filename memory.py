@@ -0,0 +1,276 @@
+"""
+Memory accounting and budgets for the video path.
+
+Every tracked stage records its RSS delta (and, with MEMORY_TRACEMALLOC=true, the Python heap
+peak from tracemalloc) into metrics and into the current request's debug details. Video work
+reserves a per-request budget before it starts: if the reservation does not fit, the request
+waits up to MEMORY_QUEUE_TIMEOUT seconds and is then refused with MemoryBudgetExceeded instead
+of letting the worker be OOM-killed.
+
+Two budgets can be set, both off by default:
+- MAX_HOST_MEMORY_MB is shared by every worker process on the host. It is split into slots of
+  MAX_REQUEST_MEMORY_MB, each an exclusive byte-range lock on MEMORY_BUDGET_LOCK_PATH, so a
+  crashed worker's slots are freed by the kernel. This is the budget that matters under sync
+  gunicorn workers, which handle one request per process: there the videos that run at the same
+  time are all in different processes.
+- MAX_PROCESS_MEMORY_MB bounds one process: the reservations of its in-flight requests plus its
+  current RSS must fit, including for the first request. It only limits concurrency within
+  threaded or asyncio workers.
+"""
+import asyncio
+import fcntl
+import functools
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from metrics import (
+    STAGE_MEMORY_DELTA, PROCESS_MEMORY_PEAK, MEMORY_RESERVED, MEMORY_REJECTIONS, record_request_info
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# 0 disables the host-wide and the per-process budget
+MAX_HOST_MEMORY_MB = float(os.environ.get("MAX_HOST_MEMORY_MB", 0))
+MAX_PROCESS_MEMORY_MB = float(os.environ.get("MAX_PROCESS_MEMORY_MB", 0))
+MEMORY_BUDGET_LOCK_PATH = os.environ.get(
+    "MEMORY_BUDGET_LOCK_PATH", os.path.join(tempfile.gettempdir(), "idea-ml-memory-budget.lock")
+)
+MAX_REQUEST_MEMORY_MB = float(os.environ.get("MAX_REQUEST_MEMORY_MB", 512))
+MEMORY_QUEUE_TIMEOUT = float(os.environ.get("MEMORY_QUEUE_TIMEOUT", 30))
+# How often a waiting request re-checks for room; other processes and RSS changes do not notify
+MEMORY_POLL_SECONDS = 0.25
+MEMORY_TRACEMALLOC = os.environ.get("MEMORY_TRACEMALLOC", "false").lower() == "true"
+
+if MEMORY_TRACEMALLOC:
+    tracemalloc.start()
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when work is refused because it would exceed a memory budget."""
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak rather than the current size, but is the best available here
+        return peak_rss()
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_memory(stage):
+    """Record the RSS delta (and tracemalloc peak, if enabled) of the enclosed block as the given stage."""
+    rss_before = current_rss()
+    if MEMORY_TRACEMALLOC:
+        tracemalloc.reset_peak()
+        heap_before = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        delta = current_rss() - rss_before
+        STAGE_MEMORY_DELTA.labels(stage).observe(max(delta, 0))
+        PROCESS_MEMORY_PEAK.set(peak_rss())
+        details = {"rss_delta_bytes": delta}
+        if MEMORY_TRACEMALLOC:
+            # The tracemalloc peak is process-wide, so concurrent requests are included in it
+            details["heap_peak_bytes"] = tracemalloc.get_traced_memory()[1] - heap_before
+        record_request_info(f"memory_{stage}", details)
+        if delta > MAX_REQUEST_MEMORY_MB * MB:
+            logger.warning(f"Stage {stage} grew RSS by {delta / MB:.0f} MB, over the per-request budget")
+
+
+def tracked_memory(stage):
+    """Decorator form of track_memory."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_memory(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class HostSlots:
+    """
+    Reservation slots shared by every process on the host, one exclusive byte-range lock each.
+
+    Args:
+        path (str): Lock file, created if missing
+        count (int): Number of slots
+    """
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+        self._held = set()
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # Record locks belong to the process, and a forked worker holds none of its parent's
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a+b")
+            self._pid = os.getpid()
+            self._held = set()
+        return self._file
+
+    def try_acquire(self):
+        """Lock a free slot; returns its number, or None if every slot is taken."""
+        with self._lock:
+            lock_file = self._open()
+            for slot in range(self.count):
+                # Locks of this process do not conflict with each other, so its own slots are skipped
+                if slot in self._held:
+                    continue
+                try:
+                    fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+                except OSError:
+                    continue
+                self._held.add(slot)
+                return slot
+            return None
+
+    def release(self, slot):
+        with self._lock:
+            if slot in self._held:
+                fcntl.lockf(self._file, fcntl.LOCK_UN, 1, slot)
+                self._held.discard(slot)
+
+    def held(self):
+        return len(self._held)
+
+
+Reservation = namedtuple("Reservation", "nbytes slot")
+
+
+class MemoryBudget:
+    """
+    Memory budget shared by concurrent video requests, on the host and within the process.
+
+    Args:
+        process_limit_mb (float): Total memory the process may use; 0 disables the process budget
+        request_limit_mb (float): Memory reserved for each request
+        queue_timeout (float): How long a request waits for room before it is refused
+        host_limit_mb (float): Memory all processes on the host may reserve; 0 disables it
+        lock_path (str): Lock file holding the host-wide slots
+    """
+    def __init__(self, process_limit_mb=MAX_PROCESS_MEMORY_MB, request_limit_mb=MAX_REQUEST_MEMORY_MB,
+                 queue_timeout=MEMORY_QUEUE_TIMEOUT, host_limit_mb=MAX_HOST_MEMORY_MB,
+                 lock_path=MEMORY_BUDGET_LOCK_PATH):
+        self.process_limit = int(process_limit_mb * MB)
+        self.request_limit = int(request_limit_mb * MB)
+        self.queue_timeout = queue_timeout
+        self.host_slots = None
+        if host_limit_mb:
+            self.host_slots = HostSlots(lock_path, max(1, int(host_limit_mb // request_limit_mb)))
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.reserved + nbytes <= self.process_limit and current_rss() + nbytes <= self.process_limit
+
+    def _try_reserve(self, nbytes):
+        with self._condition:
+            if self.process_limit and not self._fits(nbytes):
+                return None
+            slot = None
+            if self.host_slots is not None:
+                slot = self.host_slots.try_acquire()
+                if slot is None:
+                    return None
+            self.reserved += nbytes
+            MEMORY_RESERVED.set(self.reserved)
+            return Reservation(nbytes, slot)
+
+    def _refuse(self):
+        MEMORY_REJECTIONS.inc()
+        host = ""
+        if self.host_slots is not None:
+            host = f", {self.host_slots.count} host slots of {self.request_limit / MB:.0f} MB"
+        return MemoryBudgetExceeded(
+            f"Memory budget exhausted ({self.reserved / MB:.0f} MB reserved, "
+            f"{current_rss() / MB:.0f} MB resident{host}); try again later"
+        )
+
+    def acquire(self, nbytes=None, timeout=None):
+        """
+        Reserve memory for a request, waiting for room if needed.
+
+        Returns:
+            Reservation: To be passed to release(); 0 when no budget is set
+
+        Raises:
+            MemoryBudgetExceeded: If no room became available within the timeout
+        """
+        if not self.process_limit and self.host_slots is None:
+            return 0
+        nbytes = self.request_limit if nbytes is None else nbytes
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+
+        with self._condition:
+            while True:
+                reservation = self._try_reserve(nbytes)
+                if reservation is not None:
+                    return reservation
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._refuse()
+                self._condition.wait(min(remaining, MEMORY_POLL_SECONDS))
+
+    async def aacquire(self, nbytes=None, timeout=None):
+        """Asyncio variant of acquire; waiting requests sleep on the event loop instead of holding threads."""
+        if not self.process_limit and self.host_slots is None:
+            return 0
+        nbytes = self.request_limit if nbytes is None else nbytes
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+
+        while True:
+            reservation = self._try_reserve(nbytes)
+            if reservation is not None:
+                return reservation
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._refuse()
+            await asyncio.sleep(min(remaining, MEMORY_POLL_SECONDS))
+
+    def release(self, reservation):
+        if not reservation:
+            return
+        with self._condition:
+            self.reserved -= reservation.nbytes
+            MEMORY_RESERVED.set(self.reserved)
+            if reservation.slot is not None:
+                self.host_slots.release(reservation.slot)
+            self._condition.notify_all()
+
+    def status(self):
+        return {
+            "process_limit_bytes": self.process_limit,
+            "request_limit_bytes": self.request_limit,
+            "reserved_bytes": self.reserved,
+            "host_slots": self.host_slots.count if self.host_slots is not None else 0,
+            "host_slots_held": self.host_slots.held() if self.host_slots is not None else 0,
+            "rss_bytes": current_rss(),
+            "peak_rss_bytes": peak_rss()
+        }
+
+
+memory_budget = MemoryBudget()
@@ -0,0 +1,221 @@
+"""
+Array-backed per-process state that the processes of a host merge into one npz file.
+
+A RowTable keeps NumPy arrays with one row per key, grown by doubling. A MergedState holds two
+of them: the snapshot it last read from its file and the delta of this process's own updates
+since then. Every save_seconds (and at exit) the delta is merged into the file under an
+exclusive lock and the merged table is reloaded as the new snapshot, so gunicorn workers
+converge on the same totals without double counting. Reads combine the tables of _tables():
+while a save is in progress the delta being saved stays readable, and it is replaced by the
+merged snapshot in one step, so a read never misses it or counts it twice.
+
+A file rebuilt from the source of truth records a high_water mark: the updates it already
+counts. Tables that log their updates (see RowTable.after) drop those from their delta when
+they merge, so a rebuild racing live workers does not count them twice.
+
+The saver thread is started on the first update rather than at construction, so that every
+forked worker gets its own (threads do not survive a fork); background threads elsewhere in the
+service start lazily for the same reason.
+
+feedback_stats and rollups are built on it.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_INITIAL_ROWS = 64
+
+
+class RowTable:
+    """
+    NumPy arrays with one row per key.
+
+    Subclasses set LABEL and ARTIFACT_FORMAT, describe their arrays in layout() and combine one
+    row of another table into one of theirs in merge_row().
+    """
+    LABEL = "state"
+    ARTIFACT_FORMAT = 1
+
+    def __init__(self, rows=_INITIAL_ROWS):
+        self.index = {}
+        # Set on a table rebuilt from the source of truth: updates up to it are counted
+        self.high_water = None
+        for name, (shape, dtype, fill) in self.layout().items():
+            setattr(self, name, np.full((rows,) + shape, fill, dtype=dtype))
+
+    @classmethod
+    def layout(cls):
+        """Array name -> (shape of one row, dtype, value of an unused row)."""
+        raise NotImplementedError
+
+    def merge_row(self, row, other, other_row):
+        raise NotImplementedError
+
+    def row(self, key, create=False):
+        row = self.index.get(key)
+        if row is None and create:
+            row = len(self.index)
+            layout = self.layout()
+            if row == len(getattr(self, next(iter(layout)))):
+                for name, (_, _, fill) in layout.items():
+                    array = getattr(self, name)
+                    grown = np.full((2 * len(array),) + array.shape[1:], fill, dtype=array.dtype)
+                    grown[:len(array)] = array
+                    setattr(self, name, grown)
+            self.index[key] = row
+        return row
+
+    def entry(self, key):
+        """The arrays of one key as a tuple in layout order, or None if it has no row."""
+        row = self.index.get(key)
+        if row is None:
+            return None
+        return tuple(getattr(self, name)[row] for name in self.layout())
+
+    def merge(self, other):
+        """Add every key of other into this table."""
+        for key, other_row in other.index.items():
+            self.merge_row(self.row(key, create=True), other, other_row)
+
+    def after(self, high_water):
+        """
+        The part of this table updated after high_water. Tables that do not log their updates
+        cannot tell and return themselves.
+        """
+        return self
+
+    def save(self, path):
+        rows = len(self.index)
+        keys = sorted(self.index, key=self.index.get)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                format=np.array(self.ARTIFACT_FORMAT),
+                keys=np.array(json.dumps([list(key) for key in keys])),
+                high_water=np.array(np.nan if self.high_water is None else self.high_water),
+                **{name: getattr(self, name)[:rows] for name in self.layout()}
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as artifact:
+            if int(artifact["format"]) != cls.ARTIFACT_FORMAT:
+                raise ValueError(f"Unsupported {cls.LABEL} format {int(artifact['format'])}")
+            keys = [tuple(key) for key in json.loads(str(artifact["keys"]))]
+            table = cls(rows=max(_INITIAL_ROWS, len(keys)))
+            for name in cls.layout():
+                getattr(table, name)[:len(keys)] = artifact[name]
+            if "high_water" in artifact.files and not np.isnan(artifact["high_water"]):
+                table.high_water = float(artifact["high_water"])
+        table.index = {key: row for row, key in enumerate(keys)}
+        return table
+
+
+@contextmanager
+def locked(path):
+    """Hold the exclusive lock that guards writes of the file at path."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class MergedState:
+    """
+    Snapshot plus delta of a RowTable, persisted to path.
+
+    Subclasses set TABLE to their RowTable class, update self._delta under self._lock and call
+    self._updated() afterwards, and read the sum of self._tables() under self._lock.
+
+    Args:
+        path (str): npz file shared by every process; None keeps the state in memory only
+        save_seconds (float): How often pending updates are merged into the file
+    """
+    TABLE = RowTable
+
+    def __init__(self, path, save_seconds):
+        self.path = path
+        self.save_seconds = save_seconds
+        self._lock = threading.Lock()
+        self._snapshot = self.TABLE()
+        self._saving = self.TABLE()
+        self._delta = self.TABLE()
+        self._saver = None
+        self._save_lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                self._snapshot = self.TABLE.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Could not load {self.TABLE.LABEL} from {path}: {str(e)}")
+
+    def _tables(self):
+        """The tables whose sum is the current state; call with self._lock held."""
+        return self._snapshot, self._saving, self._delta
+
+    def save(self):
+        """Merge the updates since the last save into the file and reload the merged totals."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                self._saving, self._delta = self._delta, self.TABLE()
+            saving = self._saving
+            try:
+                with locked(self.path):
+                    merged = self.TABLE.load(self.path) if os.path.exists(self.path) else self.TABLE()
+                    merged.merge(saving.after(merged.high_water))
+                    merged.save(self.path)
+                    with self._lock:
+                        self._snapshot, self._saving = merged, self.TABLE()
+            except Exception as e:
+                logger.error(f"Could not save {self.TABLE.LABEL} to {self.path}: {str(e)}")
+                # Keep the updates for the next attempt
+                with self._lock:
+                    saving.merge(self._delta)
+                    self._delta, self._saving = saving, self.TABLE()
+
+    def _updated(self):
+        if not self.path or (self._saver is not None and self._saver.is_alive()):
+            return
+        with self._lock:
+            if self._saver is None or not self._saver.is_alive():
+                self._saver = threading.Thread(target=self._save_periodically,
+                                               name=f"{self.TABLE.LABEL.replace(' ', '-')}-saver", daemon=True)
+                self._saver.start()
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(self.save_seconds)
+            self.save()
+
+
+def process_wide(factory):
+    """
+    A getter for one factory() instance per process, created on first use and saved at exit.
+
+    Returns:
+        callable: Taking no arguments
+    """
+    instance = None
+    lock = threading.Lock()
+
+    def get():
+        nonlocal instance
+        with lock:
+            if instance is None:
+                instance = factory()
+                atexit.register(instance.save)
+            return instance
+    return get
@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the query service.
+
+Under gunicorn, gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a shared directory so that
+every worker writes its samples there and /metrics aggregates all workers; without it the
+metrics of the current process are served.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_LATENCY = Histogram(
+    "query_stage_duration_seconds", "Time spent in each stage of the query pipeline",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Prompt and completion tokens used per model", ["model", "kind"]
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "Groq requests per model", ["model"]
+)
+CLASSIFICATIONS = Counter(
+    "classifications_total", "Classifications by the method that produced them (llm, local, table or fallback)", ["method"]
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)", ["cache", "result"]
+)
+QUEUE_WAIT = Histogram(
+    "queue_wait_seconds", "Time work items spend queued before they start", ["queue"], buckets=LATENCY_BUCKETS
+)
+STAGE_MEMORY_DELTA = Histogram(
+    "query_stage_rss_delta_bytes", "Growth of the resident set size during each stage", ["stage"],
+    buckets=tuple(2 ** n * 1024 * 1024 for n in range(0, 13))
+)
+PROCESS_MEMORY_PEAK = Gauge(
+    "process_peak_rss_bytes", "Peak resident set size of the worker process", multiprocess_mode="livemax"
+)
+MEMORY_RESERVED = Gauge(
+    "memory_budget_reserved_bytes", "Memory currently reserved by in-flight video requests", multiprocess_mode="livesum"
+)
+MEMORY_REJECTIONS = Counter(
+    "memory_budget_rejections_total", "Requests refused because the memory budget was exhausted"
+)
+LLM_OUTPUT_FAILURES = Counter(
+    "llm_output_failures_total", "LLM answers that could not be parsed or were not valid", ["task", "model", "reason"]
+)
+LABEL_RESOLUTIONS = Counter(
+    "label_resolutions_total", "LLM labels mapped onto the taxonomy, by how (exact, normalized, snapped, invalid)",
+    ["task", "how"]
+)
+LLM_REPAIRS = Counter(
+    "llm_repairs_total", "Repair retries after an invalid LLM answer, by whether they fixed it", ["task", "model", "result"]
+)
+ROUTING_DECISIONS = Counter(
+    "routing_decisions_total", "Model tier chosen per call, with the signal that decided", ["task", "tier", "reason"]
+)
+ROUTING_AUDITS = Counter(
+    "routing_audits_total", "Cheaper-tier answers recomputed on the escalation tier", ["task", "tier"]
+)
+ROUTING_OVERRIDES = Counter(
+    "routing_overrides_total", "Cheaper-tier answers replaced or contradicted by the escalation tier",
+    ["task", "tier", "reason"]
+)
+OUTBOX_DELIVERIES = Counter(
+    "outbox_deliveries_total", "Tickets handed to the downstream server, by result (delivered, retry, dead)", ["result"]
+)
+OUTBOX_DELIVERY_LAG = Histogram(
+    "outbox_delivery_lag_seconds", "Time from a ticket's commit to its acknowledged delivery", buckets=LATENCY_BUCKETS
+)
+OUTBOX_OLDEST_PENDING = Gauge(
+    "outbox_oldest_pending_seconds", "Age of the oldest ticket still waiting for delivery", multiprocess_mode="livemax"
+)
+
+
+class RequestTiming:
+    """Stage durations and debug details collected for a single request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.info = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        """Format the durations as a Server-Timing header value, including the total so far."""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def debug(self):
+        """Per-stage durations in milliseconds plus any details recorded for the request."""
+        return {
+            "timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            **self.info
+        }
+
+
+_request_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+@contextmanager
+def request_timing():
+    """Collect the stage durations of everything the enclosed request does, including work on pipeline threads."""
+    timing = RequestTiming()
+    token = _request_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _request_timing.reset(token)
+
+
+def record_request_info(key, value):
+    """Attach a debug detail to the current request, if one is being timed."""
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.info[key] = value
+
+
+def observe_stage(stage, seconds):
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as one observation of the stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator recording the duration of every call as the given stage; works on sync and async functions."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(model, response):
+    """Count the request and its token usage from a Groq chat completion response."""
+    LLM_REQUESTS.labels(model).inc()
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(model, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def record_classification(method, count=1):
+    CLASSIFICATIONS.labels(method).inc(count)
+
+
+def record_output_failure(task, model, reason):
+    LLM_OUTPUT_FAILURES.labels(task, model or "unknown", reason).inc()
+
+
+def record_label_resolution(task, how):
+    LABEL_RESOLUTIONS.labels(task, how).inc()
+
+
+def record_repair(task, model, fixed):
+    LLM_REPAIRS.labels(task, model, "fixed" if fixed else "failed").inc()
+
+
+def record_routing(task, tier, reason):
+    ROUTING_DECISIONS.labels(task, tier, reason).inc()
+
+
+def record_routing_audit(task, tier):
+    ROUTING_AUDITS.labels(task, tier).inc()
+
+
+def record_routing_override(task, tier, reason):
+    ROUTING_OVERRIDES.labels(task, tier, reason).inc()
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_queue_wait(queue_name, seconds):
+    QUEUE_WAIT.labels(queue_name).observe(seconds)
+
+
+def record_outbox_delivery(result, count=1):
+    OUTBOX_DELIVERIES.labels(result).inc(count)
+
+
+def observe_delivery_lag(seconds):
+    OUTBOX_DELIVERY_LAG.observe(seconds)
+
+
+def set_outbox_oldest_pending(seconds):
+    OUTBOX_OLDEST_PENDING.set(seconds)
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,259 @@
+"""
+Precompiled classifications for the predefined options of the front-end menu.
+
+A predefined_option query is one of a fixed list of texts, so detecting its language,
+translating and classifying it on every request repeats the same LLM calls. The build command
+runs each option through those steps once, keeps only answers that are leaves of the taxonomy,
+and writes a versioned JSON artifact keyed by the normalized option text. At runtime
+lookup_option() answers from the table; options missing from it go through the classification
+pipeline as before.
+
+Entries are checked against the taxonomy again when the artifact is loaded, so a table built
+before a taxonomy change never serves a leaf that no longer exists.
+
+Build with:
+    python option_table.py build --options options.json --output-dir models
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from taxonomy import LEAVES, is_valid
+from metrics import record_cache, record_classification
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+OPTION_TABLE_DIR = os.environ.get("OPTION_TABLE_DIR", "models")
+# Deploy a specific artifact instead of the newest one in OPTION_TABLE_DIR
+OPTION_TABLE_PATH = os.environ.get("OPTION_TABLE_PATH")
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_PREFIX = "option_table-"
+RESULT_KEYS = ("department", "service_type", "request_category", "detected_language", "translated_query")
+
+
+def option_key(option):
+    """Canonical form of an option text, the same as normalize_query_text."""
+    return " ".join(option.split()).casefold()
+
+
+def taxonomy_fingerprint():
+    """Short hash of the taxonomy leaves, recorded in the artifact to tell which taxonomy it was built for."""
+    leaves = json.dumps(sorted(LEAVES)).encode("utf-8")
+    return hashlib.sha256(leaves).hexdigest()[:12]
+
+
+class OptionTable:
+    """Classification results of the predefined options, keyed by option_key."""
+
+    def __init__(self, entries, metadata):
+        self.entries = entries
+        self.metadata = metadata
+
+    @property
+    def version(self):
+        return self.metadata.get("version")
+
+    def get(self, option):
+        """The classification result for the option, or None."""
+        entry = self.entries.get(option_key(option))
+        return {key: entry[key] for key in RESULT_KEYS} if entry is not None else None
+
+    def save(self, output_dir):
+        """Write the table as a versioned artifact and return its path."""
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{ARTIFACT_PREFIX}{self.metadata['version']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**self.metadata, "options": self.entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            artifact = json.load(f)
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported option table format {artifact.get('format')} in {path}")
+        entries = artifact.pop("options")
+        if artifact.get("taxonomy") != taxonomy_fingerprint():
+            stale = [key for key, entry in entries.items()
+                     if not is_valid(entry["department"], entry["service_type"], entry["request_category"])]
+            for key in stale:
+                del entries[key]
+            logger.warning(f"Option table {artifact.get('version')} was built for another taxonomy; "
+                           f"dropped {len(stale)} entries that are no longer leaves")
+        return cls(entries, artifact)
+
+
+def classify_option(option, model):
+    """
+    Run one option through language detection, translation and validated classification.
+
+    Returns:
+        dict: The classification result as the query endpoints return it, or None when the
+            model gave no valid leaf
+
+    Raises:
+        ValueError: When language detection or translation failed; both fall back silently at
+            runtime, and a fallback must not be stored in the table for good
+    """
+    # Imported here so loading the table at runtime does not pull in the Groq client
+    from classify import detect_language, translate_to_english, classify_validated, _needs_translation
+
+    detected_language = detect_language(option)
+    if detected_language == "unknown":
+        raise ValueError("language detection failed")
+    translated = None
+    if _needs_translation(detected_language):
+        translated = translate_to_english(option, detected_language).strip()
+        # translate_to_english returns the original text when the request fails
+        if not translated or translated == option.strip():
+            raise ValueError(f"translation from {detected_language} failed")
+    classification = classify_validated(translated or option, model)
+    if classification is None:
+        return None
+    return {
+        "department": classification["department"],
+        "service_type": classification["service_type"],
+        "request_category": classification["subsubcategory"],
+        "detected_language": detected_language,
+        "translated_query": translated or ""
+    }
+
+
+def build(options, model="mixtral-8x7b-32768", workers=4):
+    """
+    Classify every distinct option once.
+
+    Returns:
+        tuple: (OptionTable of the options that got a valid leaf, list of (option, reason) rejected)
+    """
+    distinct = {}
+    for option in options:
+        if option and option.strip():
+            distinct.setdefault(option_key(option), option.strip())
+
+    def run(option):
+        try:
+            return option, classify_option(option, model), None
+        except Exception as e:
+            return option, None, str(e)
+
+    entries, rejected = {}, []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for option, result, error in executor.map(run, distinct.values()):
+            if result is None:
+                rejected.append((option, error or "no valid taxonomy leaf"))
+            else:
+                entries[option_key(option)] = {"option": option, **result}
+
+    metadata = {
+        "format": ARTIFACT_FORMAT,
+        "version": time.strftime("%Y%m%d%H%M%S"),
+        "model": model,
+        "taxonomy": taxonomy_fingerprint(),
+        "entries": len(entries),
+        "rejected": len(rejected),
+    }
+    return OptionTable(entries, metadata), rejected
+
+
+def read_options(path):
+    """Options from a JSON list of strings, or a text file with one option per line."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            options = json.load(f)
+            if not isinstance(options, list) or not all(isinstance(option, str) for option in options):
+                raise ValueError(f"{path} must hold a JSON list of option strings")
+            return options
+        return [line.strip() for line in f if line.strip()]
+
+
+def latest_artifact(directory=OPTION_TABLE_DIR):
+    """Path of the newest artifact in the directory, or None."""
+    try:
+        names = sorted(name for name in os.listdir(directory)
+                       if name.startswith(ARTIFACT_PREFIX) and name.endswith(".json"))
+    except FileNotFoundError:
+        return None
+    return os.path.join(directory, names[-1]) if names else None
+
+
+_table = None
+_table_loaded = False
+_table_lock = threading.Lock()
+
+
+def get_option_table():
+    """Return the deployed option table, loading it on first use; None if there is no artifact."""
+    global _table, _table_loaded
+    if _table_loaded:
+        return _table
+    with _table_lock:
+        if not _table_loaded:
+            path = OPTION_TABLE_PATH or latest_artifact()
+            if path:
+                try:
+                    _table = OptionTable.load(path)
+                    logger.info(f"Loaded option table {_table.version} with {len(_table.entries)} options from {path}")
+                except Exception as e:
+                    logger.error(f"Error loading option table from {path}: {str(e)}")
+            _table_loaded = True
+    return _table
+
+
+def lookup_option(option):
+    """
+    Classification result of a predefined option from the deployed table.
+
+    Returns:
+        dict: department, service_type, request_category, detected_language and
+            translated_query, or None when the option is not in the table
+    """
+    table = get_option_table()
+    if table is None or not option:
+        return None
+    result = table.get(option)
+    record_cache("option_table", result is not None)
+    if result is not None:
+        record_classification("table")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predefined option table tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Classify the predefined options and write an artifact")
+    build_parser.add_argument("--options", required=True, help="JSON list or text file with one option per line")
+    build_parser.add_argument("--output-dir", default=OPTION_TABLE_DIR)
+    build_parser.add_argument("--model", default="mixtral-8x7b-32768")
+    build_parser.add_argument("--workers", type=int, default=4)
+    lookup_parser = subparsers.add_parser("lookup", help="Look an option up in the deployed table")
+    lookup_parser.add_argument("option")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        table, rejected = build(read_options(args.options), model=args.model, workers=args.workers)
+        for option, reason in rejected:
+            print(f"REJECTED {option!r}: {reason}", file=sys.stderr)
+        if not table.entries:
+            print("No option got a valid classification; nothing written", file=sys.stderr)
+            return 1
+        path = table.save(args.output_dir)
+        print(f"Saved {len(table.entries)} options to {path} ({len(rejected)} rejected)")
+        # Rejected options still work through the LLM path, but the build should be looked at
+        return 1 if rejected else 0
+    print(lookup_option(args.option))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
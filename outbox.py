@@ -0,0 +1,332 @@
+"""
+Transactional outbox delivering finished tickets to DEMO_SERVER_URL.
+
+attach_outbox() registers a write hook on the ticket store, so every ticket gets an outbox row
+in the same SQLite transaction that stores it: a ticket is either stored and queued for
+delivery, or neither, whatever crashes when.
+
+A delivery thread in each process claims due rows with a lease, POSTs them in batches as
+{"tickets": [...]} to DEMO_SERVER_URL + OUTBOX_DELIVERY_PATH over one keep-alive
+requests.Session, and marks them delivered on a 2xx answer. A batch is sent once
+OUTBOX_BATCH_SIZE tickets (or OUTBOX_BATCH_BYTES of JSON) are due, or when the oldest due
+ticket has waited OUTBOX_WINDOW_MS. Failures are retried with capped exponential backoff and
+full jitter, honouring Retry-After; a batch refused with a non-retryable 4xx is split so one
+bad ticket cannot hold back the others, and a single refused ticket is marked dead. While a
+batch is split its remaining rows have their lease renewed before every send, and rows whose
+lease was taken over meanwhile are left to the new owner.
+
+Leases keep workers from sending the same row concurrently, and a lease left by a crashed
+worker expires after OUTBOX_LEASE_SECONDS, so nothing is lost across restarts. Delivery is at
+least once: a crash between the server's answer and the delivered mark resends the ticket.
+Idempotency is per ticket, so it survives re-batching: the key of a ticket is its ticket_id,
+sent in the Idempotency-Key header when a request carries one ticket and in the
+Idempotency-Keys header (comma-separated, in body order) for batches, so the receiver can drop
+the repeats.
+
+Delivery is on when OUTBOX_ENABLED is true, which is the default once DEMO_SERVER_URL is set.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import record_outbox_delivery, observe_delivery_lag, set_outbox_oldest_pending
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEMO_SERVER_URL = os.environ.get("DEMO_SERVER_URL", "http://localhost:3000")
+OUTBOX_ENABLED = os.environ.get(
+    "OUTBOX_ENABLED", "true" if "DEMO_SERVER_URL" in os.environ else "false"
+).lower() == "true"
+OUTBOX_DELIVERY_PATH = os.environ.get("OUTBOX_DELIVERY_PATH", "/tickets")
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_BATCH_BYTES = int(os.environ.get("OUTBOX_BATCH_BYTES", 512 * 1024))
+OUTBOX_WINDOW_MS = float(os.environ.get("OUTBOX_WINDOW_MS", 200))
+OUTBOX_TIMEOUT_SECONDS = float(os.environ.get("OUTBOX_TIMEOUT_SECONDS", 10))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_BASE_SECONDS", 1))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get("OUTBOX_BACKOFF_MAX_SECONDS", 300))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", 60))
+# Delivered rows are kept this long for inspection, then pruned
+OUTBOX_RETENTION_SECONDS = float(os.environ.get("OUTBOX_RETENTION_SECONDS", 86400))
+
+# Longest the delivery thread sleeps without being woken by a new ticket
+IDLE_POLL_SECONDS = 1.0
+PRUNE_INTERVAL_SECONDS = 60.0
+RETRYABLE_STATUS = {408, 425, 429}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id TEXT NOT NULL UNIQUE,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status);
+"""
+
+
+def backoff_seconds(attempts, retry_after=None):
+    """Delay before retry number attempts: full jitter over a capped exponential, at least Retry-After."""
+    ceiling = min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Outbox:
+    """
+    Outbox rows of one ticket database and the delivery thread of this process.
+
+    Args:
+        store (TicketStore): Store whose write transactions also queue the tickets
+        url (str): Where batches are POSTed
+    """
+    def __init__(self, store, url):
+        self.store = store
+        self.url = url
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        connection = store._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._session = None
+        self._connection = None
+        self._last_prune = 0.0
+
+    def enqueue(self, connection, tickets):
+        """Write hook: queue the batch's tickets in the transaction that stores them."""
+        now = time.time()
+        connection.executemany(
+            "INSERT OR IGNORE INTO outbox (ticket_id, body, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+            [(ticket["ticket_id"], self.store.encode(ticket), now, now) for ticket in tickets]
+        )
+        self.ensure_started()
+        self._wake.set()
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                # A fork copies the parent's connection and session; neither may be shared
+                self._connection = self._session = None
+                self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                self._thread = threading.Thread(target=self._run, name="outbox-delivery", daemon=True)
+                self._thread.start()
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = self.store._connect()
+        return self._connection
+
+    def _http(self):
+        if self._session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.headers["Content-Type"] = "application/json"
+            self._session = session
+        return self._session
+
+    def _run(self):
+        while True:
+            # Cleared before looking, so a ticket queued while delivering still wakes the next wait
+            self._wake.clear()
+            try:
+                batch, wait_seconds = self.claim()
+                if batch:
+                    self.deliver(batch)
+                self._maintain()
+                if batch:
+                    continue
+            except Exception as e:
+                logger.error(f"Error in outbox delivery: {str(e)}")
+                wait_seconds = IDLE_POLL_SECONDS
+            self._wake.wait(wait_seconds)
+
+    def claim(self):
+        """
+        Lease the next batch of due rows to this process.
+
+        Returns:
+            tuple: (list of (seq, ticket_id, body, created_at, attempts) rows, seconds to wait when
+                the list is empty)
+        """
+        connection = self._db()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT seq, ticket_id, body, created_at, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? AND (lease_until IS NULL OR lease_until < ?) "
+                "ORDER BY seq LIMIT ?",
+                (now, now, OUTBOX_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                upcoming = connection.execute(
+                    "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+                connection.execute("COMMIT")
+                return [], IDLE_POLL_SECONDS if upcoming is None else min(IDLE_POLL_SECONDS, max(upcoming - now, 0.01))
+
+            # Wait for a fuller batch while the oldest fresh ticket is still inside the window
+            window_ends = rows[0][3] + OUTBOX_WINDOW_MS / 1000.0
+            if len(rows) < OUTBOX_BATCH_SIZE and rows[0][4] == 0 and window_ends > now:
+                connection.execute("COMMIT")
+                return [], window_ends - now
+
+            batch, size = [], 0
+            for row in rows:
+                if batch and size + len(row[2]) > OUTBOX_BATCH_BYTES:
+                    break
+                batch.append(row)
+                size += len(row[2]) + 1
+            connection.execute(
+                f"UPDATE outbox SET lease_owner = ?, lease_until = ? WHERE seq IN ({', '.join('?' * len(batch))})",
+                [self.owner, now + OUTBOX_LEASE_SECONDS] + [row[0] for row in batch]
+            )
+            connection.execute("COMMIT")
+            return batch, 0
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def deliver(self, batch):
+        """POST one claimed batch and record the outcome of every row."""
+        if len(batch) == 1:
+            headers = {"Idempotency-Key": batch[0][1]}
+        else:
+            headers = {"Idempotency-Keys": ", ".join(row[1] for row in batch)}
+        try:
+            response = self._http().post(
+                self.url,
+                data=('{"tickets": [' + ", ".join(row[2] for row in batch) + "]}").encode("utf-8"),
+                headers=headers,
+                timeout=OUTBOX_TIMEOUT_SECONDS
+            )
+        except requests.RequestException as e:
+            self._retry(batch, f"{type(e).__name__}: {str(e)}")
+            return
+
+        if 200 <= response.status_code < 300:
+            self._delivered(batch)
+        elif response.status_code >= 500 or response.status_code in RETRYABLE_STATUS:
+            self._retry(batch, f"HTTP {response.status_code}", _retry_after(response))
+        elif len(batch) > 1:
+            # Find the ticket the server refuses instead of holding back the whole batch
+            logger.warning(f"Downstream refused a batch of {len(batch)} with HTTP {response.status_code}; "
+                           "delivering its tickets one by one")
+            # Each send may take OUTBOX_TIMEOUT_SECONDS, longer in all than the lease taken for the batch
+            pending = batch
+            while pending:
+                pending = self._renew(pending)
+                if pending:
+                    self.deliver(pending[:1])
+                    pending = pending[1:]
+        else:
+            self._dead(batch, f"HTTP {response.status_code}: {response.text[:200]}")
+
+    def _update(self, sql, params, batch):
+        connection = self._db()
+        # Only rows this process still leases; an expired lease may have been taken over
+        connection.execute(
+            f"{sql} WHERE lease_owner = ? AND seq IN ({', '.join('?' * len(batch))})",
+            list(params) + [self.owner] + [row[0] for row in batch]
+        )
+
+    def _renew(self, batch):
+        """Extend the lease of the rows this process still holds; returns those rows."""
+        connection = self._db()
+        seqs = [row[0] for row in batch]
+        placeholders = ", ".join("?" * len(batch))
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                f"UPDATE outbox SET lease_until = ? WHERE lease_owner = ? AND status = 'pending' "
+                f"AND seq IN ({placeholders})",
+                [time.time() + OUTBOX_LEASE_SECONDS, self.owner] + seqs
+            )
+            held = {seq for (seq,) in connection.execute(
+                f"SELECT seq FROM outbox WHERE lease_owner = ? AND status = 'pending' AND seq IN ({placeholders})",
+                [self.owner] + seqs
+            )}
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [row for row in batch if row[0] in held]
+
+    def _delivered(self, batch):
+        now = time.time()
+        self._update("UPDATE outbox SET status = 'delivered', delivered_at = ?, lease_owner = NULL, "
+                     "lease_until = NULL, last_error = NULL", (now,), batch)
+        record_outbox_delivery("delivered", len(batch))
+        for row in batch:
+            observe_delivery_lag(now - row[3])
+
+    def _retry(self, batch, error, retry_after=None):
+        attempts = max(row[4] for row in batch) + 1
+        delay = backoff_seconds(attempts, retry_after)
+        logger.warning(f"Delivery of {len(batch)} tickets failed ({error}); retry {attempts} in {delay:.1f}s")
+        self._update("UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, lease_owner = NULL, "
+                     "lease_until = NULL, last_error = ?", (time.time() + delay, error), batch)
+        record_outbox_delivery("retry", len(batch))
+
+    def _dead(self, batch, error):
+        logger.error(f"Downstream refused ticket {batch[0][1]} ({error}); giving up on it")
+        self._update("UPDATE outbox SET status = 'dead', attempts = attempts + 1, lease_owner = NULL, "
+                     "lease_until = NULL, last_error = ?", (error,), batch)
+        record_outbox_delivery("dead", len(batch))
+
+    def _maintain(self):
+        """Refresh the lag gauge and prune old delivered rows."""
+        connection = self._db()
+        now = time.time()
+        oldest = connection.execute(
+            "SELECT created_at FROM outbox WHERE status = 'pending' ORDER BY seq LIMIT 1").fetchone()
+        set_outbox_oldest_pending(now - oldest[0] if oldest else 0.0)
+        if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+            self._last_prune = now
+            connection.execute("DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?",
+                               (now - OUTBOX_RETENTION_SECONDS,))
+
+
+def attach_outbox(store, url=None):
+    """
+    Queue every ticket the store writes for delivery, and start this process's delivery thread
+    so rows left by a previous run go out without waiting for new tickets.
+
+    Returns:
+        Outbox: The outbox, or None when OUTBOX_ENABLED is false
+    """
+    if not OUTBOX_ENABLED:
+        return None
+    outbox = Outbox(store, url or DEMO_SERVER_URL.rstrip("/") + OUTBOX_DELIVERY_PATH)
+    store.add_write_hook(outbox.enqueue)
+    outbox.ensure_started()
+    logger.info(f"Delivering tickets to {outbox.url}")
+    return outbox
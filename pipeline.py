@@ -0,0 +1,288 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from profiler import profiler
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Threads shared by every pipeline run in this process
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", 16))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide thread pool used to run pipeline stages."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+        return _executor
+
+
+class Stage:
+    """
+    A single step of a pipeline.
+
+    Args:
+        name (str): Unique stage name, also the key of its result
+        func (callable): Called with a dict of the results so far, returns the stage result
+        deps (tuple): Names of the stages that must finish before this one starts
+        when (callable): Optional predicate on the results; the stage is skipped (result None) if it returns False
+        speculation (str): Optional name of a stage that computes the same result ahead of time
+        speculation_valid (callable): Predicate on the results deciding whether the speculative result can be used
+    """
+    def __init__(self, name, func, deps=(), when=None, speculation=None, speculation_valid=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.when = when
+        self.speculation = speculation
+        self.speculation_valid = speculation_valid
+
+
+class PipelineRun:
+    """Bookkeeping for one execution of a stage graph, shared by the thread and asyncio schedulers."""
+
+    def __init__(self, stages, inputs=None, on_stage_done=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.results = dict(inputs or {})
+        self.on_stage_done = on_stage_done
+        self.started_at = {}
+        self.finished_at = {}
+        self.skipped = set()
+        self.discarded = set()
+        self.errors = {}
+        self.waiting = set(self.stages)
+        self.aliases = {}
+        self.adopted = {}
+        self.resubmit = []
+        self.start = time.perf_counter()
+        self.end = None
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages and dep not in self.results:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    def _done(self, name):
+        return name in self.results and (
+            name in self.finished_at or name in self.skipped or name not in self.stages
+        )
+
+    def take_ready(self):
+        """Resolve every stage whose dependencies are met and return the ones that must be executed."""
+        to_run, self.resubmit = self.resubmit, []
+        progress = True
+        while progress:
+            progress = False
+            for name in sorted(self.waiting):
+                stage = self.stages[name]
+                if not all(self._done(dep) for dep in stage.deps):
+                    continue
+                self.waiting.discard(name)
+                progress = True
+
+                if stage.when is not None and not stage.when(self.results):
+                    now = time.perf_counter()
+                    self.started_at[name] = self.finished_at[name] = now
+                    self.results[name] = None
+                    self.skipped.add(name)
+                    continue
+
+                speculation = stage.speculation
+                if speculation and speculation not in self.skipped and speculation not in self.errors:
+                    if stage.speculation_valid is None or stage.speculation_valid(self.results):
+                        if speculation in self.finished_at:
+                            self._adopt(name, speculation)
+                        else:
+                            # Finish together with the speculative stage instead of starting over
+                            self.started_at[name] = time.perf_counter()
+                            self.aliases[name] = speculation
+                        continue
+                    self.discard(speculation)
+
+                to_run.append(stage)
+        return to_run
+
+    def _adopt(self, name, speculation):
+        self.started_at.setdefault(name, self.started_at.get(speculation, time.perf_counter()))
+        self.results[name] = self.results[speculation]
+        self.finished_at[name] = self.finished_at[speculation]
+        self.adopted[name] = speculation
+        logger.debug(f"Stage '{name}' reused speculative result of '{speculation}'")
+        if self.on_stage_done:
+            self.on_stage_done(name, self.results[name])
+
+    def discard(self, name):
+        """Mark a speculative stage as invalid; its result (if any) is dropped."""
+        if name in self.discarded:
+            return
+        logger.debug(f"Discarding speculative stage '{name}'")
+        self.discarded.add(name)
+        self.waiting.discard(name)
+        self.results.pop(name, None)
+
+    def mark_started(self, name):
+        self.started_at[name] = time.perf_counter()
+
+    def finish(self, name, result):
+        if name in self.discarded:
+            return
+        self.results[name] = result
+        self.finished_at[name] = time.perf_counter()
+        if self.on_stage_done:
+            self.on_stage_done(name, result)
+        for alias, speculation in list(self.aliases.items()):
+            if speculation == name:
+                del self.aliases[alias]
+                self._adopt(alias, name)
+
+    def fail(self, name, error):
+        """Record a stage failure. Returns True if the failure must abort the run."""
+        if name in self.discarded:
+            return False
+        self.errors[name] = error
+        self.finished_at[name] = time.perf_counter()
+        waiting_aliases = [alias for alias, speculation in self.aliases.items() if speculation == name]
+        for alias in waiting_aliases:
+            # The speculation failed, so compute the real result after all
+            del self.aliases[alias]
+            self.resubmit.append(self.stages[alias])
+        if waiting_aliases:
+            return False
+        # A failed speculation nobody has asked for yet is simply dropped
+        return not any(stage.speculation == name for stage in self.stages.values())
+
+    def complete(self):
+        return all(name in self.finished_at or name in self.discarded for name in self.stages)
+
+    def durations(self):
+        """Return the duration of every stage that was executed, in seconds."""
+        return {
+            name: self.finished_at[name] - self.started_at[name]
+            for name in self.finished_at
+            if name in self.started_at and name not in self.skipped
+            and name not in self.discarded and name not in self.adopted
+        }
+
+    def critical_path(self):
+        """Return the chain of stages that determined the total latency, as (name, seconds) pairs."""
+        durations = self.durations()
+        if not durations:
+            return []
+        name = max(durations, key=lambda n: self.finished_at[n])
+        path = []
+        while name is not None:
+            path.append((name, durations.get(name, 0.0)))
+            stage = self.stages.get(name)
+            preds = [self.adopted.get(dep, dep) for dep in stage.deps] if stage else []
+            preds = [p for p in preds if p in durations]
+            name = max(preds, key=lambda n: self.finished_at[n]) if preds else None
+        path.reverse()
+        return path
+
+    def summary(self):
+        total = (self.end or time.perf_counter()) - self.start
+        serial = sum(self.durations().values())
+        path = " -> ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.critical_path())
+        return f"total={total * 1000:.0f}ms serial={serial * 1000:.0f}ms critical_path: {path or 'none'}"
+
+
+def _run_stage(func, results):
+    with profiler.track_thread():
+        return func(results)
+
+
+def _settle(run, name, future):
+    """Move a finished future into the run. Raises the stage error if it aborts the run."""
+    if future.cancelled():
+        return
+    try:
+        result = future.result()
+    except Exception as e:
+        if run.fail(name, e):
+            raise
+        logger.warning(f"Speculative stage '{name}' failed: {str(e)}")
+        return
+    run.finish(name, result)
+
+
+def run_pipeline(stages, inputs=None, on_stage_done=None):
+    """
+    Run the stages on the shared thread pool, starting each one as soon as its dependencies finish.
+
+    Args:
+        stages (list): Stage objects making up the graph
+        inputs (dict): Results that are known up front, usable as dependencies
+        on_stage_done (callable): Optional callback(name, result) invoked as each stage finishes
+
+    Returns:
+        PipelineRun: The finished run with results and per-stage timings
+    """
+    run = PipelineRun(stages, inputs, on_stage_done)
+    executor = get_executor()
+    futures = {}
+
+    while True:
+        for stage in run.take_ready():
+            run.mark_started(stage.name)
+            # Copy the caller's context so request-scoped state follows the stage
+            ctx = contextvars.copy_context()
+            futures[executor.submit(ctx.run, _run_stage, stage.func, dict(run.results))] = stage.name
+
+        for future, name in list(futures.items()):
+            if name in run.discarded:
+                future.cancel()
+                del futures[future]
+
+        if run.complete():
+            break
+        if not futures:
+            raise RuntimeError(f"Pipeline stalled with unresolved stages: {sorted(run.waiting)}")
+
+        done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+        for future in done:
+            _settle(run, futures.pop(future), future)
+
+    run.end = time.perf_counter()
+    return run
+
+
+async def arun_pipeline(stages, inputs=None, on_stage_done=None):
+    """Asyncio variant of run_pipeline; every stage func must be a coroutine function."""
+    run = PipelineRun(stages, inputs, on_stage_done)
+    tasks = {}
+
+    try:
+        while True:
+            for stage in run.take_ready():
+                run.mark_started(stage.name)
+                tasks[asyncio.ensure_future(stage.func(dict(run.results)))] = stage.name
+
+            for task, name in list(tasks.items()):
+                if name in run.discarded:
+                    task.cancel()
+                    del tasks[task]
+
+            if run.complete():
+                break
+            if not tasks:
+                raise RuntimeError(f"Pipeline stalled with unresolved stages: {sorted(run.waiting)}")
+
+            done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                _settle(run, tasks.pop(task), task)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    run.end = time.perf_counter()
+    return run
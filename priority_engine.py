@@ -0,0 +1,337 @@
+"""
+Table-driven customer priority scoring, for one request or a whole customer book.
+
+The service has three priority scores computed from the same customer fields:
+- financial priority ("low"/"medium"/"high"), the ticket priority of non-critical queries
+  (generate_priority.calculate_financial_priority): points per field by threshold, summed
+- request rank (1-3), the processing queue priority (app.determine_request_priority): the
+  first rank any of whose conditions holds
+- weighted priority ("Low Priority"/...), request_priority.set_priority: a weighted sum of
+  min-max normalized fields
+
+Each is described by a rule table below. The scalar functions evaluate the tables for the
+request path; the *_batch functions evaluate them over NumPy columns, so a book of millions of
+customers is re-scored in a few array passes. Both give exactly the results of the original
+per-row code, which bench/priority_parity.py checks against frozen copies of it.
+
+Batch input conventions: a missing value (None, NaN from Parquet nulls or an empty CSV cell)
+takes the field's default. A value that is present but not numeric makes the financial
+priority of that row fall back to every default, as the scalar code does; in the request rank
+it meets no threshold, and in the weighted priority it makes the row's code -1 (the scalar
+functions raise TypeError there).
+
+Usage:
+    python priority_engine.py customers.csv --output scored.csv
+    python priority_engine.py customers.parquet    # needs pyarrow
+"""
+import argparse
+import csv
+from bisect import bisect_right
+import logging
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Financial priority: (field, default, ((threshold, points), ...) highest threshold first)
+FINANCIAL_RULES = (
+    ("cibil_score", 700, ((800, 3), (700, 2), (600, 1))),
+    ("holdings", 0, ((1000000, 3), (100000, 2), (10000, 1))),           # 10 lakhs, 1 lakh, 10k
+    ("annual_income", 0, ((1000000, 3), (500000, 2), (250000, 1))),     # 10 lakhs, 5 lakhs, 2.5 lakhs
+    ("loans", 0, ((5000000, 3), (1000000, 2), (100000, 1))),            # 50 lakhs, 10 lakhs, 1 lakh
+)
+# (minimum total points, level) highest first; below every minimum is FINANCIAL_LEVELS[0]
+FINANCIAL_THRESHOLDS = ((8, "high"), (4, "medium"))
+FINANCIAL_LEVELS = ("low", "medium", "high")
+
+# Request rank: (rank, conditions) in order; a rank applies when any of its (field, op, value) holds
+REQUEST_RULES = (
+    (1, (("query_level", "==", "central"), ("cibil_score", ">=", 800),
+         ("holdings", ">=", 1000000), ("annual_income", ">=", 1000000))),
+    (2, (("cibil_score", ">=", 700), ("holdings", ">=", 500000), ("annual_income", ">=", 500000))),
+)
+REQUEST_DEFAULT_RANK = 3
+REQUEST_DEFAULTS = {"cibil_score": 0, "holdings": 0, "annual_income": 0, "query_level": "branch"}
+
+# Weighted priority: (field, weight, min, max, inverted) in the order the terms are summed
+WEIGHTED_RULES = (
+    ("loans", 0.3, 0, 100, False),
+    ("holdings", 0.2, 0, 500, True),
+    ("cibil", 0.25, 300, 900, True),
+    ("income", 0.25, 0, 100, True),
+)
+# (maximum score, level) lowest first; above every maximum is the last level
+WEIGHTED_THRESHOLDS = ((0.3, "Low Priority"), (0.6, "Medium Priority"))
+WEIGHTED_LEVELS = ("Low Priority", "Medium Priority", "High Priority")
+
+BOOK_FIELDS = ("cibil_score", "holdings", "annual_income", "loans", "query_level")
+
+
+# The tables flattened for the scalar functions, which run on every request: per field the
+# thresholds in ascending order and the points for meeting none, the lowest, ... all of them
+_FINANCIAL_DEFAULTS = tuple(default for _, default, _ in FINANCIAL_RULES)
+_FINANCIAL_STEPS = tuple(
+    (tuple(threshold for threshold, _ in reversed(thresholds)), (0,) + tuple(points for _, points in reversed(thresholds)))
+    for _, _, thresholds in FINANCIAL_RULES
+)
+_FINANCIAL_LEVEL_STEPS = (tuple(minimum for minimum, _ in reversed(FINANCIAL_THRESHOLDS)),
+                          (FINANCIAL_LEVELS[0],) + tuple(level for _, level in reversed(FINANCIAL_THRESHOLDS)))
+_REQUEST_CONDITIONS = tuple(
+    (rank, tuple((field, REQUEST_DEFAULTS[field], op == "==", operand) for field, op, operand in conditions))
+    for rank, conditions in REQUEST_RULES
+)
+
+
+def financial_priority(cibil_score, holdings, annual_income, loans):
+    """Financial priority level of one customer; see generate_priority.calculate_financial_priority."""
+    try:
+        values = [float(value) if value is not None else default
+                  for value, default in zip((cibil_score, holdings, annual_income, loans), _FINANCIAL_DEFAULTS)]
+    except (ValueError, TypeError):
+        logger.warning("Invalid financial parameters provided, using defaults")
+        values = _FINANCIAL_DEFAULTS
+
+    score = 0
+    for value, (thresholds, points) in zip(values, _FINANCIAL_STEPS):
+        if value == value:  # NaN meets no threshold
+            score += points[bisect_right(thresholds, value)]
+    minimums, levels = _FINANCIAL_LEVEL_STEPS
+    return levels[bisect_right(minimums, score)]
+
+
+def request_rank(data):
+    """Queue priority (1 is served first) of a request; see app.determine_request_priority."""
+    for rank, conditions in _REQUEST_CONDITIONS:
+        for field, default, equals, operand in conditions:
+            value = data.get(field, default)
+            if value == operand if equals else value >= operand:
+                return rank
+    return REQUEST_DEFAULT_RANK
+
+
+def _normalize(value, min_val, max_val):
+    return (value - min_val) / (max_val - min_val) if max_val > min_val else 0
+
+
+def weighted_priority(loans, holdings, cibil, income):
+    """Weighted priority level; see request_priority.set_priority."""
+    values = {"loans": loans, "holdings": holdings, "cibil": cibil, "income": income}
+    score = 0
+    for field, weight, min_val, max_val, inverted in WEIGHTED_RULES:
+        term = _normalize(values[field], min_val, max_val)
+        score += weight * (1 - term if inverted else term)
+    for maximum, level in WEIGHTED_THRESHOLDS:
+        if score <= maximum:
+            return level
+    return WEIGHTED_LEVELS[-1]
+
+
+ParsedColumn = namedtuple("ParsedColumn", "values missing invalid")
+
+
+def parse_column(values):
+    """
+    Convert a column to float64 as float() would; an already parsed column is returned as is.
+
+    Returns:
+        ParsedColumn: values, plus masks of the missing (None/empty) cells and of the cells
+            float() rejects; both are NaN in values
+    """
+    if isinstance(values, ParsedColumn):
+        return values
+    if isinstance(values, np.ndarray) and values.dtype.kind in "fiub":
+        values = values.astype(np.float64)
+        return ParsedColumn(values, np.isnan(values), np.zeros(len(values), dtype=bool))
+
+    cells = values.tolist() if isinstance(values, np.ndarray) else list(values)
+    missing = np.fromiter((cell is None or cell == "" for cell in cells), dtype=bool, count=len(cells))
+    invalid = np.zeros(len(cells), dtype=bool)
+    try:
+        # Fast path: every present cell is a number or a numeric string
+        parsed = np.fromiter((np.nan if cell is None or cell == "" else float(cell) for cell in cells),
+                             dtype=np.float64, count=len(cells))
+        return ParsedColumn(parsed, missing, invalid)
+    except (ValueError, TypeError):
+        pass
+    parsed = np.full(len(cells), np.nan)
+    for i, cell in enumerate(cells):
+        if missing[i]:
+            continue
+        try:
+            parsed[i] = float(cell)
+        except (ValueError, TypeError):
+            invalid[i] = True
+    return ParsedColumn(parsed, missing, invalid)
+
+
+def _points(values, thresholds):
+    points = np.zeros(len(values), dtype=np.int8)
+    # Lowest threshold first, so the highest one met wins
+    for threshold, value in reversed(thresholds):
+        points[values >= threshold] = value
+    return points
+
+
+def financial_priority_batch(cibil_score, holdings, annual_income, loans):
+    """
+    Financial priority of every row.
+
+    Returns:
+        numpy.ndarray: int8 indexes into FINANCIAL_LEVELS
+    """
+    columns = {"cibil_score": cibil_score, "holdings": holdings, "annual_income": annual_income, "loans": loans}
+    parsed = {field: parse_column(columns[field]) for field, _, _ in FINANCIAL_RULES}
+    # One unparseable field sends the whole row to the defaults
+    any_invalid = np.logical_or.reduce([invalid for _, _, invalid in parsed.values()])
+
+    score = np.zeros(len(any_invalid), dtype=np.int8)
+    with np.errstate(invalid="ignore"):
+        for field, default, thresholds in FINANCIAL_RULES:
+            values, missing, _ = parsed[field]
+            values = np.where(missing | any_invalid, default, values)
+            score += _points(values, thresholds)
+
+    codes = np.zeros(len(score), dtype=np.int8)
+    for minimum, level in reversed(FINANCIAL_THRESHOLDS):
+        codes[score >= minimum] = FINANCIAL_LEVELS.index(level)
+    return codes
+
+
+def request_rank_batch(cibil_score, holdings, annual_income, query_level):
+    """
+    Request rank of every row.
+
+    Returns:
+        numpy.ndarray: int8 ranks
+    """
+    columns = {"cibil_score": cibil_score, "holdings": holdings, "annual_income": annual_income}
+    numeric = {}
+    for field, column in columns.items():
+        values, missing, _ = parse_column(column)
+        numeric[field] = np.where(missing, REQUEST_DEFAULTS[field], values)
+    # A copy: the defaults must not be written into the caller's column
+    levels = np.array(query_level, dtype=object, copy=True)
+    levels[np.equal(levels, None) | (levels == "")] = REQUEST_DEFAULTS["query_level"]
+
+    ranks = np.full(len(levels), REQUEST_DEFAULT_RANK, dtype=np.int8)
+    with np.errstate(invalid="ignore"):
+        # Lowest priority rule first, so the first rule that holds wins
+        for rank, conditions in reversed(REQUEST_RULES):
+            holds = np.zeros(len(levels), dtype=bool)
+            for field, op, operand in conditions:
+                values = levels if field == "query_level" else numeric[field]
+                holds |= (values == operand) if op == "==" else (values >= operand)
+            ranks[holds] = rank
+    return ranks
+
+
+def weighted_priority_batch(loans, holdings, cibil, income):
+    """
+    Weighted priority of every row.
+
+    Returns:
+        numpy.ndarray: int8 indexes into WEIGHTED_LEVELS, -1 where an input is missing or not numeric
+    """
+    columns = {"loans": loans, "holdings": holdings, "cibil": cibil, "income": income}
+    score = None
+    unusable = None
+    for field, weight, min_val, max_val, inverted in WEIGHTED_RULES:
+        values, missing, invalid = parse_column(columns[field])
+        unusable = (missing | invalid) if unusable is None else unusable | missing | invalid
+        term = _normalize(values, min_val, max_val)
+        term = weight * (1 - term if inverted else term)
+        # Start from the first term rather than 0 + term; the sum is the same, bit for bit
+        score = term if score is None else score + term
+
+    codes = np.full(len(score), len(WEIGHTED_LEVELS) - 1, dtype=np.int8)
+    for maximum, level in reversed(WEIGHTED_THRESHOLDS):
+        codes[score <= maximum] = WEIGHTED_LEVELS.index(level)
+    codes[unusable] = -1
+    return codes
+
+
+def load_book(path):
+    """
+    Read a customer book as {column: list or array}, from CSV or (with pyarrow) Parquet.
+    Only the columns in BOOK_FIELDS are kept; absent ones are all missing.
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading Parquet needs pyarrow (pip install pyarrow)")
+        table = pq.read_table(path)
+        columns = {name: table.column(name).to_numpy(zero_copy_only=False)
+                   for name in BOOK_FIELDS if name in table.column_names}
+        rows = table.num_rows
+    else:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            wanted = [(name, header.index(name)) for name in BOOK_FIELDS if name in header]
+            data = {name: [] for name, _ in wanted}
+            rows = 0
+            for row in reader:
+                rows += 1
+                for name, position in wanted:
+                    data[name].append(row[position] if position < len(row) else "")
+        columns = data
+    for name in BOOK_FIELDS:
+        if name not in columns:
+            columns[name] = [None] * rows
+    return columns
+
+
+def score_book(columns):
+    """
+    Score a customer book with all three scorers.
+
+    Returns:
+        dict: "financial_priority", "request_rank" and "weighted_priority" arrays; the level
+            columns are int8 codes into FINANCIAL_LEVELS and WEIGHTED_LEVELS
+    """
+    # Each numeric column is parsed once and shared by the scorers
+    columns = {name: column if name == "query_level" else parse_column(column) for name, column in columns.items()}
+    return {
+        "financial_priority": financial_priority_batch(
+            columns["cibil_score"], columns["holdings"], columns["annual_income"], columns["loans"]),
+        "request_rank": request_rank_batch(
+            columns["cibil_score"], columns["holdings"], columns["annual_income"], columns["query_level"]),
+        "weighted_priority": weighted_priority_batch(
+            columns["loans"], columns["holdings"], columns["cibil_score"], columns["annual_income"]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score a customer book with the priority engine")
+    parser.add_argument("book", help="CSV or Parquet file with cibil_score, holdings, annual_income, loans, query_level")
+    parser.add_argument("--output", help="Write the scores as CSV to this path")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    columns = load_book(args.book)
+    loaded = time.perf_counter()
+    scores = score_book(columns)
+    scored = time.perf_counter()
+    rows = len(scores["request_rank"])
+    print(f"{rows} rows: load {loaded - start:.2f}s, score {scored - loaded:.3f}s "
+          f"({rows / max(scored - loaded, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+    financial = np.asarray(FINANCIAL_LEVELS, dtype=object)[scores["financial_priority"]]
+    weighted = np.asarray(WEIGHTED_LEVELS + ("",), dtype=object)[scores["weighted_priority"]]
+    counts = {level: int((financial == level).sum()) for level in FINANCIAL_LEVELS}
+    print(f"financial priority: {counts}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["financial_priority", "request_rank", "weighted_priority"])
+            writer.writerows(zip(financial.tolist(), scores["request_rank"].tolist(), weighted.tolist()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
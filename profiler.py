@@ -0,0 +1,186 @@
+"""
+On-demand sampling profiler.
+
+While active, a background thread samples the Python stacks of the threads serving profiled
+requests every few milliseconds and, when the window ends or it is stopped, writes them as
+collapsed stacks (one `frame;frame;frame count` line per unique stack) that flamegraph.pl,
+speedscope and similar tools read directly.
+
+Profiling covers either every request for a time window (fraction=1.0) or a random fraction
+of requests.
+
+The state is per process: under gunicorn, /admin/profiler starts, stops and reports the
+profiler of the worker that handled that call only, and the status it returns carries that
+worker's pid. To profile every worker, repeat the call until each pid has answered.
+"""
+import contextvars
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PROFILER_OUTPUT_DIR = os.environ.get("PROFILER_OUTPUT_DIR", "profiles")
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", 10))
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", 600))
+
+_profiled = contextvars.ContextVar("profiled", default=False)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = Counter()
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self.fraction = 0.0
+        self.interval = PROFILER_INTERVAL_MS / 1000.0
+        self.until = 0.0
+        self.output_path = None
+
+    @property
+    def active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=30, fraction=1.0, interval_ms=PROFILER_INTERVAL_MS):
+        """
+        Start sampling for the given window.
+
+        Args:
+            seconds (float): How long to profile, capped at PROFILER_MAX_SECONDS
+            fraction (float): Share of requests that are profiled, in (0, 1]; larger values are capped at 1
+            interval_ms (float): Time between samples
+
+        Returns:
+            dict: The profiler status
+
+        Raises:
+            ValueError: When an argument is not a positive number
+        """
+        seconds = _positive("seconds", seconds)
+        fraction = min(_positive("fraction", fraction), 1.0)
+        interval_ms = _positive("interval_ms", interval_ms)
+        with self._lock:
+            if self.active:
+                raise RuntimeError("Profiler is already running")
+            seconds = min(seconds, PROFILER_MAX_SECONDS)
+            self.fraction = fraction
+            self.interval = max(interval_ms, 1.0) / 1000.0
+            self.until = time.monotonic() + seconds
+            self.output_path = os.path.join(
+                PROFILER_OUTPUT_DIR, f"profile-{os.getpid()}-{time.strftime('%Y%m%dT%H%M%S')}.folded"
+            )
+            self._stacks = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"Sampling profiler started for {seconds}s at {fraction:.0%} of requests")
+        return self.status()
+
+    def stop(self):
+        """Stop sampling early; the collected stacks are written out."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+        return self.status()
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "active": self.active,
+            "fraction": self.fraction,
+            "interval_ms": self.interval * 1000,
+            "remaining_seconds": max(0.0, self.until - time.monotonic()) if self.active else 0.0,
+            "output_path": self.output_path
+        }
+
+    def should_profile(self):
+        """Decide whether a new request is profiled."""
+        return self.active and random.random() < self.fraction
+
+    @contextmanager
+    def track_thread(self):
+        """Sample the current thread while the enclosed block runs, if its request is being profiled."""
+        if not _profiled.get():
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if self._threads[ident] <= 0:
+                    del self._threads[ident]
+
+    @contextmanager
+    def profile_request(self):
+        """Mark the enclosed request as profiled (subject to the sampling fraction) and track its thread."""
+        if not self.should_profile():
+            yield
+            return
+        token = _profiled.set(True)
+        try:
+            with self.track_thread():
+                yield
+        finally:
+            _profiled.reset(token)
+
+    def _sample_loop(self):
+        while not self._stop.is_set() and time.monotonic() < self.until:
+            with self._lock:
+                idents = set(self._threads)
+            if idents:
+                frames = sys._current_frames()
+                for ident in idents:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks[_collapse(frame)] += 1
+            self._stop.wait(self.interval)
+        self._dump()
+
+    def _dump(self):
+        try:
+            os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+            with open(self.output_path, "w") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Profile with {sum(self._stacks.values())} samples written to {self.output_path}")
+        except Exception as e:
+            logger.error(f"Error writing profile: {str(e)}")
+
+
+def _positive(name, value):
+    """value parsed as a finite float above 0, as it may come from JSON as a string."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f"{name} must be a positive number")
+    return value
+
+
+def _collapse(frame):
+    """Render a stack as root-first `file:function` frames separated by semicolons."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(";", ":").replace(" ", "_"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,62 @@
+"""
+Progress events of the query being processed, for the streaming endpoints.
+
+A request that wants progress runs its work inside reporting(callback); code anywhere in that
+request, including pipeline stage threads and executors that copy the context, calls
+report(event, data) and the callback receives it. Without a reporter, report() does nothing.
+
+Each event is delivered at most once per request unless it is reported with repeat=True (as
+download progress is), so a step can be re-reported safely: a request that attached to a
+shared in-flight computation misses its live events and reports them from the final result
+instead, while the request that ran it sees them only once.
+"""
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+# Streams send a comment line after this long without an event so that proxies keep them open
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+SSE_HEARTBEAT = ": keep-alive\n\n"
+
+_reporter = contextvars.ContextVar("progress_reporter", default=None)
+
+
+class ProgressReporter:
+    """Forwards the events of one request to its callback(event, data)."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.sent = set()
+        self._lock = threading.Lock()
+
+    def report(self, event, data, repeat=False):
+        with self._lock:
+            if not repeat:
+                if event in self.sent:
+                    return
+                self.sent.add(event)
+        self.callback(event, data)
+
+
+@contextmanager
+def reporting(callback):
+    """Send the progress events of the enclosed work to callback(event, data)."""
+    token = _reporter.set(ProgressReporter(callback))
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+
+def report(event, data=None, repeat=False):
+    """Report a progress event of the current request, if it is being reported."""
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.report(event, data or {}, repeat)
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,11 +1,15 @@
 import os
+import asyncio
+import contextvars
 from groq import Groq
 import requests
 from urllib.parse import urlparse, parse_qs
 import tempfile
 import logging
 # from moviepy import VideoFileClip
-from moviepy.editor import VideoFileClip
+from metrics import timed, stage_timer, record_llm_usage
+from memory import memory_budget, track_memory, tracked_memory, MemoryBudgetExceeded
+from progress import report
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,6 +20,9 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if not GROQ_API_KEY:
     logger.warning("GROQ_API_KEY environment variable not set. Transcription will not work.")
 
+# Share of the file between two download progress events
+DOWNLOAD_PROGRESS_STEP = 0.05
+
 def get_direct_url(url):
     """Convert Google Drive sharing URL to direct download URL if needed"""
     if 'drive.google.com' in url:
@@ -29,6 +36,31 @@ def get_direct_url(url):
             return f'https://drive.google.com/uc?export=download&id={file_id}'
     return url
 
+def normalize_video_url(url):
+    """Canonical form of a video URL, used to recognise requests for the same video"""
+    parsed = urlparse(get_direct_url(url.strip()))
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(), fragment="").geturl()
+
+class DownloadProgress:
+    """Reports download progress every DOWNLOAD_PROGRESS_STEP of the file (or every MiB when the size is unknown)."""
+
+    def __init__(self, content_length):
+        self.total = int(content_length) if content_length and str(content_length).isdigit() else None
+        self.step = max(int(self.total * DOWNLOAD_PROGRESS_STEP), 1) if self.total else 1024 * 1024
+        self.received = 0
+        self.next_report = self.step
+
+    def add(self, size):
+        self.received += size
+        if self.received >= self.next_report:
+            self.next_report = self.received + self.step
+            report("download", {"bytes": self.received, "total_bytes": self.total}, repeat=True)
+
+    def done(self):
+        report("downloaded", {"bytes": self.received})
+
+@timed("download")
+@tracked_memory("download")
 def download_video(url, output_path=None):
     """Download video from URL to a temporary file"""
     try:
@@ -56,10 +88,13 @@ def download_video(url, output_path=None):
         
         if response.status_code == 200:
             # Download the video file
+            progress = DownloadProgress(response.headers.get('Content-Length'))
             with open(output_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     if chunk:
                         f.write(chunk)
+                        progress.add(len(chunk))
+            progress.done()
             return output_path
         else:
             raise Exception(f"Failed to download video: {response.status_code}")
@@ -67,6 +102,8 @@ def download_video(url, output_path=None):
         logger.error(f"Error downloading video: {str(e)}")
         raise
 
+@timed("audio_extract")
+@tracked_memory("audio_extract")
 def extract_audio(video_path):
     """Extract audio from video file using MoviePy"""
     try:
@@ -76,6 +113,10 @@ def extract_audio(video_path):
         audio_path = audio_file.name
         audio_file.close()
         
+        # Imported here: moviepy pulls in imageio and ffmpeg probing, which only video queries need.
+        # The clip module avoids moviepy.editor, which also imports IPython
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+
         # Load the video clip
         video_clip = VideoFileClip(video_path)
         
@@ -94,12 +135,80 @@ def extract_audio(video_path):
         logger.error(f"Error extracting audio: {str(e)}")
         raise
 
+@timed("download")
+async def adownload_video(url, output_path=None):
+    """Async variant of download_video using a streaming httpx client"""
+    import httpx
+
+    try:
+        if output_path is None:
+            temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+            output_path = temp_file.name
+            temp_file.close()
+
+        async with httpx.AsyncClient(follow_redirects=True, timeout=None) as client:
+            # Only the headers are read before the body is streamed to the file
+            response = await client.send(client.build_request("GET", url), stream=True)
+            try:
+                # For Google Drive files, we need to handle the confirmation page for large files
+                if 'drive.google.com' in url:
+                    for key, value in response.cookies.items():
+                        if key.startswith('download_warning'):
+                            await response.aclose()
+                            url = f"{url}&confirm={value}"
+                            response = await client.send(client.build_request("GET", url), stream=True)
+                            break
+
+                response.raise_for_status()
+                progress = DownloadProgress(response.headers.get('Content-Length'))
+                with open(output_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                            progress.add(len(chunk))
+                progress.done()
+            finally:
+                await response.aclose()
+        return output_path
+    except Exception as e:
+        logger.error(f"Error downloading video: {str(e)}")
+        raise
+
+def _transcription_request(audio_file, file):
+    """Build the transcription arguments; the open file is streamed rather than read into memory"""
+    return dict(
+        file=(os.path.basename(audio_file), file),
+        model="whisper-large-v3-turbo",
+        response_format="json",
+        temperature=0.0
+    )
+
+def _remove_temp_files(video_file, audio_file):
+    """Delete the temporary video and audio files if they exist"""
+    if video_file and os.path.exists(video_file):
+        try:
+            os.unlink(video_file)
+            logger.info(f"Deleted temporary video file: {video_file}")
+        except Exception as e:
+            logger.warning(f"Failed to delete temporary video file: {str(e)}")
+
+    if audio_file and os.path.exists(audio_file):
+        try:
+            os.unlink(audio_file)
+            logger.info(f"Deleted temporary audio file: {audio_file}")
+        except Exception as e:
+            logger.warning(f"Failed to delete temporary audio file: {str(e)}")
+
 def extract_and_transcribe(video_url):
     """Download video, extract audio, and transcribe using Groq API"""
     video_file = None
     audio_file = None
+    reserved = 0
     
     try:
+        # Wait for room in the memory budget (or refuse) before touching the video
+        reserved = memory_budget.acquire()
+
         # Get direct URL if it's a Google Drive link
         direct_url = get_direct_url(video_url)
         
@@ -109,41 +218,71 @@ def extract_and_transcribe(video_url):
         
         # Extract audio from the video
         audio_file = extract_audio(video_file)
+        report("audio_extracted", {"bytes": os.path.getsize(audio_file)})
         
         # Initialize Groq client
         client = Groq(api_key=GROQ_API_KEY)
         
         # Open and transcribe the audio file
         logger.info("Transcribing audio...")
-        with open(audio_file, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_file, file.read()),
-                model="whisper-large-v3-turbo",
-                response_format="json",
-                temperature=0.0
-            )
+        with stage_timer("transcribe"), track_memory("transcribe"), open(audio_file, "rb") as file:
+            request = _transcription_request(audio_file, file)
+            transcription = client.audio.transcriptions.create(**request)
+        record_llm_usage(request["model"], transcription)
         
         logger.info("Transcription complete")
         return transcription.text
         
+    except MemoryBudgetExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error in transcription process: {str(e)}")
         return f"Error in transcription: {str(e)}"
     finally:
         # Clean up temporary files
-        if video_file and os.path.exists(video_file):
-            try:
-                os.unlink(video_file)
-                logger.info(f"Deleted temporary video file: {video_file}")
-            except Exception as e:
-                logger.warning(f"Failed to delete temporary video file: {str(e)}")
-                
-        if audio_file and os.path.exists(audio_file):
-            try:
-                os.unlink(audio_file)
-                logger.info(f"Deleted temporary audio file: {audio_file}")
-            except Exception as e:
-                logger.warning(f"Failed to delete temporary audio file: {str(e)}")
+        _remove_temp_files(video_file, audio_file)
+        memory_budget.release(reserved)
+
+async def aextract_and_transcribe(video_url):
+    """Async variant of extract_and_transcribe; ffmpeg and file I/O run in an executor"""
+    from classify import get_async_client
+
+    loop = asyncio.get_running_loop()
+    video_file = None
+    audio_file = None
+    reserved = 0
+
+    try:
+        # Waiting for room in the memory budget sleeps on the event loop rather than holding an executor thread
+        reserved = await memory_budget.aacquire()
+
+        direct_url = get_direct_url(video_url)
+
+        logger.info(f"Downloading video from: {direct_url}")
+        with track_memory("download"):
+            video_file = await adownload_video(direct_url)
+
+        # Copy the context so the executor thread records its timings against this request
+        audio_file = await loop.run_in_executor(None, contextvars.copy_context().run, extract_audio, video_file)
+        report("audio_extracted", {"bytes": os.path.getsize(audio_file)})
+
+        logger.info("Transcribing audio...")
+        with stage_timer("transcribe"), track_memory("transcribe"), open(audio_file, "rb") as file:
+            request = _transcription_request(audio_file, file)
+            transcription = await get_async_client().audio.transcriptions.create(**request)
+        record_llm_usage(request["model"], transcription)
+
+        logger.info("Transcription complete")
+        return transcription.text
+
+    except MemoryBudgetExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in transcription process: {str(e)}")
+        return f"Error in transcription: {str(e)}"
+    finally:
+        await loop.run_in_executor(None, _remove_temp_files, video_file, audio_file)
+        memory_budget.release(reserved)
 
 # For backward compatibility with the existing code
 def process_video_query(video_url):
@@ -0,0 +1,271 @@
+"""
+Live ticket counts per department, request_category, priority and branch.
+
+Every ticket the query endpoints produce is counted, for each of its DIMENSIONS values, into:
+- a running total
+- time-bucketed counters at three resolutions, each a ring of the most recent buckets:
+  RESOLUTIONS minutes, hours and days
+
+so the stats endpoint answers "how many loan tickets in the last hour" or "critical tickets
+per hour today" from a few array cells, without touching the ticket store.
+
+State lives in preallocated NumPy arrays, one row per (dimension, value), grown by doubling.
+A ring slot holds the bucket number it counts; a slot still holding an older bucket is simply
+reused, so nothing needs expiring.
+
+The counters are a merged_state.MergedState, merged into ROLLUPS_PATH every
+ROLLUPS_SAVE_SECONDS and at exit. Windowed counts add up across snapshot and delta, so reads
+never copy the tables.
+
+Rebuild the file from the ticket store with:
+    python rollups.py rebuild
+The rebuilt file records the newest created_at it counted; running workers drop the tickets up
+to it from the counts they have not merged yet, as the rebuild already counted those.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+from merged_state import RowTable, MergedState, locked, process_wide
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROLLUPS_PATH = os.environ.get("ROLLUPS_PATH", os.path.join("data", "ticket_rollups.npz"))
+ROLLUPS_SAVE_SECONDS = float(os.environ.get("ROLLUPS_SAVE_SECONDS", 30))
+
+DIMENSIONS = ("department", "request_category", "priority", "branch_id")
+
+# Resolution name -> (bucket length in seconds, buckets kept)
+RESOLUTIONS = {
+    "minute": (60, 120),
+    "hour": (3600, 48),
+    "day": (86400, 90),
+}
+
+ARTIFACT_FORMAT = 1
+
+
+def _bucket(timestamp, resolution):
+    return int(timestamp // RESOLUTIONS[resolution][0])
+
+
+def _combine_rings(stamp_a, count_a, stamp_b, count_b):
+    """Merge rings slot by slot: equal buckets add up, otherwise the more recent bucket wins."""
+    counts = np.where(stamp_a == stamp_b, count_a + count_b, np.where(stamp_b > stamp_a, count_b, count_a))
+    return np.maximum(stamp_a, stamp_b), counts
+
+
+class _Table(RowTable):
+    """Array-backed counters for a set of (dimension, value) keys, one row each."""
+    LABEL = "ticket rollups"
+    ARTIFACT_FORMAT = ARTIFACT_FORMAT
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (key, timestamp, count) of every add, so a delta can drop what a rebuild counted;
+        # None on tables that are not deltas
+        self.log = []
+
+    @classmethod
+    def load(cls, path):
+        table = super().load(path)
+        table.log = None
+        return table
+
+    @classmethod
+    def layout(cls):
+        layout = {"total": ((), np.int64, 0)}
+        for resolution, (_, slots) in RESOLUTIONS.items():
+            layout[f"{resolution}_stamp"] = ((slots,), np.int64, -1)
+            layout[f"{resolution}_count"] = ((slots,), np.int32, 0)
+        return layout
+
+    def add(self, key, timestamp, count=1):
+        if self.log is not None:
+            self.log.append((key, timestamp, count))
+        row = self.row(key, create=True)
+        self.total[row] += count
+        for resolution, (_, slots) in RESOLUTIONS.items():
+            bucket = _bucket(timestamp, resolution)
+            slot = bucket % slots
+            stamps, counts = getattr(self, f"{resolution}_stamp"), getattr(self, f"{resolution}_count")
+            if stamps[row, slot] != bucket:
+                if stamps[row, slot] > bucket:
+                    continue  # Older than the ring kept at this resolution
+                stamps[row, slot] = bucket
+                counts[row, slot] = 0
+            counts[row, slot] += count
+
+    def window(self, rows, resolution, first, last):
+        """Counts of the given rows summed over buckets first..last inclusive."""
+        stamps = getattr(self, f"{resolution}_stamp")[rows]
+        counts = getattr(self, f"{resolution}_count")[rows]
+        return np.where((stamps >= first) & (stamps <= last), counts, 0).sum(axis=1)
+
+    def series(self, row, resolution, first, last):
+        """Count of each bucket first..last for one row."""
+        slots = RESOLUTIONS[resolution][1]
+        buckets = np.arange(first, last + 1)
+        stamps = getattr(self, f"{resolution}_stamp")[row, buckets % slots]
+        counts = getattr(self, f"{resolution}_count")[row, buckets % slots]
+        return np.where(stamps == buckets, counts, 0)
+
+    def merge(self, other):
+        super().merge(other)
+        if self.log is not None and other.log is not None:
+            self.log.extend(other.log)
+
+    def after(self, high_water):
+        """The counts added after the ticket created_at high_water."""
+        if high_water is None or self.log is None:
+            return self
+        table = _Table()
+        table.log = None
+        for key, timestamp, count in self.log:
+            if timestamp > high_water:
+                table.add(key, timestamp, count)
+        return table
+
+    def merge_row(self, row, other, other_row):
+        self.total[row] += other.total[other_row]
+        for resolution in RESOLUTIONS:
+            stamps, counts = getattr(self, f"{resolution}_stamp"), getattr(self, f"{resolution}_count")
+            stamps[row], counts[row] = _combine_rings(
+                stamps[row], counts[row],
+                getattr(other, f"{resolution}_stamp")[other_row], getattr(other, f"{resolution}_count")[other_row]
+            )
+
+
+class TicketRollups(MergedState):
+    """
+    Ticket counters for one process, persisted to path.
+
+    Args:
+        path (str): npz file shared by every process; None keeps the counters in memory only
+        save_seconds (float): How often pending counts are merged into the file
+    """
+    TABLE = _Table
+
+    def __init__(self, path=ROLLUPS_PATH, save_seconds=ROLLUPS_SAVE_SECONDS):
+        super().__init__(path, save_seconds)
+
+    def record(self, ticket):
+        """Count one ticket under each of its dimension values, at its created_at (now if absent)."""
+        timestamp = float(ticket.get("created_at") or time.time())
+        with self._lock:
+            for dimension in DIMENSIONS:
+                value = ticket.get(dimension)
+                if value is not None and value != "":
+                    self._delta.add((dimension, str(value)), timestamp)
+        self._updated()
+
+    def summary(self, dimension, now=None):
+        """
+        Counts of every value of a dimension.
+
+        Returns:
+            dict: value -> total, last_hour (the last 60 minute buckets), last_day (24 hour
+                buckets) and last_30_days (30 day buckets), each including the current bucket
+        """
+        now = time.time() if now is None else now
+        windows = {"last_hour": ("minute", 60), "last_day": ("hour", 24), "last_30_days": ("day", 30)}
+        counts = {}
+        with self._lock:
+            for table in self._tables():
+                keys = [key for key in table.index if key[0] == dimension]
+                if not keys:
+                    continue
+                rows = np.array([table.index[key] for key in keys])
+                columns = {"total": table.total[rows]}
+                for name, (resolution, buckets) in windows.items():
+                    last = _bucket(now, resolution)
+                    columns[name] = table.window(rows, resolution, last - buckets + 1, last)
+                for i, (_, value) in enumerate(keys):
+                    entry = counts.setdefault(value, dict.fromkeys(columns, 0))
+                    for name, column in columns.items():
+                        entry[name] += int(column[i])
+        return counts
+
+    def series(self, dimension, value, resolution="hour", buckets=24, now=None):
+        """
+        Per-bucket counts of one value, oldest first, ending with the current bucket.
+
+        Returns:
+            list: [bucket start in epoch seconds, count] pairs
+
+        Raises:
+            ValueError: On an unknown resolution, or more buckets than its ring keeps
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+        seconds, slots = RESOLUTIONS[resolution]
+        if not 1 <= buckets <= slots:
+            raise ValueError(f"buckets must be between 1 and {slots} at {resolution} resolution")
+        last = _bucket(time.time() if now is None else now, resolution)
+        first = last - buckets + 1
+        counts = np.zeros(buckets, dtype=np.int64)
+        with self._lock:
+            for table in self._tables():
+                row = table.row((dimension, str(value)))
+                if row is not None:
+                    counts += table.series(row, resolution, first, last)
+        return [[(first + i) * seconds, int(count)] for i, count in enumerate(counts)]
+
+
+_ticket_rollups = process_wide(TicketRollups)
+
+
+def get_ticket_rollups():
+    """Return the process-wide TicketRollups, loading it from ROLLUPS_PATH on first use."""
+    return _ticket_rollups()
+
+
+def rebuild(store, path):
+    """
+    Recount every ticket in the store into a fresh rollups file at path; returns the ticket count.
+
+    The file stays locked throughout, so no worker merges into it meanwhile, and its high_water
+    is the newest created_at counted. A ticket created before that but committed only after the
+    export started (within one ticket store window) is missed.
+    """
+    table = _Table()
+    table.log = None
+    count = 0
+    with locked(path):
+        for line in store.export():
+            ticket = json.loads(line)
+            timestamp = float(ticket["created_at"])
+            for dimension in DIMENSIONS:
+                value = ticket.get(dimension)
+                if value is not None and value != "":
+                    table.add((dimension, str(value)), timestamp)
+            table.high_water = timestamp if table.high_water is None else max(table.high_water, timestamp)
+            count += 1
+        table.save(path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ticket rollup tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recount the ticket store into ROLLUPS_PATH")
+    show_parser = subparsers.add_parser("show", help="Print the counts of a dimension")
+    show_parser.add_argument("dimension", choices=DIMENSIONS)
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        from ticket_store import TicketStore, TICKET_STORE_PATH
+        count = rebuild(TicketStore(TICKET_STORE_PATH), ROLLUPS_PATH)
+        print(f"Counted {count} tickets into {ROLLUPS_PATH}")
+    else:
+        print(json.dumps(TicketRollups().summary(args.dimension), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
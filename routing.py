@@ -0,0 +1,210 @@
+"""
+Per-call model routing by query difficulty.
+
+Each task (classify, feedback) has a small fast tier and a large tier. A call goes to the small
+tier only when every cheap signal says the input is easy: the text is short, the local
+classifier is reasonably sure, the language is one the small model handles and the query is
+not critical. Everything else goes to the default (large) tier.
+
+The policy can be overridden with ROUTING_POLICY, either a JSON string or the path of a JSON
+file, merged per task over DEFAULT_POLICY, e.g.
+    ROUTING_POLICY='{"classify": {"small": {"max_chars": 300}}}'
+
+To measure how often the cheaper tier gets it wrong, a fraction (audit_rate) of small-tier
+answers is recomputed on the escalation tier in the background. Disagreements, and small-tier
+answers that were unusable and had to be escalated, count as overrides in
+routing_overrides_total.
+"""
+import copy
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from generate_priority import check_critical_query
+from metrics import record_routing, record_routing_audit, record_routing_override, record_request_info
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = {
+    "classify": {
+        "tiers": {"small": "llama3-8b-8192", "large": "mixtral-8x7b-32768"},
+        "default": "large",
+        "escalate_to": "large",
+        "small": {
+            "max_chars": 200,
+            # Only checked when a local classifier is deployed
+            "min_local_confidence": 0.5,
+            "languages": ["en"],
+            "allow_critical": False
+        },
+        "audit_rate": 0.05
+    },
+    "feedback": {
+        "tiers": {"small": "llama3-8b-8192", "large": "llama3-70b-8192"},
+        "default": "large",
+        "escalate_to": "large",
+        "small": {
+            "max_chars": 400,
+            "min_local_confidence": None,
+            "languages": None,
+            "allow_critical": True
+        },
+        # Summaries cannot be compared for equality, so feedback is not audited
+        "audit_rate": 0.0
+    }
+}
+
+ROUTING_AUDIT_WORKERS = int(os.environ.get("ROUTING_AUDIT_WORKERS", 2))
+
+
+def _merge(base, override):
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_policy(source=None):
+    """Return DEFAULT_POLICY merged with the JSON string or file given in source (or ROUTING_POLICY)."""
+    source = source if source is not None else os.environ.get("ROUTING_POLICY", "")
+    if not source:
+        return copy.deepcopy(DEFAULT_POLICY)
+    try:
+        if os.path.exists(source):
+            with open(source) as f:
+                override = json.load(f)
+        else:
+            override = json.loads(source)
+        return _merge(DEFAULT_POLICY, override)
+    except (OSError, ValueError) as e:
+        logger.error(f"Invalid ROUTING_POLICY, using the default policy: {str(e)}")
+        return copy.deepcopy(DEFAULT_POLICY)
+
+
+policy = load_policy()
+
+
+def likely_language(text):
+    """Guess 'en' for mostly-ASCII text and 'other' otherwise, for when detection has not run yet."""
+    if not text:
+        return "en"
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return "en" if non_ascii / len(text) < 0.3 else "other"
+
+
+def choose_tier(task, text, local_confidence=None, language=None, critical=None):
+    """
+    Pick the tier for one call.
+
+    Args:
+        task (str): Policy section, e.g. "classify" or "feedback"
+        text (str): The input the model will see
+        local_confidence (float): Calibrated confidence of the local classifier, if it ran
+        language (str): Detected language code, if known
+        critical (bool): Whether the query is critical; computed from the text if None
+
+    Returns:
+        tuple: (tier, reason) where reason names the signal that decided
+    """
+    task_policy = policy[task]
+    small = task_policy.get("small")
+    default = task_policy["default"]
+    if not small or "small" not in task_policy["tiers"]:
+        return default, "no_small_tier"
+
+    text = text or ""
+    if small.get("max_chars") is not None and len(text) > small["max_chars"]:
+        return default, "length"
+    minimum = small.get("min_local_confidence")
+    if minimum is not None and local_confidence is not None and local_confidence < minimum:
+        return default, "local_confidence"
+    languages = small.get("languages")
+    if language in (None, "unknown"):
+        language = likely_language(text)
+    if languages and language not in languages:
+        return default, "language"
+    if not small.get("allow_critical", True):
+        if critical is None:
+            critical = check_critical_query(text)
+        if critical:
+            return default, "critical"
+    return "small", "easy"
+
+
+def route(task, text, **signals):
+    """
+    Choose the model for a call and record the decision.
+
+    Returns:
+        tuple: (tier, model)
+    """
+    tier, reason = choose_tier(task, text, **signals)
+    record_routing(task, tier, reason)
+    record_request_info(f"route_{task}", {"tier": tier, "reason": reason})
+    return tier, policy[task]["tiers"][tier]
+
+
+def escalation(task, tier):
+    """
+    The tier and model to retry on when an answer from tier is unusable.
+
+    Returns:
+        tuple: (tier, model), or (None, None) if tier is already the escalation tier
+    """
+    target = policy[task].get("escalate_to")
+    if not target or target == tier:
+        return None, None
+    return target, policy[task]["tiers"][target]
+
+
+def record_escalation(task, tier):
+    """Count an unusable answer from a cheaper tier that had to be recomputed."""
+    record_routing_override(task, tier, "escalated")
+
+
+_audit_executor = None
+_audit_executor_lock = threading.Lock()
+
+
+def _get_audit_executor():
+    global _audit_executor
+    with _audit_executor_lock:
+        if _audit_executor is None:
+            _audit_executor = ThreadPoolExecutor(max_workers=ROUTING_AUDIT_WORKERS, thread_name_prefix="routing-audit")
+        return _audit_executor
+
+
+def maybe_audit(task, tier, answer, recompute):
+    """
+    For a sample of cheaper-tier answers, recompute the answer on the escalation tier in the
+    background and count an override when the two disagree.
+
+    Args:
+        task (str): Policy section
+        tier (str): Tier that produced the answer
+        answer: The cheaper tier's answer
+        recompute (callable): Called with the escalation model, returns its answer in the same
+            form as answer; raising skips the audit
+    """
+    target, model = escalation(task, tier)
+    if target is None or random.random() >= policy[task].get("audit_rate", 0.0):
+        return
+
+    def audit():
+        try:
+            reference = recompute(model)
+        except Exception as e:
+            logger.warning(f"Routing audit for {task} failed: {str(e)}")
+            return
+        record_routing_audit(task, tier)
+        if reference != answer:
+            record_routing_override(task, tier, "audit")
+
+    _get_audit_executor().submit(audit)
@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import record_cache, observe_queue_wait
+from profiler import profiler
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Maximum number of distinct computations running at once in this process
+SINGLEFLIGHT_WORKERS = int(os.environ.get("SINGLEFLIGHT_WORKERS", 64))
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight work: while a computation for a key is running, later calls
+    with the same key attach to it and receive the same result instead of starting their own.
+
+    The work runs on the single-flight pool (or as its own asyncio task), detached from the
+    caller, so it keeps going even if the caller that started it goes away.
+    """
+    def __init__(self, max_workers=SINGLEFLIGHT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="singleflight")
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        """
+        Start func(*args) for the key unless it is already running.
+
+        Returns:
+            concurrent.futures.Future: Shared by every caller with the same key
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            record_cache("singleflight", future is not None)
+            if future is not None:
+                logger.info(f"Attaching to in-flight computation for {key[0]}")
+                return future
+            # The work runs in the context of the caller that started it, so its stage timings are kept
+            ctx = contextvars.copy_context()
+            future = self._executor.submit(ctx.run, self._run, time.perf_counter(), func, *args)
+            self._calls[key] = future
+        future.add_done_callback(lambda _: self._forget(self._calls, key, future))
+        return future
+
+    def do(self, key, func, *args):
+        """Run func(*args) once per in-flight key and return its result."""
+        return self.submit(key, func, *args).result()
+
+    def do_inline(self, key, func, *args):
+        """
+        Like do, but the first caller runs func(*args) on its own thread. For work that itself
+        waits on the single-flight pool, which could otherwise be taken up by the callers waiting.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            record_cache("singleflight", future is not None)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            logger.info(f"Attaching to in-flight computation for {key[0]}")
+            return future.result()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._forget(self._calls, key, future)
+
+    async def ado(self, key, coro_func, *args):
+        """Asyncio variant of do; a cancelled caller does not cancel the shared task."""
+        task = self._tasks.get(key)
+        record_cache("singleflight", task is not None)
+        if task is None:
+            task = asyncio.ensure_future(coro_func(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(self._tasks, key, task))
+        else:
+            logger.info(f"Attaching to in-flight computation for {key[0]}")
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _run(submitted_at, func, *args):
+        observe_queue_wait("singleflight", time.perf_counter() - submitted_at)
+        with profiler.track_thread():
+            return func(*args)
+
+    def _forget(self, calls, key, future):
+        with self._lock:
+            if calls.get(key) is future:
+                del calls[key]
+
+
+inflight = SingleFlight()
@@ -0,0 +1,138 @@
+"""
+Index over the classification taxonomy for validating and repairing labels.
+
+Built once at import from the leaves of the snake_case tree the classifier answers in:
+- LEAVES, the exact (department, service_type, request_category) triples, for O(1) validation
+- a normalized-key map per level, so case, spacing and punctuation variants such as
+  "Card Services" or "card-services" resolve to the canonical label
+- a character trigram index per level, used to snap near-miss labels ("card_block",
+  "fraud_and_security") to the closest valid leaf instead of re-asking the LLM
+
+Snapping scores every leaf by the trigram similarity of its three labels to the answer,
+weighted towards the most specific level, and accepts the best leaf when its score reaches
+TAXONOMY_SNAP_MIN_SCORE.
+"""
+import os
+import re
+from collections import defaultdict
+from categories import VALID_CLASSIFICATIONS
+
+LEVELS = ("department", "service_type", "request_category")
+
+# How much each level counts when scoring a leaf; the request category carries the most meaning
+LEVEL_WEIGHTS = (0.2, 0.3, 0.5)
+
+TAXONOMY_SNAP_MIN_SCORE = float(os.environ.get("TAXONOMY_SNAP_MIN_SCORE", 0.6))
+
+_SEPARATORS = re.compile(r"[\s\-/.]+")
+_NON_WORD = re.compile(r"[^a-z0-9_]")
+
+
+def normalize_label(value):
+    """Fold a label to snake_case: lowercase, '&' as 'and', separators as underscores."""
+    value = str(value).strip().lower().replace("&", " and ")
+    value = _NON_WORD.sub("", _SEPARATORS.sub("_", value))
+    return re.sub(r"_+", "_", value).strip("_")
+
+
+def trigrams(label):
+    """Character trigrams of a normalized label, padded so word starts and ends count."""
+    padded = f"  {label.replace('_', ' ')} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+LEAVES = VALID_CLASSIFICATIONS
+
+# Stable order so ties snap deterministically
+_LEAF_LIST = sorted(LEAVES)
+
+# Per level: normalized label -> canonical label
+_CANONICAL = tuple(
+    {normalize_label(leaf[level]): leaf[level] for leaf in _LEAF_LIST}
+    for level in range(len(LEVELS))
+)
+
+# Per level: canonical label -> its trigram set, and trigram -> canonical labels containing it
+_LABEL_TRIGRAMS = tuple({label: trigrams(label) for label in canonical.values()} for canonical in _CANONICAL)
+_TRIGRAM_INDEX = []
+for _label_trigrams in _LABEL_TRIGRAMS:
+    _index = defaultdict(list)
+    for _label, _grams in _label_trigrams.items():
+        for _gram in _grams:
+            _index[_gram].append(_label)
+    _TRIGRAM_INDEX.append(dict(_index))
+_TRIGRAM_INDEX = tuple(_TRIGRAM_INDEX)
+
+
+def is_valid(department, service_type, request_category):
+    """Whether the triple is exactly a leaf of the taxonomy."""
+    return (department, service_type, request_category) in LEAVES
+
+
+def canonical_label(level, value):
+    """The canonical label at level (an index into LEVELS) equal to value up to normalization, or None."""
+    return _CANONICAL[level].get(normalize_label(value))
+
+
+def lookup(department, service_type, request_category):
+    """The leaf equal to the triple up to normalization, or None."""
+    triple = tuple(canonical_label(level, value) for level, value in enumerate(
+        (department, service_type, request_category)))
+    return triple if triple in LEAVES else None
+
+
+def _similarities(level, value):
+    """Dice similarity of value to every label at level sharing at least one trigram with it."""
+    label = normalize_label(value)
+    if label in _CANONICAL[level]:
+        return {_CANONICAL[level][label]: 1.0}
+    grams = trigrams(label)
+    shared = defaultdict(int)
+    for gram in grams:
+        for candidate in _TRIGRAM_INDEX[level].get(gram, ()):
+            shared[candidate] += 1
+    return {
+        candidate: 2 * count / (len(grams) + len(_LABEL_TRIGRAMS[level][candidate]))
+        for candidate, count in shared.items()
+    }
+
+
+def snap(department, service_type, request_category, min_score=None):
+    """
+    Find the leaf closest to a possibly invalid triple.
+
+    Returns:
+        tuple: (leaf, score) with score in [0, 1]; leaf is None when no leaf reaches min_score
+            (TAXONOMY_SNAP_MIN_SCORE by default)
+    """
+    min_score = TAXONOMY_SNAP_MIN_SCORE if min_score is None else min_score
+    similarities = [_similarities(level, value) for level, value in enumerate(
+        (department, service_type, request_category))]
+
+    best, best_score = None, 0.0
+    for leaf in _LEAF_LIST:
+        score = sum(weight * similarity.get(label, 0.0)
+                    for weight, similarity, label in zip(LEVEL_WEIGHTS, similarities, leaf))
+        if score > best_score:
+            best, best_score = leaf, score
+    if best_score < min_score:
+        return None, best_score
+    return best, best_score
+
+
+def resolve(department, service_type, request_category):
+    """
+    Map a triple to a leaf of the taxonomy, as cheaply as possible.
+
+    Returns:
+        tuple: (leaf, how) where how is "exact", "normalized" or "snapped", or (None, "invalid")
+    """
+    if (department, service_type, request_category) in LEAVES:
+        return (department, service_type, request_category), "exact"
+    leaf = lookup(department, service_type, request_category)
+    if leaf is not None:
+        return leaf, "normalized"
+    leaf, _ = snap(department, service_type, request_category)
+    if leaf is not None:
+        return leaf, "snapped"
+    return None, "invalid"
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# The modules read their configuration at import time
+_state_dir = tempfile.mkdtemp(prefix="idea-ml-tests-")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("GROQ_BASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("TICKET_STORE_PATH", os.path.join(_state_dir, "tickets.db"))
+os.environ.setdefault("ROLLUPS_PATH", os.path.join(_state_dir, "rollups.npz"))
+os.environ.setdefault("FEEDBACK_STATS_PATH", os.path.join(_state_dir, "feedback_stats.npz"))
+os.environ.setdefault("OUTBOX_ENABLED", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+import classify
+
+
+def test_parse_language_accepts_a_code():
+    assert classify._parse_language(" Hi.\n", "model") == "hi"
+
+
+def test_parse_language_of_none_content_is_unknown():
+    assert classify._parse_language(None, "model") == "unknown"
+
+
+def test_detect_language_with_none_content_is_unknown(monkeypatch):
+    class NoContentGroq:
+        def __init__(self, api_key=None):
+            self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+        def create(self, **request):
+            message = SimpleNamespace(content=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    monkeypatch.setattr(classify, "Groq", NoContentGroq)
+    assert classify.detect_language("namaste") == "unknown"
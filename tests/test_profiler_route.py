@@ -0,0 +1,36 @@
+import os
+import pytest
+import app
+from profiler import profiler
+
+HEADERS = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch, tmp_path):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr("profiler.PROFILER_OUTPUT_DIR", str(tmp_path))
+    yield
+    profiler.stop()
+
+
+@pytest.mark.parametrize("fraction", ["half", None, 0, -1, "nan", [0.5]])
+def test_bad_fraction_is_a_client_error(fraction):
+    response = app.app.test_client().post("/admin/profiler", json={"fraction": fraction}, headers=HEADERS)
+    assert response.status_code == 400
+    assert not profiler.active
+
+
+def test_fraction_is_parsed_and_capped():
+    client = app.app.test_client()
+    response = client.post("/admin/profiler", json={"fraction": "0.5", "seconds": 1}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.get_json()["fraction"] == 0.5
+    profiler.stop()
+    response = client.post("/admin/profiler", json={"fraction": 3, "seconds": 1}, headers=HEADERS)
+    assert response.get_json()["fraction"] == 1.0
+
+
+def test_status_names_the_worker():
+    response = app.app.test_client().get("/admin/profiler", headers=HEADERS)
+    assert response.get_json()["pid"] == os.getpid()
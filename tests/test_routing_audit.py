@@ -0,0 +1,65 @@
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+import pytest
+import classify
+import routing
+
+
+class FakeGroq:
+    """Groq client whose completions all answer with one classification."""
+    answer = None
+
+    def __init__(self, api_key=None):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        message = SimpleNamespace(content=json.dumps(self.answer))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class InlineExecutor:
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+@pytest.fixture
+def audit(monkeypatch):
+    """Audit every small-tier classification inline and collect the overrides it counts."""
+    overrides = []
+    monkeypatch.setattr(classify, "Groq", FakeGroq)
+    monkeypatch.setattr(routing, "_get_audit_executor", lambda: InlineExecutor())
+    monkeypatch.setitem(routing.policy, "classify", {
+        **routing.policy["classify"], "audit_rate": 1.0, "escalate_to": "large",
+        "tiers": {**routing.policy["classify"]["tiers"], "large": "large-model"}
+    })
+    monkeypatch.setattr(routing, "record_routing_audit", lambda task, tier: None)
+    monkeypatch.setattr(routing, "record_routing_override", lambda task, tier, reason: overrides.append(reason))
+    return overrides
+
+
+ANSWER = classify.LLMClassification(
+    {"department": "loans", "service_type": "vehicle_loan", "subsubcategory": "union_car"}, "small-model")
+
+
+def _audit(reference):
+    FakeGroq.answer = reference
+    routing.maybe_audit("classify", "small", ANSWER,
+                        lambda model: classify._audit_classification("I want a car loan", model))
+
+
+def test_reference_spelled_differently_agrees(audit):
+    _audit({"department": "Loans", "service_type": "Vehicle Loans", "subsubcategory": "Union Car"})
+    assert audit == []
+
+
+def test_reference_with_another_leaf_is_an_override(audit):
+    _audit({"department": "investments", "service_type": "mutual_funds", "subsubcategory": "equity_funds"})
+    assert audit == ["audit"]
+
+
+def test_unusable_reference_is_not_counted(audit):
+    _audit({"department": "nothing like it", "service_type": "at all", "subsubcategory": "zzz"})
+    assert audit == []
@@ -0,0 +1,42 @@
+import asyncio
+import httpx
+import pytest
+import app
+import asgi
+
+TICKET_READS = ["/tickets", "/tickets/q-1", "/tickets/stats/department", "/tickets/stats/department/Loans",
+                "/tickets/export"]
+
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+
+@pytest.mark.parametrize("path", TICKET_READS)
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}])
+def test_flask_ticket_reads_need_the_admin_token(path, headers):
+    response = app.app.test_client().get(path, headers=headers)
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("path", TICKET_READS)
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}])
+def test_asgi_ticket_reads_need_the_admin_token(path, headers):
+    async def get():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers=headers)
+    assert asyncio.run(get()).status_code == 403
+
+
+def test_ticket_reads_without_admin_token_configured_are_refused(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN")
+    response = app.app.test_client().get("/tickets", headers={"X-Admin-Token": ""})
+    assert response.status_code == 403
+
+
+def test_ticket_reads_with_the_admin_token_are_served():
+    response = app.app.test_client().get("/tickets", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.get_json() == {"tickets": []}
@@ -0,0 +1,321 @@
+"""
+Append-only ticket store on SQLite in WAL mode.
+
+Every ticket the query endpoints produce is appended as one row: the routing fields the
+operations side filters on are columns with secondary indexes (query_id, department,
+priority, branch_id and created_at), and the full ticket is kept as JSON next to them.
+
+Writes use group commit: append() hands the ticket to a MicroBatcher whose single writer
+thread inserts everything that arrived within TICKET_STORE_WINDOW_MS (up to
+TICKET_STORE_BATCH_SIZE tickets) in one transaction, so a burst of tickets costs one WAL sync
+instead of one file and directory entry per ticket. Readers use their own connections and
+never block the writer. Several worker processes can share one database file; SQLite
+serializes their write transactions.
+
+append() does not wait for the commit. A crash can lose the tickets of the batch in flight,
+at most one window; pending batches are flushed at exit.
+
+Export the store with:
+    python ticket_store.py export --since 2026-01-01 > tickets.jsonl
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from datetime import datetime
+from batching import MicroBatcher
+from metrics import timed
+from outbox import attach_outbox
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Database file; an empty value disables ticket persistence
+TICKET_STORE_PATH = os.environ.get("TICKET_STORE_PATH", os.path.join("data", "tickets.db"))
+TICKET_STORE_WINDOW_MS = float(os.environ.get("TICKET_STORE_WINDOW_MS", 5))
+TICKET_STORE_BATCH_SIZE = int(os.environ.get("TICKET_STORE_BATCH_SIZE", 256))
+# NORMAL only syncs the WAL at checkpoints: a power loss may drop the last commits but never
+# corrupts the database. FULL syncs every commit.
+TICKET_STORE_SYNCHRONOUS = os.environ.get("TICKET_STORE_SYNCHRONOUS", "NORMAL")
+
+# Columns filled from the ticket of the same name; everything else stays in the JSON body
+INDEXED_FIELDS = ("ticket_id", "query_id", "department", "service_type", "request_category", "priority",
+                  "branch_id", "query_level", "query_type", "created_at")
+FILTER_FIELDS = ("department", "service_type", "request_category", "priority", "branch_id", "query_level",
+                 "query_type")
+
+EXPORT_FETCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id TEXT NOT NULL UNIQUE,
+    query_id TEXT,
+    department TEXT,
+    service_type TEXT,
+    request_category TEXT,
+    priority TEXT,
+    branch_id TEXT,
+    query_level TEXT,
+    query_type TEXT,
+    created_at REAL NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_query_id ON tickets (query_id);
+CREATE INDEX IF NOT EXISTS tickets_department ON tickets (department, created_at);
+CREATE INDEX IF NOT EXISTS tickets_priority ON tickets (priority, created_at);
+CREATE INDEX IF NOT EXISTS tickets_branch_id ON tickets (branch_id, created_at);
+CREATE INDEX IF NOT EXISTS tickets_created_at ON tickets (created_at);
+"""
+
+
+def new_ticket_id():
+    return f"TKT-{uuid.uuid4().hex[:16]}"
+
+
+def parse_time(value):
+    """Epoch seconds from a number or an ISO 8601 date/time string; None stays None."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+class TicketStore:
+    """
+    Tickets persisted in one SQLite database.
+
+    Args:
+        path (str): Database file, created with its directory if missing
+        window_ms (float): How long the writer waits for more tickets before committing
+        batch_size (int): Most tickets committed in one transaction
+    """
+    def __init__(self, path, window_ms=TICKET_STORE_WINDOW_MS, batch_size=TICKET_STORE_BATCH_SIZE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self._write_hooks = []
+        self._local = threading.local()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # One batch in flight at a time: the writer thread owns the write connection
+        self._batcher = MicroBatcher(self._write_batch, window_ms=window_ms, max_batch_size=batch_size,
+                                     max_concurrent_batches=1, name="ticket-store")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute(f"PRAGMA synchronous={TICKET_STORE_SYNCHRONOUS}")
+        connection.execute("PRAGMA busy_timeout=30000")
+        return connection
+
+    def _connection(self):
+        # One connection per thread (and per process, since threads do not survive a fork)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return connection
+
+    def append(self, ticket):
+        """
+        Queue a ticket for the next group commit. ticket_id and created_at are filled in when missing.
+
+        Returns:
+            Future: Resolves to the ticket_id once the ticket is committed
+        """
+        ticket = dict(ticket)
+        ticket.setdefault("ticket_id", new_ticket_id())
+        ticket.setdefault("created_at", time.time())
+        future = self._batcher.submit(ticket)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def flush(self, timeout=None):
+        """Wait until every ticket appended so far is committed."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    @staticmethod
+    def encode(ticket):
+        """The JSON body a ticket is stored (and delivered) as."""
+        return json.dumps(ticket, ensure_ascii=False, default=str)
+
+    @timed("ticket_store_commit")
+    def _write_batch(self, tickets):
+        rows = [
+            tuple(None if ticket.get(field) is None else str(ticket[field]) for field in INDEXED_FIELDS[:-1])
+            + (float(ticket["created_at"]), self.encode(ticket))
+            for ticket in tickets
+        ]
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-appending a ticket_id (a retried batch) keeps the first copy
+            connection.executemany(
+                f"INSERT OR IGNORE INTO tickets ({', '.join(INDEXED_FIELDS)}, body) "
+                f"VALUES ({', '.join('?' * (len(INDEXED_FIELDS) + 1))})",
+                rows
+            )
+            for hook in self._write_hooks:
+                hook(connection, tickets)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [ticket["ticket_id"] for ticket in tickets]
+
+    def add_write_hook(self, hook):
+        """
+        Run hook(connection, tickets) inside the write transaction of every batch, for rows that
+        must commit or roll back together with the tickets. The hook must only write.
+        """
+        self._write_hooks.append(hook)
+
+    def get(self, ticket_id):
+        """The ticket with this ticket_id, or None."""
+        row = self._connection().execute("SELECT body FROM tickets WHERE ticket_id = ?", (ticket_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def by_query_id(self, query_id):
+        """Tickets of a query_id, oldest first."""
+        cursor = self._connection().execute(
+            "SELECT body FROM tickets WHERE query_id = ? ORDER BY seq", (str(query_id),))
+        return [json.loads(body) for body, in cursor]
+
+    def _where(self, filters, since, until):
+        clauses, params = [], []
+        for field in FILTER_FIELDS:
+            if filters.get(field) is not None:
+                clauses.append(f"{field} = ?")
+                params.append(str(filters[field]))
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _check_filters(filters):
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown ticket filters: {', '.join(sorted(unknown))}")
+
+    def find(self, since=None, until=None, limit=100, **filters):
+        """
+        Newest tickets matching every given routing field and the [since, until) time range.
+
+        Args:
+            since (float): Epoch seconds, inclusive
+            until (float): Epoch seconds, exclusive
+            limit (int): Most tickets returned
+            **filters: Values for any of FILTER_FIELDS
+
+        Raises:
+            ValueError: On a filter that is not one of FILTER_FIELDS
+        """
+        self._check_filters(filters)
+        where, params = self._where(filters, since, until)
+        cursor = self._connection().execute(
+            f"SELECT body FROM tickets{where} ORDER BY created_at DESC, seq DESC LIMIT ?", params + [int(limit)])
+        return [json.loads(body) for body, in cursor]
+
+    def export(self, since=None, until=None, **filters):
+        """
+        Stream matching tickets as JSON lines in insertion order, without loading them all.
+        A snapshot read: tickets committed while exporting are not included.
+
+        Returns:
+            iterator: One ticket per line, newline terminated
+
+        Raises:
+            ValueError: On a filter that is not one of FILTER_FIELDS
+        """
+        self._check_filters(filters)
+        where, params = self._where(filters, since, until)
+        return self._stream(f"SELECT body FROM tickets{where} ORDER BY seq", params)
+
+    def _stream(self, sql, params):
+        # A connection of its own, so a slow consumer never holds a request thread's connection
+        connection = self._connect()
+        try:
+            cursor = connection.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for body, in rows:
+                    yield body + "\n"
+        finally:
+            connection.close()
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+
+
+_ticket_store = None
+_ticket_store_lock = threading.Lock()
+
+
+def get_ticket_store():
+    """Return the process-wide TicketStore, or None when TICKET_STORE_PATH is empty."""
+    global _ticket_store
+    if not TICKET_STORE_PATH:
+        return None
+    with _ticket_store_lock:
+        if _ticket_store is None:
+            _ticket_store = TicketStore(TICKET_STORE_PATH)
+            # Tickets for DEMO_SERVER_URL are queued in the same transaction that stores them
+            attach_outbox(_ticket_store)
+            atexit.register(_ticket_store.flush, 10)
+        return _ticket_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ticket store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write tickets as JSON lines to stdout")
+    export_parser.add_argument("--since", help="Epoch seconds or ISO date/time, inclusive")
+    export_parser.add_argument("--until", help="Epoch seconds or ISO date/time, exclusive")
+    for field in FILTER_FIELDS:
+        export_parser.add_argument(f"--{field.replace('_', '-')}", dest=field)
+    get_parser = subparsers.add_parser("get", help="Print the tickets of a query_id")
+    get_parser.add_argument("query_id")
+    args = parser.parse_args(argv)
+
+    store = TicketStore(TICKET_STORE_PATH)
+    if args.command == "export":
+        filters = {field: getattr(args, field) for field in FILTER_FIELDS}
+        sys.stdout.writelines(store.export(parse_time(args.since), parse_time(args.until), **filters))
+    else:
+        print(json.dumps(store.by_query_id(args.query_id), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())